@@ -0,0 +1,271 @@
+# alerts.py
+"""
+Règles d'alerte configurables, évaluées à l'écriture, et notifications.
+
+Types de règles (alert_rules.kind) :
+- stock_below : relevé de stock sous `threshold` (quantité)
+- stock_cover : rupture prévue dans moins de `threshold` jours (voir depletion.py)
+- price_jump  : variation d'au moins `threshold` % par rapport au prix précédent
+                du même produit sur le même marché
+
+Une règle peut viser un produit, une zone et/ou un département (vide = tous).
+Seules les séries produit × zone touchées par une écriture sont évaluées. Les
+règles actives du type concerné sont relues dans la transaction d'écriture
+(quelques lignes) : une règle créée ou désactivée sur un autre worker
+s'applique dès l'écriture suivante.
+
+Les notifications sont enregistrées par utilisateur (index user_id, read_at) ;
+get_notification (main.py) affiche la plus ancienne non lue à chaque page, et la
+page la marque lue une fois affichée (POST /api/notifications/{id}/read).
+"""
+from datetime import datetime
+
+from sqlalchemy import func, insert, select, update
+
+import hooks
+import models
+import outliers
+
+KINDS = ("stock_below", "stock_cover", "price_jump")
+STOCK_KINDS = ("stock_below", "stock_cover")
+
+
+class Rule:
+    """Règle active (instantané en mémoire, indépendant de la session)"""
+
+    __slots__ = ("id", "kind", "product_id", "zone_id", "department", "threshold", "user_id")
+
+    def __init__(self, row):
+        for attr in self.__slots__:
+            setattr(self, attr, getattr(row, attr))
+
+    def matches(self, product_id, zone_id, department):
+        return (
+            (self.product_id is None or self.product_id == product_id)
+            and (self.zone_id is None or self.zone_id == zone_id)
+            and (self.department is None or self.department == department)
+        )
+
+
+# ============================================
+# 1. RÈGLES
+# ============================================
+def active_rules(connection, kinds):
+    """Règles actives des types demandés, lues dans la transaction en cours"""
+    table = models.AlertRule
+    rows = connection.execute(
+        select(*(getattr(table, attr) for attr in Rule.__slots__))
+        .where(table.is_active.is_(True), table.kind.in_(kinds))
+    )
+    return [Rule(row) for row in rows]
+
+
+def names(connection, product_ids, zone_ids):
+    products = {
+        pid: (name, unit) for pid, name, unit in connection.execute(
+            select(models.Product.id, models.Product.name, models.Product.unit)
+            .where(models.Product.id.in_(product_ids))
+        )
+    }
+    zones = {
+        zid: (name, department) for zid, name, department in connection.execute(
+            select(models.Zone.id, models.Zone.name, models.Zone.department)
+            .where(models.Zone.id.in_(zone_ids))
+        )
+    }
+    return products, zones
+
+
+def _candidates(rules, items, zones):
+    """(objet, règle) pour chaque règle visant le produit et la zone de l'objet"""
+    pairs = []
+    for item in items:
+        department = zones.get(item.zone_id, (None, None))[1]
+        pairs.extend((item, rule) for rule in rules if rule.matches(item.product_id, item.zone_id, department))
+    return pairs
+
+
+# ============================================
+# 2. NOTIFICATIONS
+# ============================================
+def notify(session, events):
+    """Enregistre les notifications (rule, product_id, zone_id, type, message).
+
+    Une règle ne renotifie pas un utilisateur tant que la précédente
+    notification pour le même produit et la même zone n'a pas été lue.
+    """
+    if not events:
+        return 0
+    connection = session.connection()
+    table = models.Notification
+    pending = set(connection.execute(
+        select(table.user_id, table.rule_id, table.product_id, table.zone_id)
+        .where(table.read_at.is_(None), table.rule_id.in_({rule.id for rule, *_ in events}))
+    ).all())
+    everyone = None
+    now = datetime.now()
+    rows = []
+    for rule, product_id, zone_id, kind, message in events:
+        if rule.user_id is not None:
+            recipients = [rule.user_id]
+        else:
+            if everyone is None:
+                everyone = connection.execute(
+                    select(models.User.id).where(models.User.is_active.is_(True))
+                ).scalars().all()
+            recipients = everyone
+        for user_id in recipients:
+            key = (user_id, rule.id, product_id, zone_id)
+            if key in pending:
+                continue
+            pending.add(key)
+            rows.append({
+                "user_id": user_id, "rule_id": rule.id, "type": kind, "message": message[:300],
+                "product_id": product_id, "zone_id": zone_id, "created_at": now,
+            })
+    save_notifications(session, rows)
+    return len(rows)
+
+
+def save_notifications(session, rows):
+    """Insère des lignes notifications et les transmet aux crochets (diffusion en direct)"""
+    if not rows:
+        return
+    session.connection().execute(insert(models.Notification), rows)
+    changes = hooks.Changes()
+    changes.inserted.extend(rows)
+    hooks.dispatch(session, models.Notification, changes)
+
+
+def next_notification(db, user_id):
+    """Plus ancienne notification non lue (lecture seule)"""
+    table = models.Notification
+    return db.execute(
+        select(table.id, table.type, table.message)
+        .where(table.user_id == user_id, table.read_at.is_(None))
+        .order_by(table.id)
+        .limit(1)
+    ).first()
+
+
+def mark_read(db, user_id, notification_id):
+    """Marque lue une notification de l'utilisateur ; False si elle n'existe pas"""
+    table = models.Notification
+    result = db.execute(
+        update(table)
+        .where(table.id == notification_id, table.user_id == user_id)
+        .values(read_at=func.coalesce(table.read_at, datetime.now()))
+    )
+    db.commit()
+    return result.rowcount > 0
+
+
+def list_notifications(db, user_id, unread_only=False, limit=50):
+    table = models.Notification
+    query = select(table).where(table.user_id == user_id).order_by(table.id.desc()).limit(limit)
+    if unread_only:
+        query = query.where(table.read_at.is_(None))
+    return db.execute(query).scalars().all()
+
+
+# ============================================
+# 3. ÉVALUATION À L'ÉCRITURE
+# ============================================
+@hooks.on_flush(models.Stock, priority=150)
+def evaluate_stock_rules(session, changes):
+    # Après depletion (priorité 100) : stock_projections est déjà à jour
+    stocks = [s for s in changes.inserted + changes.updated if s.product_id and s.zone_id]
+    if not stocks:
+        return
+    connection = session.connection()
+    rules = active_rules(connection, STOCK_KINDS)
+    if not rules:
+        return
+    products, zones = names(connection, {s.product_id for s in stocks}, {s.zone_id for s in stocks})
+    candidates = _candidates(rules, stocks, zones)
+    if not candidates:
+        return
+
+    cover_keys = {(s.product_id, s.zone_id) for s, rule in candidates if rule.kind == "stock_cover"}
+    projections = _projections(connection, cover_keys) if cover_keys else {}
+
+    events = []
+    for stock, rule in candidates:
+        product_name, unit = products.get(stock.product_id, ("?", ""))
+        zone_name = zones.get(stock.zone_id, ("?", None))[0]
+        if rule.kind == "stock_below" and stock.quantity is not None and stock.quantity < rule.threshold:
+            events.append((rule, stock.product_id, stock.zone_id, "warning",
+                           f"Stock faible : {product_name} à {zone_name} "
+                           f"({stock.quantity:.0f} {unit} < {rule.threshold:.0f})"))
+        elif rule.kind == "stock_cover":
+            stockout = projections.get((stock.product_id, stock.zone_id))
+            if stockout is None:
+                continue
+            days_left = max((stockout - datetime.now()).total_seconds() / 86400, 0.0)
+            if days_left < rule.threshold:
+                events.append((rule, stock.product_id, stock.zone_id, "error",
+                               f"Rupture prévue : {product_name} à {zone_name} dans {days_left:.0f} j "
+                               f"(vers le {stockout.strftime('%d/%m')})"))
+    notify(session, events)
+
+
+def _projections(connection, keys):
+    """{(produit, zone): date de rupture estimée}"""
+    table = models.StockProjection
+    rows = connection.execute(
+        select(table.product_id, table.zone_id, table.stockout_date)
+        .where(table.product_id.in_({p for p, _ in keys}), table.stockout_date.isnot(None))
+    )
+    return {(p, z): stockout for p, z, stockout in rows if (p, z) in keys}
+
+
+def _previous_price(connection, price):
+    """Prix précédent du même produit sur le même marché (hors quarantaine)"""
+    table = models.Price
+    return connection.execute(
+        select(table.price)
+        .where(
+            table.product_id == price.product_id,
+            table.zone_id == price.zone_id,
+            table.date <= price.date,
+            table.id != price.id,
+            table.id.notin_(outliers.quarantined_ids()),
+        )
+        .order_by(table.date.desc(), table.id.desc())
+        .limit(1)
+    ).scalar()
+
+
+@hooks.on_flush(models.Price, priority=150)
+def evaluate_price_rules(session, changes):
+    # Les prix mis en quarantaine (outliers.py, priorité 50) ne déclenchent rien
+    quarantined = {o["price_id"] for o in session.info.get("price_outliers", [])}
+    prices = [
+        p for p in changes.inserted
+        if p.product_id and p.zone_id and p.price and p.id not in quarantined
+    ]
+    if not prices:
+        return
+    connection = session.connection()
+    rules = active_rules(connection, ("price_jump",))
+    if not rules:
+        return
+    products, zones = names(connection, {p.product_id for p in prices}, {p.zone_id for p in prices})
+
+    events = []
+    previous = {}
+    for price, rule in _candidates(rules, prices, zones):
+        if price.id not in previous:
+            previous[price.id] = _previous_price(connection, price)
+        before = previous[price.id]
+        if not before:
+            continue
+        change = (price.price / before - 1) * 100
+        if abs(change) >= rule.threshold:
+            product_name = products.get(price.product_id, ("?", ""))[0]
+            zone_name = zones.get(price.zone_id, ("?", None))[0]
+            label = "Hausse" if change > 0 else "Baisse"
+            events.append((rule, price.product_id, price.zone_id, "warning" if change > 0 else "info",
+                           f"{label} de prix : {product_name} à {zone_name} {change:+.0f} % "
+                           f"({before:.0f} → {price.price:.0f} FCFA)"))
+    notify(session, events)
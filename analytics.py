@@ -0,0 +1,192 @@
+# analytics.py
+"""
+Indicateurs de prix vectorisés (NumPy) pour toutes les séries produit × zone.
+
+Les prix moyens journaliers (price_daily) sont chargés dans une matrice
+séries × jours (NaN quand il n'y a pas d'observation). Moyennes mobiles,
+écarts-types mobiles, coefficients de variation, variations en % et z-scores
+sont ensuite calculés en une seule passe pour toutes les séries, sans boucle
+Python sur les objets ORM.
+"""
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import select
+
+import models
+import rollups
+
+
+class PriceMatrix:
+    """Prix moyens journaliers : une ligne par série (produit, zone), une colonne par jour"""
+
+    def __init__(self, product_ids, zone_ids, first_day, values):
+        self.product_ids = product_ids
+        self.zone_ids = zone_ids
+        self.first_day = first_day
+        self.values = values
+
+    @property
+    def days(self):
+        return [self.first_day + timedelta(days=i) for i in range(self.values.shape[1])]
+
+    def __len__(self):
+        return self.values.shape[0]
+
+
+# ============================================
+# 1. CHARGEMENT
+# ============================================
+def load_arrays(connection, start, end, product_id=None, department=None):
+    """Observations (produit, zone, jour, prix moyen) en tableaux contigus triés par série"""
+    daily = models.PriceDaily
+    query = select(daily.product_id, daily.zone_id, daily.day, daily.total, daily.count)\
+        .where(daily.day >= start, daily.day <= end)\
+        .order_by(daily.product_id, daily.zone_id, daily.day)
+    if product_id:
+        query = query.where(daily.product_id == product_id)
+    if department:
+        query = query.where(daily.zone_id.in_(
+            select(models.Zone.id).where(models.Zone.department == department)
+        ))
+    rows = connection.execute(query).all()
+
+    count = len(rows)
+    products = np.empty(count, dtype=np.int64)
+    zones = np.empty(count, dtype=np.int64)
+    days = np.empty(count, dtype=np.int64)
+    prices = np.empty(count, dtype=np.float64)
+    for i, (product, zone, day, total, n) in enumerate(rows):
+        products[i] = product
+        zones[i] = zone
+        days[i] = rollups.day_of(day).toordinal()
+        prices[i] = total / n
+    return products, zones, days, prices
+
+
+def load_matrix(connection, days=90, end=None, product_id=None, department=None):
+    """Matrice séries × jours sur les `days` derniers jours (jusqu'à `end` inclus)"""
+    end = end or date.today()
+    start = end - timedelta(days=days - 1)
+    products, zones, ordinals, prices = load_arrays(connection, start, end, product_id, department)
+
+    # Début de chaque série = changement de (produit, zone) dans les lignes triées
+    if len(products):
+        starts = np.flatnonzero(np.r_[True, (products[1:] != products[:-1]) | (zones[1:] != zones[:-1])])
+    else:
+        starts = np.empty(0, dtype=np.int64)
+    row_of = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(products)]))
+
+    values = np.full((len(starts), days), np.nan)
+    values[row_of, ordinals - start.toordinal()] = prices
+    return PriceMatrix(products[starts], zones[starts], start, values)
+
+
+# ============================================
+# 2. CALCULS VECTORISÉS (axe 1 = temps)
+# ============================================
+def _rolling_sums(values, window):
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+    zeros = np.zeros((values.shape[0], 1))
+    csum = np.concatenate([zeros, np.cumsum(filled, axis=1)], axis=1)
+    csq = np.concatenate([zeros, np.cumsum(filled * filled, axis=1)], axis=1)
+    ccount = np.concatenate([zeros, np.cumsum(present, axis=1)], axis=1)
+    lagged = np.maximum(np.arange(1, values.shape[1] + 1) - window, 0)
+    sums = csum[:, 1:] - csum[:, lagged]
+    squares = csq[:, 1:] - csq[:, lagged]
+    counts = ccount[:, 1:] - ccount[:, lagged]
+    return sums, squares, counts
+
+
+def rolling_mean(values, window, min_periods=1):
+    """Moyenne mobile sur `window` jours (observations manquantes ignorées)"""
+    sums, _, counts = _rolling_sums(values, window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts >= min_periods, sums / counts, np.nan)
+
+
+def rolling_std(values, window, min_periods=2):
+    """Écart-type mobile (échantillon, ddof=1) sur `window` jours"""
+    sums, squares, counts = _rolling_sums(values, window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        variance = (squares - sums * sums / counts) / (counts - 1)
+    return np.where(counts >= min_periods, np.sqrt(np.clip(variance, 0, None)), np.nan)
+
+
+def forward_fill(values):
+    """Propage la dernière observation connue vers la droite"""
+    present = ~np.isnan(values)
+    index = np.where(present, np.arange(values.shape[1]), 0)
+    np.maximum.accumulate(index, axis=1, out=index)
+    filled = values[np.arange(values.shape[0])[:, None], index]
+    # Avant la première observation il n'y a rien à propager
+    filled[~np.maximum.accumulate(present, axis=1)] = np.nan
+    return filled
+
+
+def pct_change(values, periods=1):
+    """Variation en % sur `periods` jours (dernière observation connue à chaque date)"""
+    filled = forward_fill(values)
+    result = np.full(filled.shape, np.nan)
+    if periods < filled.shape[1]:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result[:, periods:] = (filled[:, periods:] / filled[:, :-periods] - 1) * 100
+    return result
+
+
+# ============================================
+# 3. INDICATEURS PAR SÉRIE
+# ============================================
+def indicators(matrix, window=14, change_periods=7):
+    """Indicateurs à la dernière date pour chaque série, sous forme de tableaux"""
+    values = matrix.values
+    mean = rolling_mean(values, window)[:, -1]
+    std = rolling_std(values, window)[:, -1]
+    latest = forward_fill(values)[:, -1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cv = std / mean * 100
+        zscore = (latest - mean) / std
+    change = pct_change(values, change_periods)[:, -1]
+    observations = np.count_nonzero(~np.isnan(values[:, -window:]), axis=1)
+    return {
+        "latest": latest,
+        "mean": mean,
+        "std": std,
+        "cv": cv,
+        "zscore": zscore,
+        "pct_change": change,
+        "observations": observations,
+    }
+
+
+def _clean(value, digits=2):
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+
+def volatility_ranking(connection, days=90, window=14, change_periods=7, limit=20,
+                       product_id=None, department=None, min_observations=3):
+    """Séries les plus volatiles (coefficient de variation décroissant)"""
+    matrix = load_matrix(connection, days=days, product_id=product_id, department=department)
+    stats = indicators(matrix, window=window, change_periods=change_periods)
+    eligible = np.flatnonzero((stats["observations"] >= min_observations) & ~np.isnan(stats["cv"]))
+    order = eligible[np.argsort(-stats["cv"][eligible], kind="stable")][:limit]
+
+    product_names = dict(connection.execute(select(models.Product.id, models.Product.name)).all())
+    zone_names = dict(connection.execute(select(models.Zone.id, models.Zone.name)).all())
+    return [
+        {
+            "product_id": int(matrix.product_ids[i]),
+            "product_name": product_names.get(int(matrix.product_ids[i])),
+            "zone_id": int(matrix.zone_ids[i]),
+            "zone_name": zone_names.get(int(matrix.zone_ids[i])),
+            "latest": _clean(stats["latest"][i]),
+            "mean": _clean(stats["mean"][i]),
+            "std": _clean(stats["std"][i]),
+            "cv": _clean(stats["cv"][i]),
+            "zscore": _clean(stats["zscore"][i]),
+            "pct_change": _clean(stats["pct_change"][i]),
+            "observations": int(stats["observations"][i]),
+        }
+        for i in order
+    ]
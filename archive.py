@@ -0,0 +1,398 @@
+# archive.py
+"""
+Archivage des relevés anciens (prices, stocks) en fichiers Parquet compressés.
+
+Les relevés de plus de ARCHIVE_SEASONS saisons agricoles (2 par défaut, en
+plus de la saison en cours) ne sont presque plus lus mais alourdissent index
+et sauvegardes. Une tâche quotidienne (ARCHIVE_ENABLED=1) les déplace, mois
+par mois, dans
+
+    archives/prices/year=2024/month=03/<uuid>.parquet   (zstd, découpage Hive)
+
+puis les supprime de la base. Restent en base :
+- le dernier relevé de chaque série produit × zone (derniers prix, stock
+  courant, projections de rupture) ;
+- les prix aberrants pas encore acceptés (outliers.py).
+
+L'agrégat journalier price_daily des jours archivés est recalculé juste
+avant la suppression puis conservé : séries, indices et prévisions n'ont pas
+besoin des relevés bruts. Lectures transparentes :
+- observations() (API /api/prices et /api/stocks) et batches() lisent les
+  archives quand la période demandée remonte avant la date d'archivage ;
+  seuls les répertoires des mois concernés sont ouverts ;
+- rollups.py ajoute les agrégats archivés quand il recalcule un jour ancien.
+
+Un fichier est écrit sous un nom caché (.<uuid>.parquet, ignoré des
+lectures), les lignes sont supprimées, la transaction validée, puis le
+fichier renommé. Après un arrêt brutal, recover() publie les fichiers dont
+les lignes ont quitté la base et efface les autres.
+
+    python archive.py          # archive tout de suite (sans attendre la tâche)
+
+Sans pyarrow, l'archivage est désactivé.
+"""
+import glob
+import json
+import os
+import uuid
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import DateTime, Float, Integer, delete, func, select
+
+import jobs
+import models
+import outliers
+import rollups
+import search
+import series
+from partitions import add_months, month_start
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    AVAILABLE = True
+except ImportError:
+    AVAILABLE = False
+
+ENABLED = os.environ.get("ARCHIVE_ENABLED", "0") == "1"
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "archives"))
+SEASONS = int(os.environ.get("ARCHIVE_SEASONS", "2"))
+INTERVAL = int(os.environ.get("ARCHIVE_INTERVAL", "86400"))
+COMPRESSION = os.environ.get("ARCHIVE_COMPRESSION", "zstd")
+BATCH = 500  # identifiants par DELETE ... IN
+BATCH_ROWS = 65536  # lignes par lot Arrow à la lecture
+
+MODELS = (models.Price, models.Stock)
+MANIFEST = "_manifest.json"  # {table: {"until": date ISO, "rows": n, "files": n, "archived_at": ...}}
+
+_manifest = {"mtime": None, "data": {}}
+
+if ENABLED and not AVAILABLE:
+    print("⚠️  pyarrow N'EST PAS installé - archivage désactivé")
+
+
+def cutoff(today=None):
+    """Premier jour gardé en base : début de la saison SEASONS saisons avant la saison en cours"""
+    start = series.season_start(today or date.today())
+    for _ in range(SEASONS):
+        start = series.season_start(start - timedelta(days=1))
+    return start
+
+
+def start_of(day):
+    """Début du jour (borne incluse sur une colonne DateTime)"""
+    return datetime.combine(day, datetime.min.time())
+
+
+def end_of(day):
+    """Début du lendemain (borne exclue) : `day` est inclus en entier"""
+    return start_of(day + timedelta(days=1))
+
+
+# ============================================
+# 1. MANIFESTE
+# ============================================
+def manifest():
+    """Contenu du manifeste (relu seulement si le fichier a changé : plusieurs processus le lisent)"""
+    path = os.path.join(ARCHIVE_DIR, MANIFEST)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    if mtime != _manifest["mtime"]:
+        with open(path, encoding="utf-8") as f:
+            _manifest["data"] = json.load(f)
+        _manifest["mtime"] = mtime
+    return _manifest["data"]
+
+
+def _save_manifest(data):
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(ARCHIVE_DIR, MANIFEST)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def archived_until(model):
+    """Date avant laquelle des relevés de `model` peuvent se trouver dans les archives (None : aucune)"""
+    entry = manifest().get(model.__tablename__)
+    return date.fromisoformat(entry["until"]) if entry else None
+
+
+def covers(model, start):
+    """Vrai si une lecture à partir de `start` (None : depuis le début) doit aussi lire les archives"""
+    until = archived_until(model)
+    return AVAILABLE and until is not None and (start is None or start < until)
+
+
+# ============================================
+# 2. LECTURE
+# ============================================
+def _arrow_type(column):
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, DateTime):
+        return pa.timestamp("us")
+    return pa.string()
+
+
+def schema(model):
+    """Schéma Arrow des colonnes du modèle"""
+    return pa.schema([(column.name, _arrow_type(column)) for column in model.__table__.columns])
+
+
+def _dataset(model):
+    path = os.path.join(ARCHIVE_DIR, model.__tablename__)
+    if not os.path.isdir(path):
+        return None
+    keys = pa.schema([("year", pa.int16()), ("month", pa.int8())])
+    return ds.dataset(
+        path,
+        schema=pa.unify_schemas([schema(model), keys]),
+        format="parquet",
+        partitioning=ds.partitioning(keys, flavor="hive"),
+    )
+
+
+def _filter(start=None, end=None, product_id=None, zone_id=None):
+    """Filtre Arrow : mois (répertoires écartés sans être ouverts), puis date et série"""
+    year, month, column = ds.field("year"), ds.field("month"), ds.field("date")
+    conditions = []
+    if start:
+        conditions.append((year > start.year) | ((year == start.year) & (month >= start.month)))
+        conditions.append(column >= pa.scalar(start_of(start), pa.timestamp("us")))
+    if end:
+        conditions.append((year < end.year) | ((year == end.year) & (month <= end.month)))
+        conditions.append(column < pa.scalar(end_of(end), pa.timestamp("us")))
+    if product_id:
+        conditions.append(ds.field("product_id") == product_id)
+    if zone_id:
+        conditions.append(ds.field("zone_id") == zone_id)
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def batches(model, start=None, end=None, product_id=None, zone_id=None, columns=None):
+    """Lots Arrow (RecordBatch) des relevés archivés de la période (bornes incluses), mois après mois"""
+    dataset = _dataset(model) if AVAILABLE else None
+    if dataset is None:
+        return
+    columns = columns or [column.name for column in model.__table__.columns]
+    yield from dataset.to_batches(
+        columns=columns, filter=_filter(start, end, product_id, zone_id), batch_size=BATCH_ROWS
+    )
+
+
+def _table(model, start=None, end=None, columns=None, **filters):
+    dataset = _dataset(model) if AVAILABLE else None
+    if dataset is None:
+        return None
+    columns = columns or [column.name for column in model.__table__.columns]
+    return dataset.to_table(columns=columns, filter=_filter(start, end, **filters))
+
+
+def rows(model, start=None, end=None):
+    """Relevés archivés de la période, en dictionnaires (par identifiant croissant)"""
+    table = _table(model, start, end)
+    if table is None:
+        return []
+    return table.sort_by("id").to_pylist()
+
+
+def observations(db, model, start=None, end=None):
+    """Relevés de la période (bornes incluses) : archives puis base, comme si rien n'avait été archivé"""
+    query = db.query(model)
+    if start:
+        query = query.filter(model.date >= start_of(start))
+    if end:
+        query = query.filter(model.date < end_of(end))
+    current = query.all()
+    if not covers(model, start):
+        return current
+    return rows(model, start, end) + current
+
+
+def price_aggregates(start=None, end=None, product_ids=None):
+    """{(product_id, zone_id, jour): (somme, nombre, min, max)} des prix archivés"""
+    table = _table(models.Price, start, end, columns=["id", "product_id", "zone_id", "price", "date"])
+    if table is None or not table.num_rows:
+        return {}
+    if product_ids is not None:
+        table = table.filter(pc.is_in(table["product_id"], value_set=pa.array(list(product_ids), pa.int64())))
+    table = table.append_column("day", pc.cast(table["date"], pa.date32()))
+    grouped = table.group_by(["product_id", "zone_id", "day"]).aggregate([
+        ("price", "sum"), ("id", "count"), ("price", "min"), ("price", "max"),
+    ])
+    names = ("product_id", "zone_id", "day", "price_sum", "id_count", "price_min", "price_max")
+    return {
+        (product_id, zone_id, day): (total, count, min_price, max_price)
+        for product_id, zone_id, day, total, count, min_price, max_price
+        in zip(*(grouped[name].to_pylist() for name in names))
+    }
+
+
+# ============================================
+# 3. ARCHIVAGE
+# ============================================
+def _kept_ids(connection, model):
+    """Relevés gardés en base : le dernier de chaque série, et les prix aberrants non acceptés"""
+    ranked = select(
+        model.id,
+        func.row_number().over(
+            partition_by=(model.product_id, model.zone_id),
+            order_by=(model.date.desc(), model.id.desc()),
+        ).label("rank"),
+    ).subquery()
+    kept = set(connection.execute(select(ranked.c.id).where(ranked.c.rank == 1)).scalars())
+    if model is models.Price:
+        outlier = models.PriceOutlier
+        kept.update(connection.execute(
+            select(outlier.price_id).where(outlier.status != outliers.ACCEPTED)
+        ).scalars())
+    return kept
+
+
+def _write(model, month, records):
+    """Écrit un fichier caché (pas encore visible des lectures) ; renvoie son chemin"""
+    directory = os.path.join(ARCHIVE_DIR, model.__tablename__, f"year={month.year}", f"month={month.month:02d}")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f".{uuid.uuid4().hex}.parquet")
+    pq.write_table(pa.Table.from_pylist(records, schema=schema(model)), path, compression=COMPRESSION)
+    return path
+
+
+def _publish(path):
+    directory, name = os.path.split(path)
+    os.replace(path, os.path.join(directory, name.lstrip(".")))
+
+
+def _archive_month(engine, model, month, until, kept):
+    """Archive un mois de relevés ; renvoie le nombre de lignes archivées"""
+    table = model.__table__
+    end = min(add_months(month, 1), until)
+    path = None
+    try:
+        with engine.begin() as conn:
+            result = conn.execute(
+                select(table).where(model.date >= start_of(month), model.date < start_of(end))
+                .order_by(model.date, model.id)
+            ).mappings()
+            records = [dict(row) for row in result if row["id"] not in kept]
+            if not records:
+                return 0
+            if model is models.Price:
+                # Agrégat journalier à jour avant que les relevés ne quittent la base
+                rollups.refresh(conn, {
+                    (r["product_id"], r["zone_id"], rollups.day_of(r["date"])) for r in records
+                })
+            path = _write(model, month, records)
+            ids = [r["id"] for r in records]
+            documents = models.SearchDocument
+            kind = search.SOURCES[model][0]
+            for offset in range(0, len(ids), BATCH):
+                batch = ids[offset:offset + BATCH]
+                conn.execute(delete(table).where(table.c.id.in_(batch)))
+                conn.execute(delete(documents).where(documents.kind == kind, documents.ref_id.in_(batch)))
+    except Exception:
+        if path and os.path.exists(path):
+            os.remove(path)
+        raise
+    _publish(path)
+    return len(records)
+
+
+def archive_table(engine, model, until):
+    """Archive les relevés de `model` antérieurs à `until` ; renvoie (lignes, fichiers)"""
+    with engine.connect() as conn:
+        first = conn.execute(select(func.min(model.date)).where(model.date < start_of(until))).scalar()
+        if first is None:
+            return 0, 0
+        kept = _kept_ids(conn, model)
+    archived = files = 0
+    month = month_start(rollups.day_of(first))
+    while month < until:
+        count = _archive_month(engine, model, month, until, kept)
+        archived += count
+        files += 1 if count else 0
+        month = add_months(month, 1)
+    return archived, files
+
+
+def recover(engine):
+    """Fichiers cachés laissés par un arrêt brutal : publiés si leurs lignes ont quitté
+    la base (transaction validée), effacés sinon ; renvoie le nombre de fichiers publiés"""
+    published = 0
+    for model in MODELS:
+        pattern = os.path.join(ARCHIVE_DIR, model.__tablename__, "year=*", "month=*", ".*.parquet")
+        for path in glob.glob(pattern):
+            try:
+                ids = pq.read_table(path, columns=["id"])["id"].to_pylist()
+            except Exception:
+                ids = None  # écriture interrompue : la transaction n'a pas été validée
+            remaining = ids is None
+            with engine.connect() as conn:
+                for offset in range(0, len(ids or []), BATCH):
+                    batch = ids[offset:offset + BATCH]
+                    if conn.execute(select(model.id).where(model.id.in_(batch)).limit(1)).first():
+                        remaining = True
+                        break
+            if remaining:
+                os.remove(path)
+            else:
+                _publish(path)
+                published += 1
+    return published
+
+
+def run(engine, today=None):
+    """Archive les relevés antérieurs à cutoff() ; renvoie {table: lignes archivées}"""
+    if not AVAILABLE:
+        return {}
+    until = cutoff(today)
+    recover(engine)
+    data = dict(manifest())
+    # Les lectures consultent les archives avant même la fin de l'archivage :
+    # aucune ligne n'est introuvable pendant le déplacement
+    for model in MODELS:
+        entry = data.setdefault(model.__tablename__, {"until": until.isoformat(), "rows": 0, "files": 0})
+        entry["until"] = max(entry["until"], until.isoformat())
+    _save_manifest(data)
+
+    archived = {}
+    for model in MODELS:
+        count, files = archive_table(engine, model, until)
+        archived[model.__tablename__] = count
+        if count:
+            entry = data[model.__tablename__]
+            entry["rows"] += count
+            entry["files"] += files
+            entry["archived_at"] = datetime.now().isoformat(timespec="seconds")
+            _save_manifest(data)
+    return archived
+
+
+@jobs.every(INTERVAL if ENABLED and AVAILABLE else 0, name="archivage", delay=60)
+def scheduled_archive():
+    from database import engine
+
+    archived = run(engine)
+    if any(archived.values()):
+        details = ", ".join(f"{table}: {count}" for table, count in archived.items())
+        print(f"🗄️ Relevés archivés en Parquet ({details})")
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    if not AVAILABLE:
+        raise SystemExit("❌ pyarrow est nécessaire : pip install pyarrow")
+    models.Base.metadata.create_all(bind=engine)
+    archived = run(engine)
+    print(f"✅ Archivage jusqu'au {cutoff().isoformat()} : {archived}")
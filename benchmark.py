@@ -0,0 +1,516 @@
+# benchmark.py
+"""
+Banc de mesure HTTP des routes les plus sollicitées.
+
+Exemples :
+    python benchmark.py --scale 10k
+    python benchmark.py --scale 1m --db postgres --pg-url postgresql://localhost/agrisuivi_bench
+    python benchmark.py --scale 10k --output bench_baseline.json
+    python benchmark.py --scale 10k --compare bench_baseline.json --tolerance 0.25
+    python benchmark.py --scale 1m --workers 1 2 4 8 --clients 32
+
+Le script génère (une seule fois) un jeu de données de la taille demandée,
+démarre l'application dans un sous-processus uvicorn pointé sur cette base,
+puis envoie des requêtes authentifiées en parallèle sur chaque route.
+Pour chaque route on mesure p50/p95/p99, le débit et le nombre de requêtes SQL
+par appel HTTP. Le résultat est écrit en JSON ; avec --compare, le script
+échoue (code 1) si une route régresse au-delà de la tolérance.
+
+Avec --workers, l'application est lancée par serve.py (serveur de
+production) successivement avec chaque nombre de workers, et seul le débit
+est comparé : gain par rapport au premier nombre de workers, par route.
+Prévoir assez de --clients pour occuper tous les workers.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# ============================================
+# CONFIGURATION
+# ============================================
+SCALES = {
+    "10k": 10_000,
+    "1m": 1_000_000,
+    "10m": 10_000_000,
+}
+
+ROUTES = [
+    "/dashboard",
+    "/stocks",
+    "/prices",
+    "/prices/latest",
+    "/api/products",
+    "/api/zones",
+    "/api/stocks",
+    "/api/prices",
+    "/api/stats",
+]
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = os.path.join(BASE_DIR, "bench_data")
+BENCH_EMAIL = "bench@agrisuivi.bj"
+CHUNK_SIZE = 20_000
+
+PRODUCTS_COUNT = 60
+ZONES_COUNT = 300
+CATEGORIES = ["Céréale", "Légume", "Tubercule", "Légumineuse", "Oléagineux", "Épice", "Fruit"]
+UNITS = ["kg", "sac", "tas", "bassine"]
+DEPARTMENTS = [
+    "Alibori", "Atacora", "Atlantique", "Borgou", "Collines", "Couffo",
+    "Donga", "Littoral", "Mono", "Ouémé", "Plateau", "Zou",
+]
+ZONE_TYPES = ["Marché", "Dépôt", "Commune", "Arrondissement"]
+
+
+# ============================================
+# 1. GÉNÉRATION DES JEUX DE DONNÉES
+# ============================================
+def dataset_url(db, scale, pg_url):
+    """URL de la base de test pour un moteur et une échelle donnés"""
+    if db == "postgres":
+        return pg_url
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    return "sqlite:///" + os.path.join(BENCH_DIR, f"agriculture_{scale}.db")
+
+
+def generate_dataset(url, rows, seed=42):
+    """Crée le schéma et remplit la base avec `rows` prix et `rows` stocks.
+
+    La génération est ignorée si la base contient déjà le bon volume, ce qui
+    permet de relancer le banc sans tout régénérer.
+    """
+    os.environ["DATABASE_URL"] = url
+    from sqlalchemy import create_engine, func, insert, select
+    import models
+    from auth import get_password_hash
+
+    connect_args = {"check_same_thread": False} if url.startswith("sqlite") else {}
+    engine = create_engine(url, connect_args=connect_args)
+    models.Base.metadata.create_all(bind=engine)
+
+    with engine.connect() as conn:
+        existing = conn.execute(select(func.count()).select_from(models.Price.__table__)).scalar()
+    if existing == rows:
+        print(f"⏩ Jeu de données déjà présent ({rows} lignes)")
+        engine.dispose()
+        return
+
+    print(f"🌱 Génération de {rows} prix et {rows} stocks...")
+    rng = random.Random(seed)
+    start = time.perf_counter()
+
+    with engine.begin() as conn:
+        # Tables dérivées vidées aussi : elles sont reconstruites au démarrage du serveur
+        derived = (models.PriceDaily, models.PriceIndex, models.PriceIndexBase,
+                   models.PriceStats, models.PriceOutlier, models.PriceForecast,
+                   models.LatestPrice, models.PriceSpread, models.StockProjection,
+                   models.SearchDocument)
+        for table in derived + (models.Price, models.Stock, models.Product, models.Zone, models.User):
+            conn.execute(table.__table__.delete())
+
+        conn.execute(insert(models.User.__table__), [{
+            "username": "bench",
+            "email": BENCH_EMAIL,
+            "hashed_password": get_password_hash("bench123"),
+            "is_active": True,
+            "is_admin": True,
+            "created_at": datetime.now(),
+        }])
+        conn.execute(insert(models.Product.__table__), [{
+            "name": f"Produit {i:03d}",
+            "category": CATEGORIES[i % len(CATEGORIES)],
+            "unit": UNITS[i % len(UNITS)],
+            "description": f"Produit de test {i}",
+            "created_at": datetime.now(),
+        } for i in range(1, PRODUCTS_COUNT + 1)])
+        conn.execute(insert(models.Zone.__table__), [{
+            "name": f"Marché {i:04d}",
+            "type": ZONE_TYPES[i % len(ZONE_TYPES)],
+            "department": DEPARTMENTS[i % len(DEPARTMENTS)],
+            "city": f"Ville {i % 77}",
+            "created_at": datetime.now(),
+        } for i in range(1, ZONES_COUNT + 1)])
+
+    product_ids = list(range(1, PRODUCTS_COUNT + 1))
+    zone_ids = list(range(1, ZONES_COUNT + 1))
+    base_prices = {pid: rng.uniform(150, 9000) for pid in product_ids}
+    horizon = timedelta(days=3 * 365)
+    now = datetime.now()
+
+    def rows_for(model):
+        for offset in range(0, rows, CHUNK_SIZE):
+            batch = []
+            for _ in range(min(CHUNK_SIZE, rows - offset)):
+                pid = rng.choice(product_ids)
+                row = {
+                    "product_id": pid,
+                    "zone_id": rng.choice(zone_ids),
+                    "date": now - horizon * rng.random(),
+                    "notes": None,
+                    "created_by": 1,
+                }
+                if model is models.Price:
+                    row["price"] = round(base_prices[pid] * rng.uniform(0.7, 1.3), 0)
+                else:
+                    row["quantity"] = round(rng.uniform(5, 5000), 2)
+                batch.append(row)
+            yield batch
+
+    for model in (models.Price, models.Stock):
+        done = 0
+        for batch in rows_for(model):
+            with engine.begin() as conn:
+                conn.execute(insert(model.__table__), batch)
+            done += len(batch)
+            if done % (CHUNK_SIZE * 10) == 0 or done == rows:
+                print(f"  ✓ {model.__tablename__}: {done}/{rows}")
+
+    engine.dispose()
+    print(f"✅ Jeu de données généré en {time.perf_counter() - start:.1f}s")
+
+
+# ============================================
+# 2. SERVEUR INSTRUMENTÉ (sous-processus)
+# ============================================
+def serve(port):
+    """Démarre l'application avec un compteur de requêtes SQL.
+
+    La route /__bench/queries renvoie le nombre d'instructions SQL exécutées
+    depuis le dernier appel (et remet le compteur à zéro).
+    """
+    from sqlalchemy import event
+    import uvicorn
+    from main import app
+    from database import all_engines
+
+    counter = {"statements": 0}
+    lock = threading.Lock()
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        with lock:
+            counter["statements"] += 1
+
+    for _, engine in all_engines():  # base principale et réplicas
+        event.listen(engine, "before_cursor_execute", count_statement)
+
+    @app.get("/__bench/queries", include_in_schema=False)
+    async def bench_queries():
+        with lock:
+            value = counter["statements"]
+            counter["statements"] = 0
+        return {"statements": value}
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(url, port, workers=None):
+    """Serveur instrumenté, ou serveur de production (serve.py) avec `workers` workers"""
+    # Tâches périodiques (prévisions, partitions, archivage) coupées pendant la mesure
+    env = dict(os.environ, DATABASE_URL=url, JOBS_ENABLED="0")
+    if workers:
+        command = [sys.executable, os.path.join(BASE_DIR, "serve.py"),
+                   "--workers", str(workers), "--bind", f"127.0.0.1:{port}"]
+        env.update(WEB_JOBS="0", WEB_MAX_REQUESTS="0")
+        stderr = subprocess.DEVNULL  # journaux gunicorn
+    else:
+        command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port)]
+        stderr = None
+    proc = subprocess.Popen(command, env=env, cwd=BASE_DIR, stdout=subprocess.DEVNULL, stderr=stderr)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("Le serveur de test s'est arrêté au démarrage")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("Le serveur de test n'a pas démarré à temps")
+
+
+# ============================================
+# 3. CLIENTS HTTP
+# ============================================
+class Client:
+    """Connexion HTTP keep-alive authentifiée par le cookie user_id"""
+
+    def __init__(self, port, user_id, timeout):
+        self.port = port
+        self.timeout = timeout
+        self.headers = {"Cookie": f"user_id={user_id}"}
+        self.conn = None
+
+    def get(self, path):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=self.timeout)
+        try:
+            self.conn.request("GET", path, headers=self.headers)
+            response = self.conn.getresponse()
+            body = response.read()
+            return response.status, body
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = None
+            raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def measure_queries(port, user_id, route, timeout):
+    """Nombre d'instructions SQL pour un appel isolé de la route"""
+    client = Client(port, user_id, timeout)
+    try:
+        client.get("/__bench/queries")
+        client.get(route)
+        _, body = client.get("/__bench/queries")
+        return json.loads(body)["statements"]
+    finally:
+        client.close()
+
+
+def load_route(port, user_id, route, clients, duration, timeout):
+    """Envoie des requêtes en parallèle pendant `duration` secondes"""
+    deadline = time.perf_counter() + duration
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def worker():
+        client = Client(port, user_id, timeout)
+        local = []
+        local_errors = 0
+        try:
+            while time.perf_counter() < deadline:
+                t0 = time.perf_counter()
+                try:
+                    status, _ = client.get(route)
+                    if status != 200:  # une redirection (303 vers /login) n'est pas la page mesurée
+                        local_errors += 1
+                        continue
+                except (OSError, http.client.HTTPException):
+                    local_errors += 1
+                    continue
+                local.append((time.perf_counter() - t0) * 1000)
+        finally:
+            client.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        for _ in range(clients):
+            pool.submit(worker)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "p50_ms": round(percentile(latencies, 50), 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95), 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 2) if latencies else None,
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+    }
+
+
+# ============================================
+# 4. COMPARAISON AVEC UNE RÉFÉRENCE
+# ============================================
+def compare(results, baseline, tolerance):
+    """Renvoie la liste des régressions par rapport à la référence"""
+    regressions = []
+    for route, current in results["routes"].items():
+        reference = baseline.get("routes", {}).get(route)
+        if not reference:
+            continue
+        for metric in ("p95_ms", "p99_ms"):
+            if reference.get(metric) and current.get(metric) is not None:
+                if current[metric] > reference[metric] * (1 + tolerance):
+                    regressions.append(
+                        f"{route}: {metric} {current[metric]} > {reference[metric]} (+{tolerance:.0%})"
+                    )
+        if reference.get("throughput_rps") and current["throughput_rps"] < reference["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{route}: débit {current['throughput_rps']} < {reference['throughput_rps']} (-{tolerance:.0%})"
+            )
+        if current.get("queries") is not None and reference.get("queries") is not None:
+            if current["queries"] > reference["queries"]:
+                regressions.append(
+                    f"{route}: {current['queries']} requêtes SQL au lieu de {reference['queries']}"
+                )
+        if current["errors"] and not reference.get("errors"):
+            regressions.append(f"{route}: {current['errors']} erreurs")
+    return regressions
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+# ============================================
+# 5. MONTÉE EN CHARGE SUR PLUSIEURS CŒURS
+# ============================================
+def scaling(url, user_id, args):
+    """Débit de chaque route pour chaque nombre de workers"""
+    results = {}
+    for workers in args.workers:
+        port = free_port()
+        print(f"\n🚀 serve.py avec {workers} worker(s) sur le port {port}")
+        proc = start_server(url, port, workers)
+        try:
+            for route in args.routes:
+                # Premier appel hors mesure (caches de chaque worker)
+                load_route(port, user_id, route, args.clients, 1.0, args.timeout)
+                stats = load_route(port, user_id, route, args.clients, args.duration, args.timeout)
+                results.setdefault(route, {})[str(workers)] = stats
+                print(f"  {route}: débit={stats['throughput_rps']}/s p95={stats['p95_ms']}ms "
+                      f"erreurs={stats['errors']}")
+        finally:
+            stop_server(proc)
+
+    reference = str(args.workers[0])
+    print(f"\n📈 Gain de débit par rapport à {reference} worker(s)")
+    print("  " + "route".ljust(22) + "".join(f"{w:>10}" for w in args.workers))
+    for route, by_workers in results.items():
+        base = by_workers[reference]["throughput_rps"] or None
+        cells = []
+        for workers in args.workers:
+            stats = by_workers[str(workers)]
+            stats["speedup"] = round(stats["throughput_rps"] / base, 2) if base else None
+            cells.append(f"{stats['speedup']}x" if stats["speedup"] is not None else "-")
+        print("  " + route.ljust(22) + "".join(f"{cell:>10}" for cell in cells))
+    return results
+
+
+# ============================================
+# 6. POINT D'ENTRÉE
+# ============================================
+def main():
+    parser = argparse.ArgumentParser(description="Banc de mesure HTTP AgriSuivi")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="10k")
+    parser.add_argument("--db", choices=["sqlite", "postgres"], default="sqlite")
+    parser.add_argument("--pg-url", default=os.environ.get("BENCH_POSTGRES_URL", "postgresql://localhost/agrisuivi_bench"))
+    parser.add_argument("--routes", nargs="*", default=ROUTES)
+    parser.add_argument("--clients", type=int, default=8, help="clients simultanés")
+    parser.add_argument("--duration", type=float, default=10.0, help="durée par route (s)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="délai max par requête (s)")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="fichier JSON de référence")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="régression tolérée (0.2 = 20%%)")
+    parser.add_argument("--workers", type=int, nargs="+", help="nombres de workers à comparer (serve.py)")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port)
+        return 0
+
+    url = dataset_url(args.db, args.scale, args.pg_url)
+    generate_dataset(url, SCALES[args.scale])
+
+    from sqlalchemy import create_engine, select
+    import models
+    engine = create_engine(url)
+    with engine.connect() as conn:
+        user_id = conn.execute(
+            select(models.User.id).where(models.User.email == BENCH_EMAIL)
+        ).scalar()
+    engine.dispose()
+    if user_id is None:
+        print(f"❌ Utilisateur de mesure {BENCH_EMAIL} introuvable : les routes répondraient par /login")
+        return 1
+
+    results = {
+        "meta": {
+            "scale": args.scale,
+            "rows": SCALES[args.scale],
+            "db": args.db,
+            "clients": args.clients,
+            "duration_s": args.duration,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "date": datetime.now().isoformat(timespec="seconds"),
+        },
+        "routes": {},
+    }
+
+    if args.workers:
+        results["scaling"] = scaling(url, user_id, args)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Résultats enregistrés dans {args.output}")
+        return 0
+
+    port = free_port()
+    print(f"\n🚀 Démarrage du serveur sur le port {port} ({args.db}, {args.scale})")
+    proc = start_server(url, port)
+    try:
+        for route in args.routes:
+            print(f"\n⏱️  {route}")
+            try:
+                queries = measure_queries(port, user_id, route, args.timeout)
+            except (OSError, http.client.HTTPException) as e:
+                print(f"  ❌ Route injoignable: {e}")
+                queries = None
+            stats = load_route(port, user_id, route, args.clients, args.duration, args.timeout)
+            stats["queries"] = queries
+            results["routes"][route] = stats
+            print(f"  p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms "
+                  f"débit={stats['throughput_rps']}/s SQL={queries} erreurs={stats['errors']}")
+    finally:
+        stop_server(proc)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"\n💾 Résultats enregistrés dans {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\n❌ RÉGRESSIONS DÉTECTÉES:")
+            for line in regressions:
+                print(f"   - {line}")
+            return 1
+        print("\n✅ Aucune régression par rapport à la référence")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,137 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from fastapi import Request
+from contextvars import ContextVar
+import itertools
+import os
 
-# Base de données SQLite (simple pour commencer)
-SQLALCHEMY_DATABASE_URL = "sqlite:///./agriculture.db"
+# Base de données SQLite par défaut (surchargeable avec DATABASE_URL, ex: PostgreSQL)
+SQLALCHEMY_DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./agriculture.db")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, 
-    connect_args={"check_same_thread": False}  # Nécessaire pour SQLite
-)
+# Réplicas en lecture seule (optionnels), séparés par des virgules :
+#   DATABASE_REPLICA_URLS=postgresql://replica1/agrisuivi,postgresql://replica2/agrisuivi
+REPLICA_URLS = [url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# Après une écriture, les lectures de l'utilisateur restent sur la base principale
+# pendant ce délai (retard de réplication toléré)
+STICKY_SECONDS = int(os.environ.get("DATABASE_STICKY_SECONDS", "10"))
+STICKY_COOKIE = "db_primary"
+
+
+def _create_engine(url):
+    connect_args = {}
+    if url.startswith("sqlite"):
+        connect_args = {"check_same_thread": False}  # Nécessaire pour SQLite
+    return create_engine(url, connect_args=connect_args)
+
+
+engine = _create_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+replica_engines = [_create_engine(url) for url in REPLICA_URLS]
+ReplicaSession = sessionmaker(autocommit=False, autoflush=False)
+_replicas = itertools.cycle(replica_engines)
+
 Base = declarative_base()
 
-# Dépendance pour obtenir la session BD
-def get_db():
+
+def all_engines():
+    """[(nom, moteur)] : la base principale puis les réplicas (métriques, fork)"""
+    return [("primary", engine)] + [(f"replica-{i}", e) for i, e in enumerate(replica_engines, 1)]
+
+
+@event.listens_for(ReplicaSession, "before_flush")
+def refuse_replica_writes(session, flush_context, instances):
+    raise RuntimeError("Écriture sur une session de lecture (réplica) : utiliser get_write_db")
+
+
+# ============================================
+# LECTURE DE SES PROPRES ÉCRITURES
+# ============================================
+# État de la requête HTTP en cours : {"wrote": bool}, partagé avec le
+# threadpool où s'exécutent les routes (l'objet est muté, pas remplacé)
+_request_writes = ContextVar("request_writes", default=None)
+
+
+def _mark_write():
+    state = _request_writes.get()
+    if state is not None:
+        state["wrote"] = True
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def track_flush(session, flush_context):
+    _mark_write()
+
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def track_bulk_write(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _mark_write()
+
+
+async def track_writes(request, call_next):
+    """Middleware : après une écriture, pose le cookie qui garde les lectures
+    de l'utilisateur sur la base principale pendant STICKY_SECONDS"""
+    if not replica_engines:
+        return await call_next(request)
+    state = {"wrote": False}
+    token = _request_writes.set(state)
+    try:
+        response = await call_next(request)
+    finally:
+        _request_writes.reset(token)
+    if state["wrote"]:
+        response.set_cookie(STICKY_COOKIE, "1", max_age=STICKY_SECONDS, httponly=True, samesite="lax")
+    return response
+
+
+def read_session(request=None):
+    """Session de lecture : un réplica (tour à tour), sauf juste après une
+    écriture de l'utilisateur ou sans réplica configuré"""
+    if not replica_engines or (request is not None and request.cookies.get(STICKY_COOKIE)):
+        return SessionLocal()
+    return ReplicaSession(bind=next(_replicas))
+
+
+# Dépendances pour obtenir la session BD
+def get_read_db(request: Request):
+    """Routes GET en lecture seule"""
+    db = read_session(request)
+    request.state.db = db  # aussi pour les fonctions des templates (get_notification)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_write_db(request: Request):
+    """Routes qui écrivent (ou lisent pour valider une écriture) : base principale"""
     db = SessionLocal()
+    request.state.db = db
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+get_db = get_write_db
+
+
+def sync_sqlite_replicas():
+    """Copie la base SQLite principale dans les réplicas SQLite (essais en local :
+    SQLite ne se réplique pas, cette copie tient lieu de réplication)"""
+    import sqlite3
+
+    source_path = engine.url.database
+    for replica in replica_engines:
+        if replica.dialect.name != "sqlite" or engine.dialect.name != "sqlite":
+            continue
+        replica.dispose()
+        with sqlite3.connect(source_path) as source, sqlite3.connect(replica.url.database) as target:
+            source.backup(target)
+        print(f"✅ Réplica {replica.url.database} synchronisé depuis {source_path}")
+
+
+if __name__ == "__main__":
+    sync_sqlite_replicas()
@@ -0,0 +1,227 @@
+# depletion.py
+"""
+Rythme d'écoulement des stocks et date de rupture estimée par produit × zone.
+
+Les relevés de stock sont des niveaux à une date. Sur les STOCK_LOOKBACK_DAYS
+derniers jours (dernier relevé seul pour les séries plus anciennes), le
+rythme d'écoulement d'une série est la somme des baisses entre relevés
+successifs (les hausses sont des réapprovisionnements) divisée par la durée
+couverte. La rupture est attendue à
+
+    dernier relevé + quantité / rythme
+
+Le calcul est vectorisé (NumPy) sur toutes les séries à la fois et stocké
+dans stock_projections : tableau de bord et alertes classent par date de
+rupture sans recalcul. Les séries touchées sont recalculées à chaque écriture
+de stock ; une tâche périodique recalcule tout (fenêtre glissante, imports
+hors ORM).
+
+    STOCK_LOOKBACK_DAYS=90
+    STOCK_PROJECTION_INTERVAL=3600   # période de la tâche en secondes (0 = désactivée)
+    LOW_STOCK_THRESHOLD=100          # seuil fixe pour les séries sans rythme connu
+"""
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import delete, func, insert, or_, select, tuple_
+
+import hooks
+import jobs
+import models
+
+LOOKBACK_DAYS = int(os.environ.get("STOCK_LOOKBACK_DAYS", "90"))
+INTERVAL = int(os.environ.get("STOCK_PROJECTION_INTERVAL", "3600"))
+LOW_STOCK_THRESHOLD = float(os.environ.get("LOW_STOCK_THRESHOLD", "100"))
+ALERT_DAYS = 14
+MIN_SPAN_DAYS = 1.0
+BATCH = 500
+
+
+# ============================================
+# 1. CALCUL VECTORISÉ
+# ============================================
+def _query(condition=None):
+    """Relevés de la fenêtre, plus le dernier relevé des séries sans relevé récent.
+
+    `condition` est une fonction qui construit le filtre : il est utilisé deux
+    fois et un même paramètre IN développé ne peut pas apparaître deux fois.
+    """
+    stock = models.Stock
+    since = datetime.now() - timedelta(days=LOOKBACK_DAYS)
+    ranked = select(
+        stock.id,
+        func.row_number().over(
+            partition_by=(stock.product_id, stock.zone_id),
+            order_by=(stock.date.desc(), stock.id.desc()),
+        ).label("rank"),
+    )
+    query = select(stock.product_id, stock.zone_id, stock.date, stock.quantity)\
+        .where(stock.product_id.isnot(None), stock.zone_id.isnot(None))\
+        .order_by(stock.product_id, stock.zone_id, stock.date, stock.id)
+    if condition is not None:
+        ranked = ranked.where(condition())
+        query = query.where(condition())
+    ranked = ranked.subquery()
+    latest = select(ranked.c.id).where(ranked.c.rank == 1)
+    return query.where(or_(stock.date >= since, stock.id.in_(latest)))
+
+
+def _load(connection, keys=None):
+    if keys is None:
+        return connection.execute(_query()).all()
+    stock = models.Stock
+    rows = []
+    keys = list(keys)
+    for offset in range(0, len(keys), BATCH):
+        batch = keys[offset:offset + BATCH]
+        rows.extend(connection.execute(_query(lambda: tuple_(stock.product_id, stock.zone_id).in_(batch))))
+    return rows
+
+
+def project(rows):
+    """Projections à partir de relevés triés par (produit, zone, date)"""
+    if not rows:
+        return []
+    products = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    zones = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+    days = np.fromiter((r[2].timestamp() / 86400 for r in rows), dtype=np.float64, count=len(rows))
+    quantities = np.fromiter((r[3] or 0.0 for r in rows), dtype=np.float64, count=len(rows))
+
+    new_series = np.r_[True, (products[1:] != products[:-1]) | (zones[1:] != zones[:-1])]
+    series_id = np.cumsum(new_series) - 1
+    count = series_id[-1] + 1
+    last = np.r_[np.flatnonzero(new_series)[1:] - 1, len(rows) - 1]
+
+    # Baisses et durées entre relevés successifs d'une même série
+    same = ~new_series[1:]
+    consumed = np.where(same, np.clip(quantities[:-1] - quantities[1:], 0, None), 0.0)
+    elapsed = np.where(same, days[1:] - days[:-1], 0.0)
+    consumed = np.bincount(series_id[1:], weights=consumed, minlength=count)
+    elapsed = np.bincount(series_id[1:], weights=elapsed, minlength=count)
+    observations = np.bincount(series_id, minlength=count)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rate = np.where(elapsed >= MIN_SPAN_DAYS, consumed / elapsed, 0.0)
+        cover = np.where(rate > 0, np.clip(quantities[last], 0, None) / rate, np.nan)
+
+    now = datetime.now()
+    result = []
+    for i, row_index in enumerate(last):
+        last_date = rows[row_index][2]
+        result.append({
+            "product_id": int(products[row_index]),
+            "zone_id": int(zones[row_index]),
+            "quantity": float(quantities[row_index]),
+            "last_date": last_date,
+            "daily_rate": round(float(rate[i]), 4),
+            "stockout_date": None if np.isnan(cover[i]) else last_date + timedelta(days=float(cover[i])),
+            "observations": int(observations[i]),
+            "computed_at": now,
+        })
+    return result
+
+
+def refresh(connection, keys):
+    """Recalcule les projections des séries (product_id, zone_id) données"""
+    keys = {(p, z) for p, z in keys if p is not None and z is not None}
+    if not keys:
+        return
+    table = models.StockProjection
+    hooks.replace_rows(connection, table, keys, project(_load(connection, keys)))
+
+
+def rebuild(connection):
+    """Recalcule toutes les projections"""
+    rows = project(_load(connection))
+    connection.execute(delete(models.StockProjection))
+    if rows:
+        connection.execute(insert(models.StockProjection), rows)
+    return len(rows)
+
+
+def ensure_built(engine):
+    """Construit les projections au démarrage si la table est vide alors que des stocks existent"""
+    with engine.begin() as conn:
+        has_projections = conn.execute(select(models.StockProjection.product_id).limit(1)).first()
+        has_stocks = conn.execute(select(models.Stock.id).limit(1)).first()
+        if has_stocks and not has_projections:
+            count = rebuild(conn)
+            print(f"✅ Projections de stocks construites ({count} séries)")
+
+
+# ============================================
+# 2. LECTURE
+# ============================================
+def urgent(db, limit=10, department=None, days=ALERT_DAYS):
+    """Séries classées par urgence : rupture prévue sous `days` jours, puis
+    stocks sous le seuil fixe quand aucun rythme n'est connu"""
+    projection = models.StockProjection
+    now = datetime.now()
+    query = select(
+        projection,
+        models.Product.name.label("product_name"),
+        models.Product.unit,
+        models.Zone.name.label("zone_name"),
+    ).join(models.Product, models.Product.id == projection.product_id)\
+     .join(models.Zone, models.Zone.id == projection.zone_id)\
+     .where(or_(
+        projection.stockout_date <= now + timedelta(days=days),
+        projection.stockout_date.is_(None) & (projection.quantity < LOW_STOCK_THRESHOLD),
+     ))\
+     .order_by(projection.stockout_date.is_(None), projection.stockout_date, projection.quantity)\
+     .limit(limit)
+    if department:
+        query = query.where(models.Zone.department == department)
+
+    alerts = []
+    for row, product_name, unit, zone_name in db.execute(query):
+        days_left = None
+        if row.stockout_date is not None:
+            days_left = max((row.stockout_date - now).total_seconds() / 86400, 0.0)
+        alerts.append({
+            "product_id": row.product_id,
+            "product_name": product_name,
+            "zone_id": row.zone_id,
+            "zone_name": zone_name,
+            "unit": unit,
+            "quantity": row.quantity,
+            "last_date": row.last_date,
+            "daily_rate": row.daily_rate,
+            "stockout_date": row.stockout_date,
+            "days_left": round(days_left, 1) if days_left is not None else None,
+        })
+    return alerts
+
+
+# ============================================
+# 3. MISE À JOUR
+# ============================================
+def stock_keys(changes):
+    """Séries (produit, zone) touchées par des changements de stock"""
+    keys = {(s.product_id, s.zone_id) for s in changes.inserted + changes.deleted + changes.updated}
+    keys |= {(hooks.old_value(s, "product_id"), hooks.old_value(s, "zone_id")) for s in changes.updated}
+    return keys
+
+
+@hooks.on_flush(models.Stock)
+def refresh_stock_projections(session, changes):
+    refresh(session.connection(), stock_keys(changes))
+
+
+@jobs.every(INTERVAL, name="projections de stocks")
+def scheduled_rebuild():
+    from database import engine
+
+    with engine.begin() as conn:
+        count = rebuild(conn)
+    print(f"📦 Projections de stocks recalculées ({count} séries)")
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        count = rebuild(conn)
+    print(f"✅ Projections de stocks recalculées ({count} séries)")
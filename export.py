@@ -0,0 +1,246 @@
+# export.py
+"""
+Export colonnaire des prix pour les analystes (pandas, R, DuckDB...).
+
+    GET /api/export/prices.parquet?from=2025-01-01&to=2025-12-31&product_id=&zone_id=
+    GET /api/export/prices.arrow   (format fichier Arrow IPC / Feather v2)
+
+    pandas.read_parquet("prices.parquet")     pandas.read_feather("prices.arrow")
+    arrow::read_parquet("prices.parquet")     arrow::read_feather("prices.arrow")
+
+Le fichier est produit au fil de l'eau : les prix sont lus par lots de
+BATCH_ROWS lignes (archives Parquet d'abord, voir archive.py, puis la base,
+par date croissante), chaque lot devient un RecordBatch Arrow (un groupe de
+lignes Parquet) envoyé aussitôt ; la mémoire ne dépend pas de la taille de
+l'export. Les noms de produit, catégorie, unité, zone et département sont
+ajoutés à chaque ligne (colonnes dictionnaire : « category » sous pandas).
+Les bornes from / to portent sur la date du relevé : seules les partitions
+et archives concernées sont lues.
+
+Sans pyarrow, l'export est indisponible (501).
+
+Vérification aller-retour (pandas si installé) : python export.py [AAAA-MM-JJ AAAA-MM-JJ]
+"""
+import os
+
+from sqlalchemy import select
+
+import archive
+import models
+import refcache
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+    AVAILABLE = True
+except ImportError:
+    AVAILABLE = False
+
+BATCH_ROWS = int(os.environ.get("EXPORT_BATCH_ROWS", "50000"))
+COMPRESSION = os.environ.get("EXPORT_COMPRESSION", "zstd")
+
+FORMATS = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.file",
+}
+PRICE_COLUMNS = ["id", "date", "product_id", "zone_id", "price"]
+
+
+def price_schema():
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ("id", pa.int64()),
+        ("date", pa.timestamp("us")),
+        ("product_id", pa.int64()),
+        ("product_name", dictionary),
+        ("category", dictionary),
+        ("unit", dictionary),
+        ("zone_id", pa.int64()),
+        ("zone_name", dictionary),
+        ("department", dictionary),
+        ("price", pa.float64()),
+    ])
+
+
+# ============================================
+# 1. NOMS DÉNORMALISÉS
+# ============================================
+class Names:
+    """Colonnes de noms d'un lot, calculées en bloc depuis le cache des données de référence"""
+
+    def __init__(self, refs):
+        products = list(refs.products.values())
+        zones = list(refs.zones.values())
+        self.product_ids = pa.array([p.id for p in products], pa.int64())
+        self.zone_ids = pa.array([z.id for z in zones], pa.int64())
+        # Un dictionnaire de valeurs distinctes par colonne (pandas refuse les catégories en double)
+        self.product_columns = {
+            "product_name": self._encode([p.name for p in products]),
+            "category": self._encode([p.category for p in products]),
+            "unit": self._encode([p.unit for p in products]),
+        }
+        self.zone_columns = {
+            "zone_name": self._encode([z.name for z in zones]),
+            "department": self._encode([z.department for z in zones]),
+        }
+
+    @staticmethod
+    def _encode(values):
+        """(code de chaque fiche, valeurs distinctes)"""
+        encoded = pa.array(values, pa.string()).dictionary_encode()
+        return encoded.indices, encoded.dictionary
+
+    @staticmethod
+    def _lookup(values, ids, column):
+        # Position de chaque identifiant dans la liste des fiches (nulle si inconnu),
+        # puis code de la fiche dans le dictionnaire de la colonne
+        codes, dictionary = column
+        positions = pc.index_in(values, value_set=ids)
+        return pa.DictionaryArray.from_arrays(pc.take(codes, positions), dictionary)
+
+    def batch(self, batch, schema):
+        """RecordBatch au schéma d'export à partir d'un lot (id, date, product_id, zone_id, price)"""
+        product_ids = batch.column("product_id")
+        zone_ids = batch.column("zone_id")
+        columns = {name: batch.column(name) for name in PRICE_COLUMNS}
+        for name, column in self.product_columns.items():
+            columns[name] = self._lookup(product_ids, self.product_ids, column)
+        for name, column in self.zone_columns.items():
+            columns[name] = self._lookup(zone_ids, self.zone_ids, column)
+        return pa.RecordBatch.from_arrays([columns[field.name] for field in schema], schema=schema)
+
+
+# ============================================
+# 2. LECTURE PAR LOTS
+# ============================================
+def _database_batches(db, start, end, product_id, zone_id):
+    price = models.Price
+    query = select(price.id, price.date, price.product_id, price.zone_id, price.price)\
+        .order_by(price.date, price.id)
+    if start:
+        query = query.where(price.date >= archive.start_of(start))
+    if end:
+        query = query.where(price.date < archive.end_of(end))
+    if product_id:
+        query = query.where(price.product_id == product_id)
+    if zone_id:
+        query = query.where(price.zone_id == zone_id)
+    types = [pa.int64(), pa.timestamp("us"), pa.int64(), pa.int64(), pa.float64()]
+    # Curseur côté serveur (PostgreSQL) : les lignes arrivent par lots, jamais toutes en mémoire
+    result = db.execute(query.execution_options(stream_results=True, yield_per=BATCH_ROWS))
+    for rows in result.partitions():
+        columns = list(zip(*rows))
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(values, type_) for values, type_ in zip(columns, types)], names=PRICE_COLUMNS
+        )
+
+
+def price_batches(db, start=None, end=None, product_id=None, zone_id=None):
+    """Lots Arrow des prix de la période (bornes incluses), noms compris : archives puis base"""
+    schema = price_schema()
+    names = Names(refcache.get())
+    if archive.covers(models.Price, start):
+        for batch in archive.batches(models.Price, start, end, product_id, zone_id, columns=PRICE_COLUMNS):
+            if batch.num_rows:
+                yield names.batch(batch, schema)
+    for batch in _database_batches(db, start, end, product_id, zone_id):
+        yield names.batch(batch, schema)
+
+
+# ============================================
+# 3. ÉCRITURE EN FLUX
+# ============================================
+class _Sink:
+    """Fichier en écriture seule dont le contenu est repris au fur et à mesure"""
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream(batches, fmt):
+    """Octets du fichier `fmt` (parquet, arrow), envoyés lot après lot"""
+    schema = price_schema()
+    sink = _Sink()
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(sink, schema, compression=COMPRESSION)
+    else:
+        writer = ipc.new_file(sink, schema)
+    for batch in batches:
+        writer.write_batch(batch)
+        data = sink.drain()
+        if data:
+            yield data
+    writer.close()
+    yield sink.drain()
+
+
+def stream_prices(db, fmt, start=None, end=None, product_id=None, zone_id=None):
+    """Corps de la réponse d'export ; la session est fermée à la fin du flux (pas par la route)"""
+    try:
+        yield from stream(price_batches(db, start, end, product_id, zone_id), fmt)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    # Vérification aller-retour : python export.py [AAAA-MM-JJ AAAA-MM-JJ]
+    import sys
+    import tempfile
+
+    import series
+    from database import SessionLocal
+
+    if not AVAILABLE:
+        raise SystemExit("❌ pyarrow est nécessaire : pip install pyarrow")
+    try:
+        import pandas
+    except ImportError:
+        pandas = None
+    start, end = (series.parse_day(day) for day in (sys.argv[1:3] + [None, None])[:2])
+    db = SessionLocal()
+    try:
+        # Mêmes relevés que /api/prices (archives comprises)
+        expected = sorted(
+            row["id"] if isinstance(row, dict) else row.id
+            for row in archive.observations(db, models.Price, start, end)
+        )
+    finally:
+        db.close()
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in FORMATS:
+            path = os.path.join(tmp, f"prices.{fmt}")
+            with open(path, "wb") as f:
+                for data in stream_prices(SessionLocal(), fmt, start, end):
+                    f.write(data)
+            if pandas is not None:
+                frame = pandas.read_parquet(path) if fmt == "parquet" else pandas.read_feather(path)
+                ids = frame["id"].tolist()
+            else:
+                table = pq.read_table(path) if fmt == "parquet" else ipc.open_file(path).read_all()
+                ids = table.column("id").to_pylist()
+            if sorted(ids) != expected:
+                raise SystemExit(f"❌ {fmt} : {len(ids)} lignes, {len(expected)} attendues")
+            print(f"✅ {fmt} : {len(ids)} lignes relues ({'pandas' if pandas is not None else 'pyarrow'})")
@@ -0,0 +1,271 @@
+# forecast.py
+"""
+Prévisions hebdomadaires des prix par produit × zone.
+
+Modèle léger, ajusté sur le logarithme du prix moyen hebdomadaire :
+- tendance amortie (lissage exponentiel de Holt, paramètres choisis par
+  recherche sur grille, vectorisée avec NumPy) ;
+- composante saisonnière par saison agricole (voir series.SEASONS), estimée
+  dès qu'une série couvre une année complète.
+
+Les prévisions et leurs intervalles (80 % et 95 %) sont stockées dans
+price_forecasts ; l'API ne fait que les lire. Une tâche périodique ne
+réajuste que les séries dont price_daily a changé depuis le dernier calcul,
+en parallèle sur un pool de processus.
+
+    python forecast.py          # séries modifiées depuis le dernier calcul
+    python forecast.py --all    # toutes les séries
+
+    FORECAST_INTERVAL=3600      # période de la tâche en secondes (0 = désactivée)
+    FORECAST_HORIZON=8          # nombre de semaines prévues
+    FORECAST_WORKERS=<cœurs-1>  # taille du pool de processus
+"""
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import delete, func, insert, select, tuple_
+
+import jobs
+import models
+import series
+from rollups import day_of
+
+INTERVAL = int(os.environ.get("FORECAST_INTERVAL", "3600"))
+HORIZON = int(os.environ.get("FORECAST_HORIZON", "8"))
+WORKERS = int(os.environ.get("FORECAST_WORKERS", str(max((os.cpu_count() or 1) - 1, 1))))
+HISTORY_WEEKS = 156
+MIN_WEEKS = 8
+PARALLEL_MIN = 200  # en dessous, le démarrage du pool coûte plus que l'ajustement
+BATCH = 500
+
+ALPHAS = (0.1, 0.3, 0.5, 0.7, 0.9)
+BETAS = (0.01, 0.05, 0.1, 0.2)
+PHI = 0.95
+Z_80 = 1.2816
+Z_95 = 1.96
+
+
+def week_of(day):
+    """Lundi de la semaine contenant `day`"""
+    return day - timedelta(days=day.weekday())
+
+
+# ============================================
+# 1. MODÈLE (fonctions pures, exécutées dans les processus du pool)
+# ============================================
+def _season_offsets(weeks, values):
+    """Écart moyen de chaque saison agricole à la tendance linéaire"""
+    if weeks[-1] - weeks[0] < 52 * 7:
+        return {}
+    slope, intercept = np.polyfit(weeks, values, 1)
+    residuals = values - (slope * weeks + intercept)
+    seasons = np.array([series.SEASONS[date.fromordinal(int(w)).month][0] for w in weeks])
+    offsets = {}
+    for season in set(seasons.tolist()):
+        mask = seasons == season
+        if mask.sum() >= 2:
+            offsets[season] = float(residuals[mask].mean())
+    if offsets:
+        center = np.mean(list(offsets.values()))
+        offsets = {season: offset - center for season, offset in offsets.items()}
+    return offsets
+
+
+def _holt(y):
+    """Tendance amortie : meilleurs (alpha, beta), niveau, tendance et écart-type des erreurs"""
+    alphas, betas = np.meshgrid(ALPHAS, BETAS)
+    alphas, betas = alphas.ravel(), betas.ravel()
+    level = np.full(alphas.shape, y[0])
+    trend = np.full(alphas.shape, y[1] - y[0])
+    sse = np.zeros(alphas.shape)
+    for value in y[1:]:
+        predicted = level + PHI * trend
+        error = value - predicted
+        sse += error * error
+        level = predicted + alphas * error
+        trend = PHI * trend + alphas * betas * error
+    best = int(np.argmin(sse))
+    sigma = math.sqrt(sse[best] / (len(y) - 1))
+    return alphas[best], betas[best], level[best], trend[best], sigma
+
+
+def fit_series(task):
+    """Ajuste une série ((product_id, zone_id), semaines ordinales, log des prix).
+
+    Retourne (clé, modèle, dernière semaine, [(h, prévision, bornes 80 %, bornes 95 %)...])
+    ou (clé, None, None, []) si la série est trop courte.
+    """
+    key, weeks, values = task
+    if len(weeks) < MIN_WEEKS:
+        return key, None, None, []
+    weeks = np.asarray(weeks, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+
+    offsets = _season_offsets(weeks, values)
+    def offset(ordinal):
+        return offsets.get(series.SEASONS[date.fromordinal(int(ordinal)).month][0], 0.0)
+
+    # Semaines manquantes interpolées pour garder un pas régulier
+    grid = np.arange(weeks[0], weeks[-1] + 1, 7)
+    y = np.interp(grid, weeks, values) - np.array([offset(w) for w in grid])
+    alpha, beta, level, trend, sigma = _holt(y)
+
+    rows = []
+    damped = 0.0
+    variance = 0.0
+    for h in range(1, HORIZON + 1):
+        damped += PHI ** h
+        if h > 1:
+            c = alpha * (1 + beta * (damped - PHI ** h))
+            variance += c * c
+        target = weeks[-1] + 7 * h
+        center = level + damped * trend + offset(target)
+        spread = sigma * math.sqrt(1 + variance)
+        rows.append((
+            h,
+            math.exp(center),
+            math.exp(center - Z_80 * spread), math.exp(center + Z_80 * spread),
+            math.exp(center - Z_95 * spread), math.exp(center + Z_95 * spread),
+        ))
+    model = "holt_amorti_saisonnier" if offsets else "holt_amorti"
+    return key, model, int(weeks[-1]), rows
+
+
+def fit_all(tasks):
+    """Ajuste toutes les séries, sur un pool de processus si elles sont nombreuses"""
+    if WORKERS > 1 and len(tasks) >= PARALLEL_MIN:
+        # "spawn" : le processus web a des threads (tâches, serveur), fork serait risqué
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=WORKERS, mp_context=context) as pool:
+            return list(pool.map(fit_series, tasks, chunksize=max(len(tasks) // (WORKERS * 4), 1)))
+    return [fit_series(task) for task in tasks]
+
+
+# ============================================
+# 2. LECTURE / ÉCRITURE
+# ============================================
+def stale_keys(connection, full=False):
+    """Séries dont l'agrégat journalier a changé depuis le dernier calcul"""
+    daily = models.PriceDaily
+    watermark = None if full else connection.execute(select(func.max(models.PriceForecast.fitted_at))).scalar()
+    query = select(daily.product_id, daily.zone_id).distinct()
+    if watermark is not None:
+        query = query.where(daily.updated_at > watermark)
+    return {tuple(row) for row in connection.execute(query)}
+
+
+def load_tasks(connection, keys):
+    """Séries hebdomadaires (log du prix moyen) des clés demandées"""
+    daily = models.PriceDaily
+    start = date.today() - timedelta(weeks=HISTORY_WEEKS)
+    sums = {}
+    keys = list(keys)
+    for offset in range(0, len(keys), BATCH):
+        batch = keys[offset:offset + BATCH]
+        query = select(daily.product_id, daily.zone_id, daily.day, daily.total, daily.count)\
+            .where(daily.day >= start, tuple_(daily.product_id, daily.zone_id).in_(batch))
+        for product_id, zone_id, day, total, count in connection.execute(query):
+            bucket = sums.setdefault((product_id, zone_id), {})
+            week = week_of(day_of(day)).toordinal()
+            previous = bucket.get(week, (0.0, 0))
+            bucket[week] = (previous[0] + total, previous[1] + count)
+
+    tasks = []
+    for key, weeks in sums.items():
+        ordered = sorted(weeks)
+        tasks.append((key, ordered, [math.log(weeks[w][0] / weeks[w][1]) for w in ordered]))
+    return tasks
+
+
+def save(connection, keys, results, fitted_at):
+    table = models.PriceForecast
+    keys = list(keys)
+    for offset in range(0, len(keys), BATCH):
+        batch = keys[offset:offset + BATCH]
+        connection.execute(delete(table).where(tuple_(table.product_id, table.zone_id).in_(batch)))
+    rows = []
+    for (product_id, zone_id), model, last_week, forecasts in results:
+        for h, value, lower_80, upper_80, lower_95, upper_95 in forecasts:
+            rows.append({
+                "product_id": product_id,
+                "zone_id": zone_id,
+                "week": date.fromordinal(last_week + 7 * h),
+                "horizon": h,
+                "forecast": round(value, 2),
+                "lower_80": round(lower_80, 2),
+                "upper_80": round(upper_80, 2),
+                "lower_95": round(lower_95, 2),
+                "upper_95": round(upper_95, 2),
+                "model": model,
+                "last_observed": date.fromordinal(last_week),
+                "fitted_at": fitted_at,
+            })
+    if rows:
+        connection.execute(insert(table), rows)
+    return sum(1 for result in results if result[1])
+
+
+def refit(engine, full=False):
+    """Réajuste les séries modifiées (toutes si full=True) ; retourne le nombre de séries prévues.
+
+    Lecture, ajustement et écriture sont séparés : aucune transaction n'est
+    ouverte pendant le calcul.
+    """
+    fitted_at = datetime.now()
+    with engine.connect() as conn:
+        keys = stale_keys(conn, full=full)
+        if not keys:
+            return 0
+        tasks = load_tasks(conn, keys)
+    results = fit_all(tasks)
+    with engine.begin() as conn:
+        return save(conn, keys, results, fitted_at)
+
+
+def forecasts_for(db, product_id, zone_id=None):
+    """Prévisions enregistrées d'un produit (toutes zones ou une seule)"""
+    table = models.PriceForecast
+    query = select(table, models.Zone.name)\
+        .join(models.Zone, models.Zone.id == table.zone_id)\
+        .where(table.product_id == product_id)\
+        .order_by(table.zone_id, table.week)
+    if zone_id:
+        query = query.where(table.zone_id == zone_id)
+
+    by_zone = {}
+    for row, zone_name in db.execute(query):
+        entry = by_zone.setdefault(row.zone_id, {
+            "zone_id": row.zone_id,
+            "zone_name": zone_name,
+            "model": row.model,
+            "last_observed": row.last_observed.isoformat(),
+            "fitted_at": row.fitted_at.isoformat(),
+            "weeks": [], "forecast": [],
+            "lower_80": [], "upper_80": [], "lower_95": [], "upper_95": [],
+        })
+        entry["weeks"].append(row.week.isoformat())
+        for field in ("forecast", "lower_80", "upper_80", "lower_95", "upper_95"):
+            entry[field].append(getattr(row, field))
+    return list(by_zone.values())
+
+
+@jobs.every(INTERVAL, name="prévisions")
+def scheduled_refit():
+    from database import engine
+
+    count = refit(engine)
+    if count:
+        print(f"📈 Prévisions de prix mises à jour ({count} séries)")
+
+
+if __name__ == "__main__":
+    import sys
+    from database import engine
+
+    models.Base.metadata.create_all(bind=engine)
+    count = refit(engine, full="--all" in sys.argv)
+    print(f"✅ Prévisions de prix calculées ({count} séries)")
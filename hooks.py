@@ -0,0 +1,154 @@
+# hooks.py
+"""
+Crochets d'écriture : traitements déclenchés quand des lignes sont écrites.
+
+Les modules qui maintiennent des données dérivées (agrégats, index, alertes...)
+s'enregistrent ici plutôt que d'être appelés depuis chaque route :
+
+    @hooks.on_flush(models.Price)
+    def refresh_rollup(session, changes):
+        ...
+
+Les traitements `on_flush` s'exécutent dans la transaction en cours, juste
+après l'envoi des INSERT/UPDATE/DELETE (les identifiants sont connus) ; ils
+doivent écrire via `session.connection()` et non via l'ORM. Les traitements
+`on_commit` s'exécutent une fois la transaction validée (notifications,
+diffusion en direct...) et reçoivent les changements accumulés sous forme
+d'instantanés (dict colonne -> valeur), la session ne pouvant plus lire la base.
+
+Les tables dérivées recalculées dans un traitement `on_flush` s'écrivent avec
+`replace_rows()` (INSERT ... ON CONFLICT DO UPDATE) plutôt qu'avec DELETE
+puis INSERT : sous PostgreSQL, deux écritures simultanées qui recalculent la
+même clé ne voient pas la ligne insérée par l'autre, et la seconde échouait
+sur la clé primaire.
+"""
+from sqlalchemy import delete, event, inspect, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+DELETE_BATCH = 500  # clés par DELETE ... WHERE (...) IN
+
+_flush_handlers = []
+_commit_handlers = []
+
+
+class Changes:
+    """Objets d'un modèle insérés, modifiés ou supprimés lors d'un flush"""
+
+    __slots__ = ("inserted", "updated", "deleted")
+
+    def __init__(self):
+        self.inserted = []
+        self.updated = []
+        self.deleted = []
+
+    def __bool__(self):
+        return bool(self.inserted or self.updated or self.deleted)
+
+
+def old_value(obj, attribute):
+    """Valeur d'un attribut avant modification (valeur courante s'il n'a pas changé)"""
+    history = inspect(obj).attrs[attribute].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(obj, attribute)
+
+
+def on_flush(model, priority=100):
+    """Enregistre un traitement exécuté après chaque flush touchant `model`.
+
+    Les traitements sont appelés par priorité croissante.
+    """
+    def decorator(handler):
+        _flush_handlers.append((priority, len(_flush_handlers), model, handler))
+        _flush_handlers.sort(key=lambda item: item[:2])
+        return handler
+    return decorator
+
+
+def on_commit(model):
+    """Enregistre un traitement exécuté après la validation de la transaction"""
+    def decorator(handler):
+        _commit_handlers.append((model, handler))
+        return handler
+    return decorator
+
+
+def snapshot(obj):
+    """Valeurs des colonnes d'un objet ORM, utilisables hors session"""
+    if isinstance(obj, dict):
+        return obj
+    return {attr.key: getattr(obj, attr.key) for attr in inspect(obj).mapper.column_attrs}
+
+
+def dispatch(session, model, changes):
+    """Déclenche les traitements pour des changements faits hors flush ORM
+    (ex: INSERT ... ON CONFLICT exécuté directement)"""
+    if not changes:
+        return
+    for _, _, target, handler in _flush_handlers:
+        if target is model:
+            handler(session, changes)
+    if any(target is model for target, _ in _commit_handlers):
+        pending = session.info.setdefault("hooks_pending", {}).setdefault(model, Changes())
+        pending.inserted.extend(snapshot(obj) for obj in changes.inserted)
+        pending.updated.extend(snapshot(obj) for obj in changes.updated)
+        pending.deleted.extend(snapshot(obj) for obj in changes.deleted)
+
+
+def replace_rows(connection, model, keys, rows):
+    """Remplace les lignes de `model` aux clés primaires `keys` par `rows` (dicts).
+
+    Les lignes sont insérées ou mises à jour en place ; seules les clés qui
+    n'ont plus de ligne sont supprimées.
+    """
+    table = model.__table__
+    primary = list(table.primary_key.columns)
+    if rows:
+        insert = (postgresql if connection.dialect.name == "postgresql" else sqlite).insert(table)
+        connection.execute(insert.on_conflict_do_update(
+            index_elements=primary,
+            set_={name: insert.excluded[name] for name in rows[0] if name not in table.primary_key.columns},
+        ), rows)
+    written = {tuple(row[column.name] for column in primary) for row in rows}
+    stale = [tuple(key) for key in keys if tuple(key) not in written]
+    for offset in range(0, len(stale), DELETE_BATCH):
+        connection.execute(delete(table).where(tuple_(*primary).in_(stale[offset:offset + DELETE_BATCH])))
+
+
+def _collect(session):
+    by_model = {}
+    for attr, state_objs in (("inserted", session.new), ("updated", session.dirty), ("deleted", session.deleted)):
+        for obj in state_objs:
+            if attr == "updated" and not session.is_modified(obj, include_collections=False):
+                continue
+            changes = by_model.setdefault(type(obj), Changes())
+            getattr(changes, attr).append(obj)
+    return by_model
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context):
+    if not _flush_handlers and not _commit_handlers:
+        return
+    for model, changes in _collect(session).items():
+        dispatch(session, model, changes)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    pending = session.info.pop("hooks_pending", None)
+    if not pending:
+        return
+    for target, handler in _commit_handlers:
+        changes = pending.get(target)
+        if changes:
+            try:
+                handler(changes)
+            except Exception as e:
+                print(f"❌ Erreur traitement après commit ({handler.__name__}): {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("hooks_pending", None)
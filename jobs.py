@@ -0,0 +1,90 @@
+# jobs.py
+"""
+Tâches périodiques exécutées en arrière-plan dans le processus web.
+
+    @jobs.every(3600, name="prévisions")
+    def refit():
+        ...
+
+Chaque tâche tourne dans son propre thread démon, démarré par start() au
+lancement de l'application ; une tâche n'est jamais exécutée deux fois en
+parallèle. Un intervalle <= 0 désactive la tâche (JOBS_ENABLED=0 les
+désactive toutes, ex: pour les workers qui ne doivent pas les porter).
+"""
+import os
+import threading
+import time
+
+ENABLED = os.environ.get("JOBS_ENABLED", "1") != "0"
+
+_jobs = []
+_stop = threading.Event()
+
+
+class Job:
+    def __init__(self, name, interval, func, delay):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.delay = delay
+        self.thread = None
+        self.last_run = None
+        self.last_duration = None
+        self.last_error = None
+
+    def run(self):
+        start = time.perf_counter()
+        self.last_run = time.time()
+        try:
+            self.func()
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"❌ Erreur tâche '{self.name}': {e}")
+        self.last_duration = time.perf_counter() - start
+
+    def loop(self):
+        if _stop.wait(self.delay):
+            return
+        while True:
+            self.run()
+            if _stop.wait(self.interval):
+                return
+
+
+def every(seconds, name=None, delay=10):
+    """Enregistre une fonction exécutée toutes les `seconds` secondes (première fois après `delay`)"""
+    def decorator(func):
+        _jobs.append(Job(name or func.__name__, seconds, func, delay))
+        return func
+    return decorator
+
+
+def start():
+    if not ENABLED:
+        return
+    _stop.clear()
+    for job in _jobs:
+        if job.interval > 0 and (job.thread is None or not job.thread.is_alive()):
+            job.thread = threading.Thread(target=job.loop, name=f"job-{job.name}", daemon=True)
+            job.thread.start()
+            print(f"⏱️ Tâche '{job.name}' planifiée toutes les {job.interval}s")
+
+
+def stop():
+    _stop.set()
+
+
+def status():
+    """État des tâches (dernière exécution, durée, erreur)"""
+    return [
+        {
+            "name": job.name,
+            "interval": job.interval,
+            "running": job.thread is not None and job.thread.is_alive(),
+            "last_run": job.last_run,
+            "last_duration": job.last_duration,
+            "last_error": job.last_error,
+        }
+        for job in _jobs
+    ]
@@ -0,0 +1,347 @@
+# live.py
+"""
+Mises à jour en direct du tableau de bord (Server-Sent Events).
+
+Chaque écriture validée produit UN événement (compteurs, nouveaux prix ou
+stocks, alertes), sérialisé une seule fois puis copié dans la file de chaque
+tableau de bord connecté : des centaines de navigateurs ouverts coûtent un
+calcul par changement, et non une série de requêtes par rafraîchissement.
+
+    GET /dashboard/stream   (text/event-stream)
+
+    event: counters      data: {"prices_count": 1}          (variations)
+    event: price         data: {"product_name": ..., "price": ...}
+    event: stock         data: {"product_name": ..., "quantity": ...}
+    event: notification  data: {"type": "warning", "message": ...}  (destinataire seul)
+
+Le diffuseur est propre à chaque processus. Avec plusieurs workers
+(LIVE_SHARED=1, posé par serve.py), chaque événement est écrit dans la table
+live_events, que chaque worker relit toutes les LIVE_POLL_INTERVAL secondes
+pour le diffuser à ses propres tableaux de bord, dans l'ordre du journal.
+Les événements portent alors un identifiant (`id:`) : quand un worker
+s'arrête (serve.py), ses flux sont fermés aussitôt, le navigateur se
+reconnecte à un autre worker avec Last-Event-ID et reçoit les événements
+manqués entre-temps. Les variations de compteurs ne se perdent donc pas.
+"""
+import asyncio
+import json
+import os
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select
+
+import database
+import hooks
+import jobs
+import metrics
+import models
+import refcache
+
+HEARTBEAT = 15  # secondes entre deux commentaires de maintien de connexion
+QUEUE_SIZE = 100  # au-delà, le client est trop lent : il recharge la page
+LATEST_LIMIT = 5
+
+SHARED = os.environ.get("LIVE_SHARED", "0") == "1"
+POLL_INTERVAL = float(os.environ.get("LIVE_POLL_INTERVAL", "1"))
+RETENTION = int(os.environ.get("LIVE_RETENTION", "600"))  # secondes de rattrapage possible
+SLACK = 100  # identifiants relus en arrière (transactions validées dans le désordre)
+
+
+def _message(event, payload, event_id=None):
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {payload}\n\n"
+
+
+# ============================================
+# JOURNAL PARTAGÉ ENTRE WORKERS (LIVE_SHARED)
+# ============================================
+def _log(events):
+    """Écrit les événements dans live_events (une transaction)"""
+    now = datetime.now()
+    rows = [
+        {"event": event, "data": payload, "user_id": user_id, "created_at": now}
+        for event, payload, user_id in events
+    ]
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.LiveEvent), rows)
+
+
+def _last_id():
+    with database.engine.connect() as conn:
+        return conn.execute(select(func.max(models.LiveEvent.id))).scalar() or 0
+
+
+def _read(after, limit=500):
+    """[(id, event, data, user_id)] d'identifiant > after"""
+    event = models.LiveEvent
+    with database.engine.connect() as conn:
+        return conn.execute(
+            select(event.id, event.event, event.data, event.user_id)
+            .where(event.id > after)
+            .order_by(event.id)
+            .limit(limit)
+        ).all()
+
+
+@jobs.every(60 if SHARED else 0, name="événements en direct")
+def prune():
+    """Supprime les événements trop anciens pour être rattrapés"""
+    with database.engine.begin() as conn:
+        conn.execute(delete(models.LiveEvent).where(
+            models.LiveEvent.created_at < datetime.now() - timedelta(seconds=RETENTION)
+        ))
+
+
+class Subscription:
+    __slots__ = ("user_id", "queue", "overflowed")
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.overflowed = False
+
+
+class Broker:
+    """Diffusion des événements vers les abonnés (thread-safe côté publication)"""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._loop = None
+        self._poller = None
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    @property
+    def active(self):
+        """Vrai si un événement peut avoir un destinataire (ici ou, partagé, dans un autre worker)"""
+        return SHARED or bool(self._subscribers)
+
+    def subscribe(self, user_id):
+        self._loop = asyncio.get_running_loop()
+        subscription = Subscription(user_id)
+        self._subscribers.add(subscription)
+        metrics.LIVE_SUBSCRIBERS.set(len(self._subscribers))
+        if SHARED and self._poller is None:
+            self._poller = self._loop.create_task(self._poll())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._subscribers.discard(subscription)
+        metrics.LIVE_SUBSCRIBERS.set(len(self._subscribers))
+
+    def publish(self, event, data, user_id=None):
+        """Diffuse un événement (à un seul utilisateur si user_id est donné)"""
+        self.publish_many([(event, data, user_id)])
+
+    def publish_many(self, events):
+        """Diffuse des événements [(event, data, user_id)] ; une seule écriture du journal partagé.
+
+        Appelable depuis n'importe quel thread (routes, tâches de fond).
+        """
+        if not events or not self.active:
+            return
+        events = [(event, json.dumps(data, default=str, ensure_ascii=False), user_id) for event, data, user_id in events]
+        for event, _, _ in events:
+            metrics.LIVE_EVENTS.inc(event=event)
+        if SHARED:
+            # Diffusé par la relecture du journal, ici comme dans les autres workers
+            try:
+                _log(events)
+            except Exception as e:
+                print(f"❌ Erreur journal des événements en direct: {e}")
+            return
+        loop = self._loop
+        if loop is None or not self._subscribers or loop.is_closed():
+            return
+        messages = [(None, _message(event, payload), user_id) for event, payload, user_id in events]
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._fanout(messages)
+        else:
+            loop.call_soon_threadsafe(self._fanout, messages)
+
+    def _fanout(self, messages):
+        for event_id, message, user_id in messages:
+            for subscription in list(self._subscribers):
+                if user_id is not None and subscription.user_id != user_id:
+                    continue
+                try:
+                    subscription.queue.put_nowait((event_id, message))
+                except asyncio.QueueFull:
+                    subscription.overflowed = True
+
+    async def _poll(self):
+        """Relit le journal partagé et diffuse ses nouveaux événements"""
+        try:
+            last = await asyncio.to_thread(_last_id)
+        except Exception as e:
+            print(f"❌ Erreur lecture des événements en direct: {e}")
+            last = 0
+        seen = deque(maxlen=SLACK * 10)
+        try:
+            while self._subscribers:
+                await asyncio.sleep(POLL_INTERVAL)
+                try:
+                    rows = await asyncio.to_thread(_read, max(last - SLACK, 0))
+                except Exception as e:
+                    print(f"❌ Erreur lecture des événements en direct: {e}")
+                    continue
+                messages = []
+                for event_id, event, payload, user_id in rows:
+                    last = max(last, event_id)
+                    if event_id not in seen:
+                        seen.append(event_id)
+                        messages.append((event_id, _message(event, payload, event_id), user_id))
+                self._fanout(messages)
+        finally:
+            self._poller = None
+
+    def close(self):
+        """Termine tous les flux en cours (arrêt du worker)"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._close_all()
+        else:
+            loop.call_soon_threadsafe(self._close_all)
+
+    def _close_all(self):
+        for subscription in list(self._subscribers):
+            queue = subscription.queue
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait((None, None))
+
+
+broker = Broker()
+
+
+async def _missed(request, user_id):
+    """Événements manqués depuis Last-Event-ID (reconnexion, journal partagé)"""
+    try:
+        after = int(request.headers.get("last-event-id", ""))
+    except ValueError:
+        return []
+    rows = await asyncio.to_thread(_read, after, QUEUE_SIZE + 1)
+    if len(rows) > QUEUE_SIZE:
+        return None  # trop d'écart : la page se recharge
+    return [
+        (event_id, _message(event, payload, event_id))
+        for event_id, event, payload, target in rows
+        if target is None or target == user_id
+    ]
+
+
+async def stream(request, user_id):
+    """Générateur du flux SSE d'un tableau de bord"""
+    subscription = broker.subscribe(user_id)
+    replayed = set()
+    try:
+        yield "retry: 5000\n\n"
+        if SHARED:
+            missed = await _missed(request, user_id)
+            if missed is None:
+                yield "event: reload\ndata: {}\n\n"
+                return
+            for event_id, message in missed:
+                replayed.add(event_id)
+                yield message
+        while True:
+            try:
+                event_id, message = await asyncio.wait_for(subscription.queue.get(), timeout=HEARTBEAT)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": ping\n\n"
+                continue
+            if message is None:
+                break  # arrêt du worker : le navigateur se reconnecte (retry)
+            if subscription.overflowed:
+                yield "event: reload\ndata: {}\n\n"
+                break
+            if event_id in replayed:
+                continue  # déjà envoyé au rattrapage
+            yield message
+    finally:
+        broker.unsubscribe(subscription)
+
+
+# ============================================
+# PRODUCTION DES ÉVÉNEMENTS (une fois par validation)
+# ============================================
+def _counter(name, changes):
+    delta = len(changes.inserted) - len(changes.deleted)
+    return [("counters", {name: delta}, None)] if delta else []
+
+
+def _names(row):
+    """(produit, unité, zone) d'une ligne, depuis le cache des données de référence"""
+    refs = refcache.get()
+    product, zone = refs.product(row["product_id"]), refs.zone(row["zone_id"])
+    return (product.name if product else "?"), (product.unit if product else ""), (zone.name if zone else "?")
+
+
+def _latest(rows):
+    rows = [r for r in rows if r.get("date") is not None]
+    return sorted(rows, key=lambda r: r["date"], reverse=True)[:LATEST_LIMIT]
+
+
+@hooks.on_commit(models.Price)
+def publish_prices(changes):
+    if not broker.active:
+        return
+    events = _counter("prices_count", changes)
+    for row in reversed(_latest(changes.inserted)):
+        product_name, _, zone_name = _names(row)
+        events.append(("price", {
+            "product_name": product_name,
+            "zone_name": zone_name,
+            "price": row["price"],
+            "date": row["date"].strftime("%d/%m/%Y"),
+        }, None))
+    broker.publish_many(events)
+
+
+@hooks.on_commit(models.Stock)
+def publish_stocks(changes):
+    if not broker.active:
+        return
+    events = _counter("stocks_count", changes)
+    for row in reversed(_latest(changes.inserted)):
+        product_name, unit, zone_name = _names(row)
+        events.append(("stock", {
+            "product_name": product_name,
+            "zone_name": zone_name,
+            "quantity": row["quantity"],
+            "unit": unit,
+            "date": row["date"].strftime("%d/%m/%Y"),
+        }, None))
+    broker.publish_many(events)
+
+
+@hooks.on_commit(models.Product)
+def publish_products(changes):
+    broker.publish_many(_counter("products_count", changes))
+
+
+@hooks.on_commit(models.Zone)
+def publish_zones(changes):
+    broker.publish_many(_counter("zones_count", changes))
+
+
+@hooks.on_commit(models.Notification)
+def publish_notifications(changes):
+    broker.publish_many([
+        ("notification", {"type": row["type"], "message": row["message"]}, row["user_id"])
+        for row in changes.inserted
+    ])
@@ -0,0 +1,104 @@
+# lookup.py
+"""
+Saisie assistée (typeahead) des produits et des zones dans les formulaires.
+
+Les formulaires de stock et de prix ne chargent plus tout le catalogue pour
+remplir des <select> : le champ interroge /api/lookup/products?q=... (ou
+zones) au fil de la frappe. Les noms sont gardés en mémoire dans un index
+de préfixes : chaque mot du nom, en minuscules et sans accents, dans une
+liste triée parcourue par recherche dichotomique ; « dan » trouve
+« Dantokpa » comme « Marché Dantokpa ».
+
+Les noms viennent de l'instantané de refcache.py : l'index est reconstruit
+quand celui-ci change de version.
+"""
+import re
+from bisect import bisect_left
+
+import refcache
+from search import unaccent
+
+MAX_CANDIDATES = 200
+
+
+def _words(text):
+    return re.findall(r"\w+", unaccent(text))
+
+
+class PrefixIndex:
+    """Index de préfixes sur les mots des noms (liste triée + bisect)"""
+
+    def __init__(self, items):
+        # items : [(id, nom, libellé)], triés par nom
+        self.items = sorted(items, key=lambda item: unaccent(item[1]))
+        self.names = [unaccent(name) for _, name, _ in self.items]
+        entries = sorted(
+            (word, position)
+            for position, (_, name, _) in enumerate(self.items)
+            for word in set(_words(name))
+        )
+        self.words = [word for word, _ in entries]
+        self.positions = [position for _, position in entries]
+
+    def __len__(self):
+        return len(self.items)
+
+    def search(self, query, limit=10):
+        """[(id, nom, libellé)] dont les mots commencent par ceux de `query`,
+        les noms commençant par la requête d'abord"""
+        terms = _words(query)
+        if not terms:
+            return self.items[:limit]
+        prefix = " ".join(terms)
+        matches = []
+        # Noms commençant par la requête : plage contiguë de self.names (trié), parcourue en entier
+        i = bisect_left(self.names, prefix)
+        while i < len(self.names) and self.names[i].startswith(prefix) and len(matches) < limit:
+            if self._matches(i, terms):
+                matches.append(i)
+            i += 1
+        if len(matches) >= limit:
+            return [self.items[position] for position in matches]
+
+        # Puis les noms dont un autre mot commence par la requête
+        first = max(terms, key=len)  # le mot le plus long réduit le plus la plage parcourue
+        found = set(matches)
+        candidates = set()
+        i = bisect_left(self.words, first)
+        while i < len(self.words) and self.words[i].startswith(first) and len(candidates) < MAX_CANDIDATES:
+            if self.positions[i] not in found:
+                candidates.add(self.positions[i])
+            i += 1
+        matches.extend(sorted(position for position in candidates if self._matches(position, terms)))
+        return [self.items[position] for position in matches[:limit]]
+
+    def _matches(self, position, terms):
+        return all(any(word.startswith(term) for word in _words(self.names[position])) for term in terms)
+
+
+def _product_items(refs):
+    return [(p.id, p.name or "", f"{p.name} ({p.unit})" if p.unit else p.name) for p in refs.products.values()]
+
+
+def _zone_items(refs):
+    return [(z.id, z.name or "", f"{z.name} ({z.city})" if z.city else z.name) for z in refs.zones.values()]
+
+
+LOADERS = {"products": _product_items, "zones": _zone_items}
+_indexes = {}
+
+
+def get_index(kind):
+    """Index de préfixes de l'instantané courant (refcache), reconstruit quand il change"""
+    refs = refcache.get()
+    cached = _indexes.get(kind)
+    if cached is None or cached[0] != refs.version:
+        cached = _indexes[kind] = (refs.version, PrefixIndex(LOADERS[kind](refs)))
+    return cached[1]
+
+
+def lookup(kind, query, limit=10):
+    return [
+        {"id": item_id, "name": name, "label": label}
+        for item_id, name, label in get_index(kind).search(query, limit)
+    ]
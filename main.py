@@ -1,15 +1,43 @@
-from fastapi import FastAPI, Request, Depends
+from fastapi import FastAPI, Request, Depends, Query
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.openapi.utils import get_openapi
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, PlainTextResponse, JSONResponse, StreamingResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
+from typing import Optional
+from contextlib import asynccontextmanager
+from collections import Counter
 import models
-from database import engine, SessionLocal, get_db
+import database
+from database import engine, SessionLocal, get_read_db, get_write_db
 import sys
 import subprocess
+import time
 from auth import authenticate_user, verify_password, get_password_hash
+import metrics
+import nplusone
+import profiling
+import rollups
+import series
+import price_index
+import analytics
+import outliers
+import forecast
+import jobs
+import spreads
+import depletion
+import alerts
+import live
+import subscriptions
+import search
+import lookup
+import refcache
+import partitions
+import archive
+import export
+import upsert
 
 # ============================================
 # 1. DIAGNOSTIC DE DÉMARRAGE
@@ -23,6 +51,16 @@ try:
 except ImportError:
     print("❌ jinja2 N'EST PAS installé")
 
+if profiling.AVAILABLE:
+    print(f"✅ pyinstrument disponible (échantillonnage: {profiling.SAMPLE_RATE:.1%} des requêtes)")
+else:
+    print("⚠️  pyinstrument N'EST PAS installé - profilage désactivé")
+
+if export.AVAILABLE:
+    print("✅ pyarrow disponible (export Parquet / Arrow, archivage)")
+else:
+    print("⚠️  pyarrow N'EST PAS installé - export Parquet / Arrow et archivage désactivés")
+
 print("\n📦 Liste complète des packages:")
 result = subprocess.run(['pip', 'freeze'], capture_output=True, text=True)
 print(result.stdout)
@@ -32,24 +70,57 @@ print("=" * 50)
 # 2. CRÉATION DES TABLES
 # ============================================
 models.Base.metadata.create_all(bind=engine)
+upsert.ensure_built(engine)  # doublons supprimés avant la création de l'index unique
+partitions.ensure_built(engine)
+# create_all ne crée pas les index ajoutés après coup sur une table existante
+for table in models.Base.metadata.sorted_tables:
+    if table.name in partitions.managed_tables():
+        continue  # index posés sur chaque partition (voir partitions.py)
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
+outliers.ensure_built(engine)
+rollups.ensure_built(engine)
+spreads.ensure_built(engine)
+depletion.ensure_built(engine)
+price_index.ensure_built(engine)
+search.ensure_built(engine)
+for name, db_engine in database.all_engines():
+    metrics.instrument_engine(db_engine, name)
+    nplusone.instrument_engine(db_engine)
 
 # ============================================
 # 3. INITIALISATION FASTAPI
 # ============================================
-app = FastAPI(title="AgriSuivi Bénin")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Tâches d'arrière-plan (prévisions...), voir jobs.py
+    jobs.start()
+    yield
+    jobs.stop()
+
+app = FastAPI(title="AgriSuivi Bénin", lifespan=lifespan)
 templates = Jinja2Templates(directory="templates")
+metrics.instrument_templates(templates)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # ============================================
 # 4. MIDDLEWARE D'AUTHENTIFICATION SIMPLIFIÉ
 # ============================================
+# Le dernier middleware déclaré s'exécute en premier : déclaré avant
+# l'authentification, le profilage voit donc request.state.user
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """Profil de la requête pour les admins (?__profile=1) ou par échantillonnage"""
+    return await profiling.profile_request(request, call_next)
+
 @app.middleware("http")
 async def add_user_to_request(request: Request, call_next):
     """Récupère l'utilisateur depuis la session (sans JWT)"""
     user_id = request.cookies.get("user_id")
     
     if user_id:
-        db = SessionLocal()
+        start = time.perf_counter()
+        db = database.read_session(request)
         try:
             user = db.query(models.User).filter(models.User.id == int(user_id)).first()
             request.state.user = user
@@ -57,12 +128,31 @@ async def add_user_to_request(request: Request, call_next):
             request.state.user = None
         finally:
             db.close()
+            metrics.record_auth_time(time.perf_counter() - start)
     else:
         request.state.user = None
     
     response = await call_next(request)
     return response
 
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    """Après une écriture, les lectures de l'utilisateur restent sur la base principale"""
+    return await database.track_writes(request, call_next)
+
+# Déclaré après l'authentification : il l'englobe et la mesure aussi
+@app.middleware("http")
+async def collect_metrics(request: Request, call_next):
+    """Latence, requêtes SQL et rendu de chaque requête (voir /metrics)"""
+    return await metrics.track_request(request, call_next)
+
+# Détecteur N+1 : uniquement si NPLUSONE_MODE=log ou raise (développement)
+if nplusone.ENABLED:
+    @app.middleware("http")
+    async def detect_n_plus_one(request: Request, call_next):
+        """Signale les formes de requêtes SQL répétées au-delà du seuil"""
+        return await nplusone.track_request(request, call_next)
+
 # ============================================
 # 5. FONCTION POUR LES TEMPLATES
 # ============================================
@@ -72,13 +162,20 @@ def get_user_from_request(request: Request):
 
 # AJOUTEZ CETTE FONCTION
 def get_notification(request: Request):
-    """Récupère une notification pour les templates"""
-    # Pour l'instant, retourne None (pas de notification)
-    # Tu pourras implémenter les notifications plus tard
-    return None
+    """Récupère la prochaine notification non lue de l'utilisateur (voir alerts.py),
+    avec la session de la requête ; la page la marque lue une fois affichée"""
+    user = getattr(request.state, 'user', None)
+    if not user:
+        return None
+    db = getattr(request.state, 'db', None)
+    if db is None:
+        with database.read_session(request) as db:
+            return alerts.next_notification(db, user.id)
+    return alerts.next_notification(db, user.id)
 
 templates.env.globals['get_user'] = get_user_from_request
 templates.env.globals['get_notification'] = get_notification  # ← AJOUTEZ CETTE LIGNE
+templates.env.globals['refs'] = refcache.get  # produits et zones en cache (refs().product(id))
 
 
 # ============================================
@@ -122,7 +219,7 @@ async def login_form(request: Request):
     return templates.TemplateResponse("login.html", {"request": request})
 
 @app.post("/token")
-async def login(request: Request, db: Session = Depends(get_db)):
+async def login(request: Request, db: Session = Depends(get_write_db)):
     """Connexion utilisateur - SANS JWT"""
     try:
         form = await request.form()
@@ -172,7 +269,7 @@ async def register_form(request: Request):
     return templates.TemplateResponse("register.html", {"request": request})
 
 @app.post("/register")
-async def register(request: Request, db: Session = Depends(get_db)):
+async def register(request: Request, db: Session = Depends(get_write_db)):
     """Inscription utilisateur"""
     form = await request.form()
     errors = []
@@ -254,31 +351,40 @@ async def debug_state(request: Request):
     
     return result
 
+@app.get("/admin/profiling")
+async def profiling_report(request: Request, reset: bool = False):
+    """Rapport agrégé des fonctions les plus coûteuses (requêtes échantillonnées)"""
+    user = getattr(request.state, 'user', None)
+    if not user or not user.is_admin:
+        return JSONResponse({"error": "Accès réservé aux administrateurs"}, status_code=403)
+    
+    report = profiling.hot_functions_report()
+    if reset:
+        profiling.reset()
+    return report
+
 # ============================================
 # 9. DASHBOARD
 # ============================================
 @app.get("/dashboard")
-async def dashboard(request: Request, db: Session = Depends(get_db)):
+async def dashboard(request: Request, db: Session = Depends(get_read_db)):
     """Tableau de bord avec statistiques"""
     user = getattr(request.state, 'user', None)
     if not user:
         return RedirectResponse(url="/login", status_code=303)
     
-    from sqlalchemy import func
+    refs = refcache.get()
     
     # 1. Statistiques générales
     stats = {
-        "products_count": db.query(models.Product).count(),
-        "zones_count": db.query(models.Zone).count(),
+        "products_count": len(refs.products),
+        "zones_count": len(refs.zones),
         "stocks_count": db.query(models.Stock).count(),
         "prices_count": db.query(models.Price).count(),
     }
     
     # 2. Répartition par catégorie
-    categories = db.query(
-        models.Product.category, 
-        func.count(models.Product.id)
-    ).group_by(models.Product.category).all()
+    categories = sorted(Counter(p.category for p in refs.products.values()).items(), key=lambda c: str(c[0]))
     
     if categories:
         category_labels = [c[0] for c in categories]
@@ -287,28 +393,11 @@ async def dashboard(request: Request, db: Session = Depends(get_db)):
         category_labels = ['Aucune donnée']
         category_data = [1]
     
-    # 3. Évolution des prix (7 derniers jours)
-    last_7_days = datetime.now() - timedelta(days=7)
-    prices = db.query(models.Price)\
-        .filter(models.Price.date >= last_7_days)\
-        .order_by(models.Price.date).all()
-    
-    if prices:
-        price_by_day = {}
-        for p in prices:
-            day = p.date.strftime('%d/%m')
-            if day not in price_by_day:
-                price_by_day[day] = []
-            price_by_day[day].append(p.price)
-        
-        price_dates = []
-        price_data = []
-        for day in sorted(price_by_day.keys()):
-            price_dates.append(day)
-            price_data.append(sum(price_by_day[day]) / len(price_by_day[day]))
-    else:
-        price_dates = []
-        price_data = []
+    # 3. Évolution des prix (7 derniers jours), depuis l'agrégat journalier
+    last_7_days = (datetime.now() - timedelta(days=7)).date()
+    trend = series.price_series(db, granularity="day", start=last_7_days)
+    price_dates = [day.strftime('%d/%m') for day in trend["labels"]]
+    price_data = trend["avg"]
     
     # 4. Top 5 des stocks
     top_stocks = db.query(
@@ -325,16 +414,8 @@ async def dashboard(request: Request, db: Session = Depends(get_db)):
         stock_labels = []
         stock_data = []
     
-    # 5. Alertes stocks faibles
-    low_stock_alerts = db.query(
-        models.Product.name.label('product_name'),
-        models.Zone.name.label('zone_name'),
-        models.Stock.quantity,
-        models.Product.unit
-    ).join(models.Product).join(models.Zone)\
-     .filter(models.Stock.quantity < 100)\
-     .order_by(models.Stock.quantity)\
-     .limit(10).all()
+    # 5. Alertes stocks : ruptures les plus proches (projections précalculées)
+    low_stock_alerts = depletion.urgent(db, limit=10)
     
     # 6. Derniers enregistrements
     latest_prices = db.query(models.Price)\
@@ -345,6 +426,9 @@ async def dashboard(request: Request, db: Session = Depends(get_db)):
         .order_by(models.Stock.date.desc())\
         .limit(5).all()
     
+    # 7. Produits les plus volatils (30 derniers jours, calcul vectorisé)
+    volatile_series = analytics.volatility_ranking(db, days=30, limit=5)
+    
     return templates.TemplateResponse(
         "dashboard.html",
         {
@@ -357,22 +441,37 @@ async def dashboard(request: Request, db: Session = Depends(get_db)):
             "stock_labels": stock_labels,
             "stock_data": stock_data,
             "low_stock_alerts": low_stock_alerts,
+            "low_stock_threshold": depletion.LOW_STOCK_THRESHOLD,
             "latest_prices": latest_prices,
-            "latest_stocks": latest_stocks
+            "latest_stocks": latest_stocks,
+            "volatile_series": volatile_series
         }
     )
 
+@app.get("/dashboard/stream")
+async def dashboard_stream(request: Request):
+    """Flux Server-Sent Events des mises à jour du tableau de bord (voir live.py)"""
+    user = getattr(request.state, 'user', None)
+    if not user:
+        return JSONResponse({"error": "Non authentifié"}, status_code=401)
+    
+    return StreamingResponse(
+        live.stream(request, user.id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # ============================================
 # 10. ROUTES PRODUITS
 # ============================================
 @app.get("/products")
-async def list_products(request: Request, db: Session = Depends(get_db)):
+async def list_products(request: Request, db: Session = Depends(get_read_db)):
     """Liste tous les produits"""
     user = getattr(request.state, 'user', None)
     if not user:
         return RedirectResponse(url="/login", status_code=303)
     
-    products = db.query(models.Product).all()
+    products = list(refcache.get().products.values())
     return templates.TemplateResponse(
         "products/list.html",
         {"request": request, "products": products}
@@ -388,7 +487,7 @@ async def add_product_form(request: Request):
     return templates.TemplateResponse("products/form.html", {"request": request})
 
 @app.post("/products/add")
-async def add_product(request: Request, db: Session = Depends(get_db)):
+async def add_product(request: Request, db: Session = Depends(get_write_db)):
     """Ajoute un produit"""
     user = getattr(request.state, 'user', None)
     if not user:
@@ -434,20 +533,20 @@ async def add_product(request: Request, db: Session = Depends(get_db)):
     return RedirectResponse(url="/products", status_code=303)
 
 @app.get("/products/edit/{product_id}")
-async def edit_product_form(request: Request, product_id: int, db: Session = Depends(get_db)):
+async def edit_product_form(request: Request, product_id: int, db: Session = Depends(get_read_db)):
     """Formulaire d'édition de produit"""
     user = getattr(request.state, 'user', None)
     if not user:
         return RedirectResponse(url="/login", status_code=303)
     
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    product = refcache.get().product(product_id)
     return templates.TemplateResponse(
         "products/edit.html",
         {"request": request, "product": product}
     )
 
 @app.post("/products/edit/{product_id}")
-async def edit_product(request: Request, product_id: int, db: Session = Depends(get_db)):
+async def edit_product(request: Request, product_id: int, db: Session = Depends(get_write_db)):
     """Modifie un produit"""
     user = getattr(request.state, 'user', None)
     if not user:
@@ -465,7 +564,7 @@ async def edit_product(request: Request, product_id: int, db: Session = Depends(
     return RedirectResponse(url="/products", status_code=303)
 
 @app.get("/products/delete/{product_id}")
-async def delete_product(request: Request, product_id: int, db: Session = Depends(get_db)):
+async def delete_product(request: Request, product_id: int, db: Session = Depends(get_write_db)):
     """Supprime un produit"""
     user = getattr(request.state, 'user', None)
     if not user:
@@ -483,13 +582,13 @@ async def delete_product(request: Request, product_id: int, db: Session = Depend
 # ============================================
 
 @app.get("/zones")
-async def list_zones(request: Request, db: Session = Depends(get_db)):
+async def list_zones(request: Request, db: Session = Depends(get_read_db)):
     """Liste toutes les zones"""
     user = getattr(request.state, 'user', None)
     if not user:
         return RedirectResponse(url="/login", status_code=303)
     
-    zones = db.query(models.Zone).all()
+    zones = list(refcache.get().zones.values())
     return templates.TemplateResponse(
         "zones/list.html",
         {"request": request, "zones": zones}
@@ -505,7 +604,7 @@ async def add_zone_form(request: Request):
     return templates.TemplateResponse("zones/form.html", {"request": request})
 
 @app.post("/zones/add")
-async def add_zone(request: Request, db: Session = Depends(get_db)):
+async def add_zone(request: Request, db: Session = Depends(get_write_db)):
     """Ajoute une zone"""
     user = getattr(request.state, 'user', None)
     if not user:
@@ -582,13 +681,13 @@ async def add_zone(request: Request, db: Session = Depends(get_db)):
         )
 
 @app.get("/zones/edit/{zone_id}")
-async def edit_zone_form(request: Request, zone_id: int, db: Session = Depends(get_db)):
+async def edit_zone_form(request: Request, zone_id: int, db: Session = Depends(get_read_db)):
     """Formulaire d'édition de zone"""
     user = getattr(request.state, 'user', None)
     if not user:
         return RedirectResponse(url="/login", status_code=303)
     
-    zone = db.query(models.Zone).filter(models.Zone.id == zone_id).first()
+    zone = refcache.get().zone(zone_id)
     if not zone:
         return RedirectResponse(url="/zones", status_code=303)
     
@@ -598,7 +697,7 @@ async def edit_zone_form(request: Request, zone_id: int, db: Session = Depends(g
     )
 
 @app.post("/zones/edit/{zone_id}")
-async def edit_zone(request: Request, zone_id: int, db: Session = Depends(get_db)):
+async def edit_zone(request: Request, zone_id: int, db: Session = Depends(get_write_db)):
     """Modifie une zone"""
     user = getattr(request.state, 'user', None)
     if not user:
@@ -619,7 +718,7 @@ async def edit_zone(request: Request, zone_id: int, db: Session = Depends(get_db
     return RedirectResponse(url="/zones", status_code=303)
 
 @app.get("/zones/delete/{zone_id}")
-async def delete_zone(request: Request, zone_id: int, db: Session = Depends(get_db)):
+async def delete_zone(request: Request, zone_id: int, db: Session = Depends(get_write_db)):
     """Supprime une zone"""
     user = getattr(request.state, 'user', None)
     if not user:
@@ -638,7 +737,7 @@ async def delete_zone(request: Request, zone_id: int, db: Session = Depends(get_
 # ============================================
 
 @app.get("/stocks")
-async def list_stocks(request: Request, db: Session = Depends(get_db)):
+async def list_stocks(request: Request, db: Session = Depends(get_read_db)):
     """Liste tous les stocks"""
     user = getattr(request.state, 'user', None)
     if not user:
@@ -651,27 +750,20 @@ async def list_stocks(request: Request, db: Session = Depends(get_db)):
     )
 
 @app.get("/stocks/add")
-async def add_stock_form(request: Request, db: Session = Depends(get_db)):
+async def add_stock_form(request: Request, db: Session = Depends(get_read_db)):
     """Formulaire d'ajout de stock"""
     user = getattr(request.state, 'user', None)
     if not user:
         return RedirectResponse(url="/login", status_code=303)
     
-    # Récupérer les produits et zones pour les menus déroulants
-    products = db.query(models.Product).order_by(models.Product.name).all()
-    zones = db.query(models.Zone).order_by(models.Zone.name).all()
-    
+    # Produit et zone : saisie assistée (/api/lookup), le catalogue n'est pas chargé
     return templates.TemplateResponse(
         "stocks/form.html",
-        {
-            "request": request,
-            "products": products,
-            "zones": zones
-        }
+        {"request": request}
     )
 
 @app.post("/stocks/add")
-async def add_stock(request: Request, db: Session = Depends(get_db)):
+async def add_stock(request: Request, db: Session = Depends(get_write_db)):
     """Ajoute un stock"""
     user = getattr(request.state, 'user', None)
     if not user:
@@ -680,13 +772,9 @@ async def add_stock(request: Request, db: Session = Depends(get_db)):
     form = await request.form()
     errors = []
     
-    # Récupérer les produits et zones en cas d'erreur
-    products = db.query(models.Product).order_by(models.Product.name).all()
-    zones = db.query(models.Zone).order_by(models.Zone.name).all()
-    
     # Validation
     try:
-        product_id = int(form.get('product_id', 0))
+        product_id = int(form.get('product_id') or 0)
         if product_id <= 0:
             errors.append("Le produit est requis")
     except ValueError:
@@ -694,13 +782,18 @@ async def add_stock(request: Request, db: Session = Depends(get_db)):
         product_id = 0
     
     try:
-        zone_id = int(form.get('zone_id', 0))
+        zone_id = int(form.get('zone_id') or 0)
         if zone_id <= 0:
             errors.append("La zone est requise")
     except ValueError:
         errors.append("Zone invalide")
         zone_id = 0
     
+    if product_id > 0 and not refcache.product_exists(db, product_id):
+        errors.append("Produit introuvable")
+    if zone_id > 0 and not refcache.zone_exists(db, zone_id):
+        errors.append("Zone introuvable")
+    
     try:
         quantity = float(form.get('quantity', 0))
         if quantity <= 0:
@@ -715,30 +808,29 @@ async def add_stock(request: Request, db: Session = Depends(get_db)):
             {
                 "request": request,
                 "errors": errors,
-                "form": dict(form),
-                "products": products,
-                "zones": zones
+                "form": dict(form)
             }
         )
     
     # Création du stock
     try:
-        stock = models.Stock(
-            product_id=product_id,
-            zone_id=zone_id,
-            quantity=quantity,
-            notes=form.get('notes', ''),
-            created_by=user.id
-        )
+        values = {
+            "product_id": product_id,
+            "zone_id": zone_id,
+            "quantity": quantity,
+            "notes": form.get('notes', ''),
+            "created_by": user.id
+        }
         
         # Gestion de la date si fournie
         if form.get('date'):
             try:
-                stock.date = datetime.fromisoformat(form.get('date'))
+                values["date"] = datetime.fromisoformat(form.get('date'))
             except:
                 pass
         
-        db.add(stock)
+        # Même produit, zone et minute qu'un relevé existant : mise à jour (NATURAL_KEY, voir upsert.py)
+        upsert.save(db, models.Stock, [values])
         db.commit()
         
         return RedirectResponse(url="/stocks", status_code=303)
@@ -750,14 +842,12 @@ async def add_stock(request: Request, db: Session = Depends(get_db)):
             {
                 "request": request,
                 "errors": ["Erreur lors de l'enregistrement"],
-                "form": dict(form),
-                "products": products,
-                "zones": zones
+                "form": dict(form)
             }
         )
 
 @app.get("/stocks/edit/{stock_id}")
-async def edit_stock_form(request: Request, stock_id: int, db: Session = Depends(get_db)):
+async def edit_stock_form(request: Request, stock_id: int, db: Session = Depends(get_read_db)):
     """Formulaire d'édition de stock"""
     user = getattr(request.state, 'user', None)
     if not user:
@@ -767,21 +857,16 @@ async def edit_stock_form(request: Request, stock_id: int, db: Session = Depends
     if not stock:
         return RedirectResponse(url="/stocks", status_code=303)
     
-    products = db.query(models.Product).order_by(models.Product.name).all()
-    zones = db.query(models.Zone).order_by(models.Zone.name).all()
-    
     return templates.TemplateResponse(
         "stocks/edit.html",
         {
             "request": request,
-            "stock": stock,
-            "products": products,
-            "zones": zones
+            "stock": stock
         }
     )
 
 @app.post("/stocks/edit/{stock_id}")
-async def edit_stock(request: Request, stock_id: int, db: Session = Depends(get_db)):
+async def edit_stock(request: Request, stock_id: int, db: Session = Depends(get_write_db)):
     """Modifie un stock"""
     user = getattr(request.state, 'user', None)
     if not user:
@@ -795,19 +880,31 @@ async def edit_stock(request: Request, stock_id: int, db: Session = Depends(get_
     
     # Mise à jour
     try:
-        stock.product_id = int(form.get('product_id', stock.product_id))
-        stock.zone_id = int(form.get('zone_id', stock.zone_id))
+        stock.product_id = int(form.get('product_id') or stock.product_id)
+        stock.zone_id = int(form.get('zone_id') or stock.zone_id)
         stock.quantity = float(form.get('quantity', stock.quantity))
         stock.notes = form.get('notes', stock.notes)
         db.commit()
         
+    except IntegrityError:
+        # Clé naturelle (NATURAL_KEY, voir upsert.py) : un autre relevé occupe déjà ce produit, cette zone et cette minute
+        db.rollback()
+        return templates.TemplateResponse(
+            "stocks/edit.html",
+            {
+                "request": request,
+                "stock": stock,
+                "errors": [upsert.CONFLICT_MESSAGE]
+            },
+            status_code=409
+        )
     except Exception as e:
         print(f"❌ Erreur modification stock: {e}")
     
     return RedirectResponse(url="/stocks", status_code=303)
 
 @app.get("/stocks/delete/{stock_id}")
-async def delete_stock(request: Request, stock_id: int, db: Session = Depends(get_db)):
+async def delete_stock(request: Request, stock_id: int, db: Session = Depends(get_write_db)):
     """Supprime un stock"""
     user = getattr(request.state, 'user', None)
     if not user:
@@ -821,14 +918,14 @@ async def delete_stock(request: Request, stock_id: int, db: Session = Depends(ge
     return RedirectResponse(url="/stocks", status_code=303)
 
 @app.get("/stocks/product/{product_id}")
-async def stocks_by_product(request: Request, product_id: int, db: Session = Depends(get_db)):
+async def stocks_by_product(request: Request, product_id: int, db: Session = Depends(get_read_db)):
     """Voir les stocks d'un produit spécifique"""
     user = getattr(request.state, 'user', None)
     if not user:
         return RedirectResponse(url="/login", status_code=303)
     
     stocks = db.query(models.Stock).filter(models.Stock.product_id == product_id).all()
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    product = refcache.get().product(product_id)
     
     return templates.TemplateResponse(
         "stocks/by_product.html",
@@ -840,14 +937,14 @@ async def stocks_by_product(request: Request, product_id: int, db: Session = Dep
     )
 
 @app.get("/stocks/zone/{zone_id}")
-async def stocks_by_zone(request: Request, zone_id: int, db: Session = Depends(get_db)):
+async def stocks_by_zone(request: Request, zone_id: int, db: Session = Depends(get_read_db)):
     """Voir les stocks d'une zone spécifique"""
     user = getattr(request.state, 'user', None)
     if not user:
         return RedirectResponse(url="/login", status_code=303)
     
     stocks = db.query(models.Stock).filter(models.Stock.zone_id == zone_id).all()
-    zone = db.query(models.Zone).filter(models.Zone.id == zone_id).first()
+    zone = refcache.get().zone(zone_id)
     
     return templates.TemplateResponse(
         "stocks/by_zone.html",
@@ -863,40 +960,34 @@ async def stocks_by_zone(request: Request, zone_id: int, db: Session = Depends(g
 # ============================================
 
 @app.get("/prices")
-async def list_prices(request: Request, db: Session = Depends(get_db)):
+async def list_prices(request: Request, db: Session = Depends(get_read_db)):
     """Liste tous les prix"""
     user = getattr(request.state, 'user', None)
     if not user:
         return RedirectResponse(url="/login", status_code=303)
     
     prices = db.query(models.Price).order_by(models.Price.date.desc()).all()
+    outlier_status = outliers.statuses(db, [p.id for p in prices])
     return templates.TemplateResponse(
         "prices/list.html",
-        {"request": request, "prices": prices}
+        {"request": request, "prices": prices, "outlier_status": outlier_status}
     )
 
 @app.get("/prices/add")
-async def add_price_form(request: Request, db: Session = Depends(get_db)):
+async def add_price_form(request: Request, db: Session = Depends(get_read_db)):
     """Formulaire d'ajout de prix"""
     user = getattr(request.state, 'user', None)
     if not user:
         return RedirectResponse(url="/login", status_code=303)
     
-    # Récupérer les produits et zones pour les menus déroulants
-    products = db.query(models.Product).order_by(models.Product.name).all()
-    zones = db.query(models.Zone).order_by(models.Zone.name).all()
-    
+    # Produit et zone : saisie assistée (/api/lookup), le catalogue n'est pas chargé
     return templates.TemplateResponse(
         "prices/form.html",
-        {
-            "request": request,
-            "products": products,
-            "zones": zones
-        }
+        {"request": request}
     )
 
 @app.post("/prices/add")
-async def add_price(request: Request, db: Session = Depends(get_db)):
+async def add_price(request: Request, db: Session = Depends(get_write_db)):
     """Ajoute un prix"""
     user = getattr(request.state, 'user', None)
     if not user:
@@ -905,13 +996,9 @@ async def add_price(request: Request, db: Session = Depends(get_db)):
     form = await request.form()
     errors = []
     
-    # Récupérer les produits et zones en cas d'erreur
-    products = db.query(models.Product).order_by(models.Product.name).all()
-    zones = db.query(models.Zone).order_by(models.Zone.name).all()
-    
     # Validation
     try:
-        product_id = int(form.get('product_id', 0))
+        product_id = int(form.get('product_id') or 0)
         if product_id <= 0:
             errors.append("Le produit est requis")
     except ValueError:
@@ -919,13 +1006,18 @@ async def add_price(request: Request, db: Session = Depends(get_db)):
         product_id = 0
     
     try:
-        zone_id = int(form.get('zone_id', 0))
+        zone_id = int(form.get('zone_id') or 0)
         if zone_id <= 0:
             errors.append("La zone est requise")
     except ValueError:
         errors.append("Zone invalide")
         zone_id = 0
     
+    if product_id > 0 and not refcache.product_exists(db, product_id):
+        errors.append("Produit introuvable")
+    if zone_id > 0 and not refcache.zone_exists(db, zone_id):
+        errors.append("Zone introuvable")
+    
     try:
         price_value = float(form.get('price', 0))
         if price_value <= 0:
@@ -940,30 +1032,29 @@ async def add_price(request: Request, db: Session = Depends(get_db)):
             {
                 "request": request,
                 "errors": errors,
-                "form": dict(form),
-                "products": products,
-                "zones": zones
+                "form": dict(form)
             }
         )
     
     # Création du prix
     try:
-        price = models.Price(
-            product_id=product_id,
-            zone_id=zone_id,
-            price=price_value,
-            notes=form.get('notes', ''),
-            created_by=user.id
-        )
+        values = {
+            "product_id": product_id,
+            "zone_id": zone_id,
+            "price": price_value,
+            "notes": form.get('notes', ''),
+            "created_by": user.id
+        }
         
         # Gestion de la date si fournie
         if form.get('date'):
             try:
-                price.date = datetime.fromisoformat(form.get('date'))
+                values["date"] = datetime.fromisoformat(form.get('date'))
             except:
                 pass
         
-        db.add(price)
+        # Même produit, zone et minute qu'un relevé existant : mise à jour (NATURAL_KEY, voir upsert.py)
+        upsert.save(db, models.Price, [values])
         db.commit()
         
         return RedirectResponse(url="/prices", status_code=303)
@@ -975,14 +1066,12 @@ async def add_price(request: Request, db: Session = Depends(get_db)):
             {
                 "request": request,
                 "errors": ["Erreur lors de l'enregistrement"],
-                "form": dict(form),
-                "products": products,
-                "zones": zones
+                "form": dict(form)
             }
         )
 
 @app.get("/prices/edit/{price_id}")
-async def edit_price_form(request: Request, price_id: int, db: Session = Depends(get_db)):
+async def edit_price_form(request: Request, price_id: int, db: Session = Depends(get_read_db)):
     """Formulaire d'édition de prix"""
     user = getattr(request.state, 'user', None)
     if not user:
@@ -992,21 +1081,16 @@ async def edit_price_form(request: Request, price_id: int, db: Session = Depends
     if not price:
         return RedirectResponse(url="/prices", status_code=303)
     
-    products = db.query(models.Product).order_by(models.Product.name).all()
-    zones = db.query(models.Zone).order_by(models.Zone.name).all()
-    
     return templates.TemplateResponse(
         "prices/edit.html",
         {
             "request": request,
-            "price": price,
-            "products": products,
-            "zones": zones
+            "price": price
         }
     )
 
 @app.post("/prices/edit/{price_id}")
-async def edit_price(request: Request, price_id: int, db: Session = Depends(get_db)):
+async def edit_price(request: Request, price_id: int, db: Session = Depends(get_write_db)):
     """Modifie un prix"""
     user = getattr(request.state, 'user', None)
     if not user:
@@ -1020,19 +1104,31 @@ async def edit_price(request: Request, price_id: int, db: Session = Depends(get_
     
     # Mise à jour
     try:
-        price.product_id = int(form.get('product_id', price.product_id))
-        price.zone_id = int(form.get('zone_id', price.zone_id))
+        price.product_id = int(form.get('product_id') or price.product_id)
+        price.zone_id = int(form.get('zone_id') or price.zone_id)
         price.price = float(form.get('price', price.price))
         price.notes = form.get('notes', price.notes)
         db.commit()
         
+    except IntegrityError:
+        # Clé naturelle (NATURAL_KEY, voir upsert.py) : un autre relevé occupe déjà ce produit, cette zone et cette minute
+        db.rollback()
+        return templates.TemplateResponse(
+            "prices/edit.html",
+            {
+                "request": request,
+                "price": price,
+                "errors": [upsert.CONFLICT_MESSAGE]
+            },
+            status_code=409
+        )
     except Exception as e:
         print(f"❌ Erreur modification prix: {e}")
     
     return RedirectResponse(url="/prices", status_code=303)
 
 @app.get("/prices/delete/{price_id}")
-async def delete_price(request: Request, price_id: int, db: Session = Depends(get_db)):
+async def delete_price(request: Request, price_id: int, db: Session = Depends(get_write_db)):
     """Supprime un prix"""
     user = getattr(request.state, 'user', None)
     if not user:
@@ -1046,14 +1142,14 @@ async def delete_price(request: Request, price_id: int, db: Session = Depends(ge
     return RedirectResponse(url="/prices", status_code=303)
 
 @app.get("/prices/product/{product_id}")
-async def prices_by_product(request: Request, product_id: int, db: Session = Depends(get_db)):
+async def prices_by_product(request: Request, product_id: int, db: Session = Depends(get_read_db)):
     """Voir les prix d'un produit spécifique"""
     user = getattr(request.state, 'user', None)
     if not user:
         return RedirectResponse(url="/login", status_code=303)
     
     prices = db.query(models.Price).filter(models.Price.product_id == product_id).order_by(models.Price.date.desc()).all()
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    product = refcache.get().product(product_id)
     
     return templates.TemplateResponse(
         "prices/by_product.html",
@@ -1065,14 +1161,14 @@ async def prices_by_product(request: Request, product_id: int, db: Session = Dep
     )
 
 @app.get("/prices/zone/{zone_id}")
-async def prices_by_zone(request: Request, zone_id: int, db: Session = Depends(get_db)):
+async def prices_by_zone(request: Request, zone_id: int, db: Session = Depends(get_read_db)):
     """Voir les prix d'une zone spécifique"""
     user = getattr(request.state, 'user', None)
     if not user:
         return RedirectResponse(url="/login", status_code=303)
     
     prices = db.query(models.Price).filter(models.Price.zone_id == zone_id).order_by(models.Price.date.desc()).all()
-    zone = db.query(models.Zone).filter(models.Zone.id == zone_id).first()
+    zone = refcache.get().zone(zone_id)
     
     return templates.TemplateResponse(
         "prices/by_zone.html",
@@ -1084,31 +1180,29 @@ async def prices_by_zone(request: Request, zone_id: int, db: Session = Depends(g
     )
 
 @app.get("/prices/latest")
-async def latest_prices(request: Request, db: Session = Depends(get_db)):
-    """Voir les derniers prix enregistrés"""
+async def latest_prices(
+    request: Request,
+    department: Optional[str] = None,
+    category: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """Dernier prix de chaque produit sur chaque marché (table latest_prices, voir spreads.py)"""
     user = getattr(request.state, 'user', None)
     if not user:
         return RedirectResponse(url="/login", status_code=303)
     
-    # Récupérer les prix les plus récents pour chaque produit
-    from sqlalchemy import func
-    
-    subquery = db.query(
-        models.Price.product_id,
-        func.max(models.Price.date).label('max_date')
-    ).group_by(models.Price.product_id).subquery()
-    
-    latest_prices = db.query(models.Price).join(
-        subquery,
-        (models.Price.product_id == subquery.c.product_id) &
-        (models.Price.date == subquery.c.max_date)
-    ).order_by(models.Price.date.desc()).all()
+    refs = refcache.get()
+    board = spreads.latest_board(db, department=department or None, category=category or None)
     
     return templates.TemplateResponse(
         "prices/latest.html",
         {
             "request": request,
-            "prices": latest_prices
+            "board": board,
+            "departments": refs.departments(),
+            "categories": sorted({p.category for p in refs.products.values() if p.category}),
+            "department": department or "",
+            "category": category or ""
         }
     )
 
@@ -1117,62 +1211,467 @@ async def latest_prices(request: Request, db: Session = Depends(get_db)):
 # 14. ROUTES API (optionnelles)
 # ============================================
 @app.get("/api/products")
-async def get_products(request: Request, db: Session = Depends(get_db)):
+async def get_products(request: Request, db: Session = Depends(get_read_db)):
     """API pour les produits"""
     user = getattr(request.state, 'user', None)
     if not user:
         return {"error": "Non authentifié"}
     
-    products = db.query(models.Product).all()
-    return products
+    return list(refcache.get().products.values())
 
 @app.get("/api/zones")
-async def get_zones(request: Request, db: Session = Depends(get_db)):
+async def get_zones(request: Request, db: Session = Depends(get_read_db)):
     """API pour les zones"""
     user = getattr(request.state, 'user', None)
     if not user:
         return {"error": "Non authentifié"}
     
-    zones = db.query(models.Zone).all()
-    return zones
+    return list(refcache.get().zones.values())
 
 @app.get("/api/stocks")
-async def get_stocks(request: Request, db: Session = Depends(get_db)):
-    """API pour les stocks"""
+async def get_stocks(
+    request: Request,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    db: Session = Depends(get_read_db)
+):
+    """API pour les stocks (from / to : période, relevés archivés compris)"""
     user = getattr(request.state, 'user', None)
     if not user:
         return {"error": "Non authentifié"}
     
-    stocks = db.query(models.Stock).all()
-    return stocks
+    try:
+        start = series.parse_day(date_from)
+        end = series.parse_day(date_to)
+    except ValueError:
+        return JSONResponse({"error": "Dates attendues au format AAAA-MM-JJ"}, status_code=400)
+    return archive.observations(db, models.Stock, start, end)
 
 @app.get("/api/prices")
-async def get_prices(request: Request, db: Session = Depends(get_db)):
-    """API pour les prix"""
+async def get_prices(
+    request: Request,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    db: Session = Depends(get_read_db)
+):
+    """API pour les prix (from / to : période, relevés archivés compris)"""
+    user = getattr(request.state, 'user', None)
+    if not user:
+        return {"error": "Non authentifié"}
+    
+    try:
+        start = series.parse_day(date_from)
+        end = series.parse_day(date_to)
+    except ValueError:
+        return JSONResponse({"error": "Dates attendues au format AAAA-MM-JJ"}, status_code=400)
+    return archive.observations(db, models.Price, start, end)
+
+@app.get("/api/export/prices.{fmt}")
+async def export_prices(
+    request: Request,
+    fmt: str,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    product_id: Optional[int] = None,
+    zone_id: Optional[int] = None
+):
+    """Export des prix en Parquet ou Arrow (noms de produit et de zone compris), envoyé par lots"""
+    user = getattr(request.state, 'user', None)
+    if not user:
+        return {"error": "Non authentifié"}
+    
+    if fmt not in export.FORMATS:
+        return JSONResponse({"error": f"Format attendu : {', '.join(export.FORMATS)}"}, status_code=400)
+    if not export.AVAILABLE:
+        return JSONResponse({"error": "Export indisponible : pyarrow n'est pas installé"}, status_code=501)
+    try:
+        start = series.parse_day(date_from)
+        end = series.parse_day(date_to)
+    except ValueError:
+        return JSONResponse({"error": "Dates attendues au format AAAA-MM-JJ"}, status_code=400)
+    
+    # Session ouverte pour la durée du flux (une dépendance serait fermée avant l'envoi)
+    db = database.read_session(request)
+    filename = f"prices_{start or 'debut'}_{end or 'fin'}.{fmt}"
+    return StreamingResponse(
+        export.stream_prices(db, fmt, start, end, product_id, zone_id),
+        media_type=export.FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/api/lookup/{kind}")
+async def lookup_api(
+    request: Request,
+    kind: str,
+    q: str = "",
+    limit: int = Query(10, ge=1, le=50)
+):
+    """Saisie assistée : produits ou zones dont un mot commence par q (sans accents)"""
+    user = getattr(request.state, 'user', None)
+    if not user:
+        return {"error": "Non authentifié"}
+    
+    if kind not in lookup.LOADERS:
+        return JSONResponse({"error": "kind doit valoir products ou zones"}, status_code=400)
+    return lookup.lookup(kind, q, limit=limit)
+
+@app.get("/api/search")
+async def search_api(
+    request: Request,
+    q: str = "",
+    kind: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_read_db)
+):
+    """Recherche plein texte (produits, zones, notes), insensible aux accents, classée par pertinence"""
+    user = getattr(request.state, 'user', None)
+    if not user:
+        return {"error": "Non authentifié"}
+    
+    if len(q.strip()) < 2:
+        return JSONResponse({"error": "Paramètre q requis (2 caractères au moins)"}, status_code=400)
+    kinds = kind.split(",") if kind else None
+    if kinds and not set(kinds) <= set(search.KINDS):
+        return JSONResponse({"error": f"kind doit valoir {', '.join(search.KINDS)}"}, status_code=400)
+    
+    return {"query": q, "results": search.search(db, q, kinds=kinds, limit=limit)}
+
+@app.get("/api/prices/series")
+async def get_price_series(
+    request: Request,
+    product_id: Optional[int] = None,
+    zone_id: Optional[int] = None,
+    department: Optional[str] = None,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    granularity: str = "day",
+    points: int = Query(500, ge=3, le=5000),
+    db: Session = Depends(get_read_db)
+):
+    """Série de prix regroupée (day|week|month|season) et sous-échantillonnée"""
+    user = getattr(request.state, 'user', None)
+    if not user:
+        return {"error": "Non authentifié"}
+    
+    if granularity not in series.GRANULARITIES:
+        return JSONResponse(
+            {"error": f"granularity doit valoir {', '.join(series.GRANULARITIES)}"},
+            status_code=400
+        )
+    try:
+        start = series.parse_day(date_from)
+        end = series.parse_day(date_to)
+    except ValueError:
+        return JSONResponse({"error": "Dates attendues au format AAAA-MM-JJ"}, status_code=400)
+    
+    data = series.price_series(
+        db, granularity=granularity, product_id=product_id, zone_id=zone_id,
+        department=department, start=start, end=end
+    )
+    return series.to_chart(series.downsample(data, points), granularity)
+
+@app.get("/api/prices/index")
+async def get_price_index(
+    request: Request,
+    scope: str = price_index.NATIONAL,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    db: Session = Depends(get_read_db)
+):
+    """Indice des prix alimentaires (base 100), national ou par département"""
+    user = getattr(request.state, 'user', None)
+    if not user:
+        return {"error": "Non authentifié"}
+    
+    try:
+        start = series.parse_day(date_from)
+        end = series.parse_day(date_to)
+    except ValueError:
+        return JSONResponse({"error": "Dates attendues au format AAAA-MM-JJ"}, status_code=400)
+    
+    return price_index.index_series(db, scope=scope, start=start, end=end)
+
+@app.get("/api/prices/spread")
+async def get_price_spread(
+    request: Request,
+    product_id: int,
+    department: Optional[str] = None,
+    zones: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """Derniers prix par marché, écarts par département et matrice d'écarts (?zones=1,2,3)"""
+    user = getattr(request.state, 'user', None)
+    if not user:
+        return {"error": "Non authentifié"}
+    
+    try:
+        zone_ids = [int(z) for z in zones.split(",") if z.strip()] if zones else None
+    except ValueError:
+        return JSONResponse({"error": "zones doit être une liste d'identifiants séparés par des virgules"}, status_code=400)
+    
+    return spreads.spread_matrix(db, product_id, department=department, zone_ids=zone_ids)
+
+@app.get("/api/prices/latest")
+async def get_latest_prices(
+    request: Request,
+    department: Optional[str] = None,
+    category: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """Dernier prix par produit et par marché, avec min/max/médiane (national ou du département)"""
+    user = getattr(request.state, 'user', None)
+    if not user:
+        return {"error": "Non authentifié"}
+    
+    return spreads.latest_board(db, department=department or None, category=category or None)
+
+@app.get("/api/prices/forecast")
+async def get_price_forecast(
+    request: Request,
+    product_id: int,
+    zone_id: Optional[int] = None,
+    db: Session = Depends(get_read_db)
+):
+    """Prévisions hebdomadaires (calculées en tâche de fond) avec intervalles 80 % et 95 %"""
+    user = getattr(request.state, 'user', None)
+    if not user:
+        return {"error": "Non authentifié"}
+    
+    return {
+        "product_id": product_id,
+        "series": forecast.forecasts_for(db, product_id, zone_id=zone_id)
+    }
+
+@app.get("/api/prices/outliers")
+async def get_price_outliers(
+    request: Request,
+    status: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_read_db)
+):
+    """Prix aberrants détectés à l'écriture (flagged, quarantined, accepted)"""
+    user = getattr(request.state, 'user', None)
+    if not user:
+        return {"error": "Non authentifié"}
+    
+    return outliers.list_outliers(db, status=status, limit=limit)
+
+@app.post("/api/prices/outliers/{price_id}/accept")
+async def accept_price_outlier(request: Request, price_id: int, db: Session = Depends(get_write_db)):
+    """Sort un prix de quarantaine (il rejoint les moyennes et statistiques)"""
+    user = getattr(request.state, 'user', None)
+    if not user or not user.is_admin:
+        return JSONResponse({"error": "Accès réservé aux administrateurs"}, status_code=403)
+    
+    if not outliers.accept(db, price_id):
+        return JSONResponse({"error": "Prix aberrant introuvable ou déjà accepté"}, status_code=404)
+    return {"price_id": price_id, "status": outliers.ACCEPTED}
+
+@app.get("/api/analytics/volatility")
+async def get_volatility(
+    request: Request,
+    days: int = Query(90, ge=2, le=3650),
+    window: int = Query(14, ge=2, le=365),
+    change_periods: int = Query(7, ge=1, le=365),
+    product_id: Optional[int] = None,
+    department: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=1000),
+    db: Session = Depends(get_read_db)
+):
+    """Séries produit × zone classées par volatilité (coefficient de variation)"""
+    user = getattr(request.state, 'user', None)
+    if not user:
+        return {"error": "Non authentifié"}
+    
+    return {
+        "days": days,
+        "window": window,
+        "series": analytics.volatility_ranking(
+            db, days=days, window=window, change_periods=change_periods,
+            limit=limit, product_id=product_id, department=department
+        )
+    }
+
+@app.get("/api/stocks/projections")
+async def get_stock_projections(
+    request: Request,
+    department: Optional[str] = None,
+    days: int = Query(depletion.ALERT_DAYS, ge=1, le=365),
+    limit: int = Query(50, ge=1, le=1000),
+    db: Session = Depends(get_read_db)
+):
+    """Stocks classés par date de rupture estimée (rythme d'écoulement observé)"""
+    user = getattr(request.state, 'user', None)
+    if not user:
+        return {"error": "Non authentifié"}
+    
+    return depletion.urgent(db, limit=limit, department=department, days=days)
+
+@app.get("/api/alerts/rules")
+async def get_alert_rules(request: Request, db: Session = Depends(get_read_db)):
+    """Règles d'alerte de l'utilisateur et règles communes"""
     user = getattr(request.state, 'user', None)
     if not user:
         return {"error": "Non authentifié"}
     
-    prices = db.query(models.Price).all()
-    return prices
+    return db.query(models.AlertRule).filter(
+        (models.AlertRule.user_id == user.id) | (models.AlertRule.user_id.is_(None))
+    ).order_by(models.AlertRule.id).all()
+
+@app.post("/api/alerts/rules")
+async def create_alert_rule(request: Request, db: Session = Depends(get_write_db)):
+    """Crée une règle d'alerte (JSON : name, kind, threshold, product_id, zone_id, department, global)"""
+    user = getattr(request.state, 'user', None)
+    if not user:
+        return {"error": "Non authentifié"}
+    
+    try:
+        data = await request.json()
+        threshold = float(data.get("threshold"))
+    except (ValueError, TypeError):
+        return JSONResponse({"error": "Corps JSON avec un seuil (threshold) numérique attendu"}, status_code=400)
+    if data.get("kind") not in alerts.KINDS:
+        return JSONResponse({"error": f"kind doit valoir {', '.join(alerts.KINDS)}"}, status_code=400)
+    if data.get("global") and not user.is_admin:
+        return JSONResponse({"error": "Seuls les administrateurs créent des règles communes"}, status_code=403)
+    
+    rule = models.AlertRule(
+        name=data.get("name") or data["kind"],
+        kind=data["kind"],
+        product_id=data.get("product_id"),
+        zone_id=data.get("zone_id"),
+        department=data.get("department"),
+        threshold=threshold,
+        user_id=None if data.get("global") else user.id
+    )
+    db.add(rule)
+    db.commit()
+    db.refresh(rule)
+    return rule
+
+@app.delete("/api/alerts/rules/{rule_id}")
+async def delete_alert_rule(request: Request, rule_id: int, db: Session = Depends(get_write_db)):
+    """Supprime une règle d'alerte (la sienne, ou une règle commune pour un administrateur)"""
+    user = getattr(request.state, 'user', None)
+    if not user:
+        return {"error": "Non authentifié"}
+    
+    rule = db.query(models.AlertRule).filter(models.AlertRule.id == rule_id).first()
+    if not rule or (rule.user_id != user.id and not user.is_admin):
+        return JSONResponse({"error": "Règle introuvable"}, status_code=404)
+    db.delete(rule)
+    db.commit()
+    return {"deleted": rule_id}
+
+@app.get("/api/subscriptions")
+async def get_subscriptions(request: Request, db: Session = Depends(get_read_db)):
+    """Abonnements aux seuils de prix de l'utilisateur"""
+    user = getattr(request.state, 'user', None)
+    if not user:
+        return {"error": "Non authentifié"}
+    
+    return subscriptions.list_subscriptions(db, user.id)
+
+@app.post("/api/subscriptions")
+async def create_subscription(request: Request, db: Session = Depends(get_write_db)):
+    """Crée un abonnement (JSON : product_id, direction, threshold, zone_id ou department)"""
+    user = getattr(request.state, 'user', None)
+    if not user:
+        return {"error": "Non authentifié"}
+    
+    try:
+        data = await request.json()
+        threshold = float(data.get("threshold"))
+        product_id = int(data.get("product_id"))
+        zone_id = int(data["zone_id"]) if data.get("zone_id") else None
+    except (ValueError, TypeError):
+        return JSONResponse({"error": "Corps JSON avec product_id et threshold numériques attendu"}, status_code=400)
+    if data.get("direction") not in subscriptions.DIRECTIONS:
+        return JSONResponse({"error": f"direction doit valoir {', '.join(subscriptions.DIRECTIONS)}"}, status_code=400)
+    if not refcache.product_exists(db, product_id):
+        return JSONResponse({"error": "Produit introuvable"}, status_code=400)
+    
+    subscription = models.PriceSubscription(
+        user_id=user.id,
+        product_id=product_id,
+        zone_id=zone_id,
+        department=None if zone_id else data.get("department"),
+        direction=data["direction"],
+        threshold=threshold
+    )
+    db.add(subscription)
+    db.commit()
+    db.refresh(subscription)
+    return subscription
+
+@app.delete("/api/subscriptions/{subscription_id}")
+async def delete_subscription(request: Request, subscription_id: int, db: Session = Depends(get_write_db)):
+    """Supprime un abonnement de l'utilisateur"""
+    user = getattr(request.state, 'user', None)
+    if not user:
+        return {"error": "Non authentifié"}
+    
+    subscription = db.query(models.PriceSubscription).filter(
+        models.PriceSubscription.id == subscription_id,
+        models.PriceSubscription.user_id == user.id
+    ).first()
+    if not subscription:
+        return JSONResponse({"error": "Abonnement introuvable"}, status_code=404)
+    db.delete(subscription)
+    db.commit()
+    return {"deleted": subscription_id}
+
+@app.get("/api/notifications")
+async def get_notifications(
+    request: Request,
+    unread: bool = False,
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_read_db)
+):
+    """Notifications de l'utilisateur (les plus récentes d'abord)"""
+    user = getattr(request.state, 'user', None)
+    if not user:
+        return {"error": "Non authentifié"}
+    
+    return alerts.list_notifications(db, user.id, unread_only=unread, limit=limit)
+
+@app.post("/api/notifications/{notification_id}/read")
+async def read_notification(request: Request, notification_id: int, db: Session = Depends(get_write_db)):
+    """Marque une notification lue (appelé par la page qui l'affiche)"""
+    user = getattr(request.state, 'user', None)
+    if not user:
+        return {"error": "Non authentifié"}
+    
+    if not alerts.mark_read(db, user.id, notification_id):
+        return JSONResponse({"error": "Notification introuvable"}, status_code=404)
+    return {"id": notification_id, "read": True}
 
 @app.get("/api/stats")
-async def get_stats(request: Request, db: Session = Depends(get_db)):
+async def get_stats(request: Request, db: Session = Depends(get_read_db)):
     """API pour les statistiques"""
     user = getattr(request.state, 'user', None)
     if not user:
         return {"error": "Non authentifié"}
     
     return {
-        "products_count": db.query(models.Product).count(),
-        "zones_count": db.query(models.Zone).count(),
+        "products_count": len(refcache.get().products),
+        "zones_count": len(refcache.get().zones),
         "stocks_count": db.query(models.Stock).count(),
         "prices_count": db.query(models.Price).count()
     }
 
 # ============================================
-# 15. POINT D'ENTRÉE
+# 15. MÉTRIQUES PROMETHEUS
+# ============================================
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Métriques au format texte Prometheus"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# ============================================
+# 16. POINT D'ENTRÉE
 # ============================================
 if __name__ == "__main__":
+    # Développement (un processus, rechargement du code) ; en production : python serve.py
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
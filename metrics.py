@@ -0,0 +1,358 @@
+# metrics.py
+"""
+Métriques de l'application au format texte Prometheus.
+
+- latence et nombre de requêtes HTTP par route, requêtes en cours
+- nombre d'instructions SQL et temps passé en base par requête HTTP
+- temps de rendu des templates Jinja2 (hors requêtes SQL déclenchées au rendu)
+- attente pour obtenir une connexion du pool
+- taux de succès des caches applicatifs
+
+Chaque réponse porte aussi un en-tête Server-Timing (authentification, SQL,
+rendu, total) lisible dans les outils de développement du navigateur ;
+SERVER_TIMING=0 le désactive.
+
+Les compteurs sont globaux au processus ; chaque worker expose les siens.
+"""
+import contextvars
+import os
+import threading
+import time
+
+from sqlalchemy import event
+
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "1") != "0"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+_lock = threading.Lock()
+_registry = []
+
+
+# ============================================
+# 1. TYPES DE MÉTRIQUES
+# ============================================
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        super().__init__(name, documentation, labelnames)
+        self._collect = collect
+
+    def set(self, value, **labels):
+        with _lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        if self._collect:
+            self._collect(self)
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            items = sorted((key, ([*counts], total, count)) for key, (counts, total, count) in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+# ============================================
+# 2. MÉTRIQUES DE L'APPLICATION
+# ============================================
+HTTP_REQUESTS = Counter(
+    "agrisuivi_http_requests_total", "Requêtes HTTP traitées", ("method", "route", "status"))
+HTTP_LATENCY = Histogram(
+    "agrisuivi_http_request_duration_seconds", "Durée des requêtes HTTP", ("method", "route"))
+HTTP_IN_FLIGHT = Gauge(
+    "agrisuivi_http_requests_in_flight", "Requêtes HTTP en cours de traitement")
+
+DB_STATEMENTS_TOTAL = Counter(
+    "agrisuivi_db_statements_total", "Instructions SQL exécutées")
+DB_STATEMENTS_PER_REQUEST = Histogram(
+    "agrisuivi_db_statements_per_request", "Instructions SQL par requête HTTP", ("route",), COUNT_BUCKETS)
+DB_TIME_PER_REQUEST = Histogram(
+    "agrisuivi_db_time_per_request_seconds", "Temps passé en base par requête HTTP", ("route",))
+
+TEMPLATE_RENDER = Histogram(
+    "agrisuivi_template_render_seconds", "Temps de rendu Jinja2 (hors SQL)", ("template",))
+
+POOL_CHECKOUT_WAIT = Histogram(
+    "agrisuivi_db_pool_checkout_wait_seconds", "Attente pour obtenir une connexion du pool",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+
+CACHE_REQUESTS = Counter(
+    "agrisuivi_cache_requests_total", "Accès aux caches applicatifs", ("cache", "result"))
+
+
+def _collect_cache_ratio(gauge):
+    with _lock:
+        totals = {}
+        for (cache, result), value in CACHE_REQUESTS._values.items():
+            hits, total = totals.get(cache, (0, 0))
+            totals[cache] = (hits + (value if result == "hit" else 0), total + value)
+        gauge._values = {(cache,): hits / total for cache, (hits, total) in totals.items() if total}
+
+
+CACHE_HIT_RATIO = Gauge(
+    "agrisuivi_cache_hit_ratio", "Taux de succès des caches applicatifs", ("cache",),
+    collect=_collect_cache_ratio)
+
+_engines = []
+
+
+def _collect_pool(gauge):
+    values = {}
+    for engine, name in _engines:
+        pool = engine.pool
+        for stat in ("checkedout", "checkedin", "overflow", "size"):
+            getter = getattr(pool, stat, None)
+            if getter is not None:
+                values[(name, stat)] = getter()
+    with _lock:
+        gauge._values = values
+
+
+POOL_STATUS = Gauge(
+    "agrisuivi_db_pool_connections", "État du pool de connexions", ("engine", "state"),
+    collect=_collect_pool)
+
+
+LIVE_SUBSCRIBERS = Gauge(
+    "agrisuivi_live_subscribers", "Tableaux de bord connectés en direct (SSE)")
+LIVE_EVENTS = Counter(
+    "agrisuivi_live_events_total", "Événements diffusés aux tableaux de bord", ("event",))
+
+
+def record_cache(cache, hit):
+    """À appeler par les caches applicatifs à chaque consultation"""
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def render():
+    """Toutes les métriques au format texte Prometheus"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ============================================
+# 3. STATISTIQUES PAR REQUÊTE HTTP
+# ============================================
+class RequestStats:
+    """Compteurs de la requête HTTP en cours (partagés via contextvars)"""
+
+    __slots__ = ("start", "statements", "db_time", "render_time", "pool_wait", "auth_time")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.pool_wait = 0.0
+        self.auth_time = 0.0
+
+    def server_timing(self, total):
+        """Valeur de l'en-tête Server-Timing (durées en millisecondes, ASCII uniquement)"""
+        return ", ".join([
+            f'auth;dur={self.auth_time * 1000:.2f};desc="Authentification"',
+            f'db;dur={self.db_time * 1000:.2f};desc="SQL ({self.statements})"',
+            f'render;dur={self.render_time * 1000:.2f};desc="Jinja2"',
+            f'total;dur={total * 1000:.2f}',
+        ])
+
+
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+def record_auth_time(seconds):
+    """Temps passé par le middleware d'authentification à charger l'utilisateur"""
+    stats = current_request.get()
+    if stats is not None:
+        stats.auth_time += seconds
+
+
+def _route_label(request):
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or "non_trouvée"
+
+
+async def track_request(request, call_next):
+    """Corps du middleware HTTP : mesure la requête et met à jour les métriques"""
+    stats = RequestStats()
+    token = current_request.set(stats)
+    HTTP_IN_FLIGHT.inc()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        if SERVER_TIMING:
+            response.headers["Server-Timing"] = stats.server_timing(time.perf_counter() - stats.start)
+        return response
+    finally:
+        elapsed = time.perf_counter() - stats.start
+        HTTP_IN_FLIGHT.dec()
+        current_request.reset(token)
+        route = _route_label(request)
+        HTTP_REQUESTS.inc(method=request.method, route=route, status=status)
+        HTTP_LATENCY.observe(elapsed, method=request.method, route=route)
+        DB_STATEMENTS_PER_REQUEST.observe(stats.statements, route=route)
+        DB_TIME_PER_REQUEST.observe(stats.db_time, route=route)
+
+
+# ============================================
+# 4. INSTRUMENTATION SQLALCHEMY ET JINJA2
+# ============================================
+def _wrap_pool(engine):
+    pool = engine.pool
+    original = pool.connect
+
+    def connect():
+        start = time.perf_counter()
+        try:
+            return original()
+        finally:
+            waited = time.perf_counter() - start
+            POOL_CHECKOUT_WAIT.observe(waited)
+            stats = current_request.get()
+            if stats is not None:
+                stats.pool_wait += waited
+
+    pool.connect = connect
+
+
+def instrument_engine(engine, name=None):
+    """Branche les écouteurs SQL et le chronométrage du pool sur un moteur
+    (`name` : étiquette du pool, ex: primary, replica-1)"""
+    _engines.append((engine, name or engine.url.get_backend_name()))
+    _wrap_pool(engine)
+
+    @event.listens_for(engine, "engine_disposed")
+    def rewrap_pool(conn):
+        # dispose() recrée le pool : on le rechronomètre
+        _wrap_pool(engine)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+        DB_STATEMENTS_TOTAL.inc()
+        stats = current_request.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.db_time += elapsed
+
+
+def instrument_templates(templates):
+    """Chronomètre le rendu de chaque TemplateResponse"""
+    original = templates.TemplateResponse
+
+    def TemplateResponse(*args, **kwargs):
+        name = kwargs.get("name") or next((a for a in args if isinstance(a, str)), "?")
+        stats = current_request.get()
+        db_before = stats.db_time if stats is not None else 0.0
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            if stats is not None:
+                # Les chargements paresseux déclenchés par le template comptent déjà en base
+                elapsed -= stats.db_time - db_before
+                stats.render_time += elapsed
+            TEMPLATE_RENDER.observe(max(elapsed, 0.0), template=name)
+
+    templates.TemplateResponse = TemplateResponse
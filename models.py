@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, Text, Boolean, Index
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -44,6 +44,10 @@ class Zone(Base):
 
 class Stock(Base):
     __tablename__ = "stocks"
+    __table_args__ = (
+        Index("ix_stocks_product_zone_date", "product_id", "zone_id", "date"),
+        Index("ix_stocks_date", "date"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     product_id = Column(Integer, ForeignKey("products.id"))
@@ -59,6 +63,10 @@ class Stock(Base):
 
 class Price(Base):
     __tablename__ = "prices"
+    __table_args__ = (
+        Index("ix_prices_product_zone_date", "product_id", "zone_id", "date"),
+        Index("ix_prices_date", "date"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     product_id = Column(Integer, ForeignKey("products.id"))
@@ -70,4 +78,217 @@ class Price(Base):
     
     product = relationship("Product", back_populates="prices")
     zone = relationship("Zone", back_populates="prices")
-    creator = relationship("User")
\ No newline at end of file
+    creator = relationship("User")
+
+class PriceDaily(Base):
+    """Agrégat journalier des prix par produit et zone (maintenu à l'écriture, voir rollups.py)"""
+    __tablename__ = "price_daily"
+    __table_args__ = (
+        Index("ix_price_daily_day", "day"),
+    )
+    
+    product_id = Column(Integer, primary_key=True)
+    zone_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    total = Column(Float)
+    count = Column(Integer)
+    min_price = Column(Float)
+    max_price = Column(Float)
+    updated_at = Column(DateTime, default=datetime.now, index=True)
+
+class PriceIndexBase(Base):
+    """Prix de référence du panier (période de base de l'indice, voir price_index.py)"""
+    __tablename__ = "price_index_base"
+    
+    product_id = Column(Integer, primary_key=True)
+    scope = Column(String(50), primary_key=True)  # département ou "national"
+    base_price = Column(Float)
+    computed_at = Column(DateTime, default=datetime.now)
+
+class PriceIndexBasket(Base):
+    """Panier de l'indice : poids et période de référence de chaque produit (voir price_index.py)"""
+    __tablename__ = "price_index_basket"
+    
+    product_id = Column(Integer, primary_key=True)
+    weight = Column(Float)
+    base_start = Column(Date, nullable=True)  # vide = produit encore jamais relevé
+    base_end = Column(Date, nullable=True)
+    computed_at = Column(DateTime, default=datetime.now)
+
+class PriceIndex(Base):
+    """Indice des prix alimentaires (Laspeyres) par jour, par département et national"""
+    __tablename__ = "price_index"
+    
+    day = Column(Date, primary_key=True)
+    scope = Column(String(50), primary_key=True)  # département ou "national"
+    value = Column(Float)
+    coverage = Column(Float)  # part du panier (en poids) observée ce jour
+    products_count = Column(Integer)
+    updated_at = Column(DateTime, default=datetime.now)
+
+class PriceStats(Base):
+    """Statistiques glissantes (Welford, sur le log du prix) par produit et zone, voir outliers.py"""
+    __tablename__ = "price_stats"
+    
+    product_id = Column(Integer, primary_key=True)
+    zone_id = Column(Integer, primary_key=True)
+    count = Column(Integer, default=0)
+    mean = Column(Float, default=0.0)
+    m2 = Column(Float, default=0.0)  # somme des carrés des écarts à la moyenne
+    updated_at = Column(DateTime, default=datetime.now)
+
+class PriceOutlier(Base):
+    """Prix aberrant détecté à l'écriture (signalé ou mis en quarantaine)"""
+    __tablename__ = "price_outliers"
+    __table_args__ = (
+        Index("ix_price_outliers_status", "status"),
+    )
+    
+    # Pas de clé étrangère vers prices.id : compatible avec le partitionnement de prices
+    price_id = Column(Integer, primary_key=True)
+    product_id = Column(Integer)
+    zone_id = Column(Integer)
+    price = Column(Float)
+    expected = Column(Float)  # prix typique (moyenne géométrique) au moment de la détection
+    zscore = Column(Float)
+    status = Column(String(20))  # flagged, quarantined, accepted
+    detected_at = Column(DateTime, default=datetime.now)
+
+class PriceForecast(Base):
+    """Prévisions hebdomadaires de prix par produit et zone (voir forecast.py)"""
+    __tablename__ = "price_forecasts"
+    
+    product_id = Column(Integer, primary_key=True)
+    zone_id = Column(Integer, primary_key=True)
+    week = Column(Date, primary_key=True)  # lundi de la semaine prévue
+    horizon = Column(Integer)  # en semaines après la dernière semaine observée
+    forecast = Column(Float)
+    lower_80 = Column(Float)
+    upper_80 = Column(Float)
+    lower_95 = Column(Float)
+    upper_95 = Column(Float)
+    model = Column(String(50))
+    last_observed = Column(Date)
+    fitted_at = Column(DateTime, default=datetime.now, index=True)
+
+class LatestPrice(Base):
+    """Dernier prix connu par produit et zone (maintenu à l'écriture, voir spreads.py)"""
+    __tablename__ = "latest_prices"
+    __table_args__ = (
+        Index("ix_latest_prices_zone", "zone_id"),
+    )
+    
+    product_id = Column(Integer, primary_key=True)
+    zone_id = Column(Integer, primary_key=True)
+    price_id = Column(Integer)
+    price = Column(Float)
+    date = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.now)
+
+class PriceSpread(Base):
+    """Écarts de prix entre marchés par produit, par département et national (voir spreads.py)"""
+    __tablename__ = "price_spreads"
+    
+    product_id = Column(Integer, primary_key=True)
+    scope = Column(String(50), primary_key=True)  # département ou "national"
+    zones_count = Column(Integer)
+    min_price = Column(Float)
+    min_zone_id = Column(Integer)
+    max_price = Column(Float)
+    max_zone_id = Column(Integer)
+    median_price = Column(Float)
+    updated_at = Column(DateTime, default=datetime.now)
+
+class StockProjection(Base):
+    """Rythme d'écoulement et date de rupture estimée par produit et zone (voir depletion.py)"""
+    __tablename__ = "stock_projections"
+    
+    product_id = Column(Integer, primary_key=True)
+    zone_id = Column(Integer, primary_key=True)
+    quantity = Column(Float)  # dernier relevé
+    last_date = Column(DateTime)
+    daily_rate = Column(Float)  # quantité consommée par jour (0 si pas de baisse observée)
+    stockout_date = Column(DateTime, nullable=True, index=True)
+    observations = Column(Integer)
+    computed_at = Column(DateTime, default=datetime.now)
+
+class AlertRule(Base):
+    """Règle d'alerte évaluée à chaque écriture de stock ou de prix (voir alerts.py)"""
+    __tablename__ = "alert_rules"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100))
+    kind = Column(String(20))  # stock_below, stock_cover, price_jump
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=True)  # vide = tous les produits
+    zone_id = Column(Integer, ForeignKey("zones.id"), nullable=True)  # vide = toutes les zones
+    department = Column(String(50), nullable=True)
+    threshold = Column(Float)  # quantité, jours de couverture ou variation en %
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)  # vide = tous les utilisateurs
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.now)
+
+class Notification(Base):
+    """Notification d'un utilisateur, affichée via get_notification jusqu'à ce qu'elle soit lue"""
+    __tablename__ = "notifications"
+    __table_args__ = (
+        Index("ix_notifications_user_unread", "user_id", "read_at", "id"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    rule_id = Column(Integer, nullable=True)
+    type = Column(String(20))  # success, info, warning, error (classes CSS de notifications.html)
+    message = Column(String(300))
+    product_id = Column(Integer, nullable=True)
+    zone_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+    read_at = Column(DateTime, nullable=True)
+
+class CacheVersion(Base):
+    """Version des données d'un cache en mémoire, incrémentée à chaque écriture (voir subscriptions.py)"""
+    __tablename__ = "cache_versions"
+    
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, default=0)
+
+class PriceSubscription(Base):
+    """Abonnement d'un utilisateur au franchissement d'un seuil de prix (voir subscriptions.py)"""
+    __tablename__ = "price_subscriptions"
+    __table_args__ = (
+        Index("ix_price_subscriptions_product_zone", "product_id", "zone_id"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    product_id = Column(Integer, ForeignKey("products.id"))
+    zone_id = Column(Integer, ForeignKey("zones.id"), nullable=True)  # vide = toutes les zones
+    department = Column(String(50), nullable=True)  # si pas de zone ; vide = tout le pays
+    direction = Column(String(10))  # above, below
+    threshold = Column(Float)
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.now)
+
+class SearchDocument(Base):
+    """Texte indexé pour la recherche (produits, zones, notes ; voir search.py)"""
+    __tablename__ = "search_documents"
+    __table_args__ = (
+        Index("ix_search_documents_ref", "kind", "ref_id", unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(10))  # product, zone, stock, price
+    ref_id = Column(Integer)
+    title = Column(String(200))
+    body = Column(Text)
+    plain = Column(Text)  # titre et texte sans accents, en minuscules (recherche LIKE de secours)
+    updated_at = Column(DateTime, default=datetime.now)
+
+class LiveEvent(Base):
+    """Événement du tableau de bord partagé entre workers (voir live.py, LIVE_SHARED)"""
+    __tablename__ = "live_events"
+    
+    id = Column(Integer, primary_key=True)
+    event = Column(String(20))
+    data = Column(Text)  # JSON
+    user_id = Column(Integer, nullable=True)  # vide = tous les tableaux de bord
+    created_at = Column(DateTime, default=datetime.now, index=True)
@@ -0,0 +1,116 @@
+# nplusone.py
+"""
+Détecteur de requêtes N+1 (mode développement).
+
+Activation par variables d'environnement :
+    NPLUSONE_MODE=log      -> affiche un avertissement en fin de requête
+    NPLUSONE_MODE=raise    -> lève NPlusOneError dès que le seuil est dépassé
+    NPLUSONE_THRESHOLD=5   -> nombre d'exécutions tolérées d'une même forme de requête
+
+Les instructions SQL d'une requête HTTP sont regroupées par forme normalisée
+(littéraux et listes IN remplacés par ?). Quand une forme dépasse le seuil, on
+indique le handler FastAPI et, le cas échéant, le template Jinja2 qui l'a
+déclenchée (typiquement un accès à price.product ou stock.zone dans une boucle).
+"""
+import contextvars
+import os
+import re
+import sys
+
+from sqlalchemy import event
+
+MODE = os.environ.get("NPLUSONE_MODE", "").lower()
+THRESHOLD = int(os.environ.get("NPLUSONE_THRESHOLD", "5"))
+ENABLED = MODE in ("log", "raise")
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\bIN\s*\([^()]*\)", re.IGNORECASE)
+_PLACEHOLDERS = re.compile(r"(?:\?|%\(\w+\)s|%s|:\w+)")
+_SPACES = re.compile(r"\s+")
+_COLUMNS = re.compile(r"^SELECT .+? FROM ", re.IGNORECASE)
+
+
+class NPlusOneError(RuntimeError):
+    """Une même forme de requête a été exécutée trop de fois dans une requête HTTP"""
+
+
+def normalize(statement):
+    """Forme d'une instruction SQL, indépendante des valeurs"""
+    shape = _STRINGS.sub("?", statement)
+    shape = _PLACEHOLDERS.sub("?", shape)
+    shape = _NUMBERS.sub("?", shape)
+    shape = _IN_LISTS.sub("IN (?)", shape)
+    return _SPACES.sub(" ", shape).strip()
+
+
+class _RequestQueries:
+    __slots__ = ("scope", "counts", "origins")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.counts = {}
+        self.origins = {}
+
+
+_current = contextvars.ContextVar("nplusone_request", default=None)
+
+
+def _origin(scope):
+    """Handler et template (s'il y en a un) à l'origine de l'instruction en cours"""
+    endpoint = scope.get("endpoint")
+    handler = getattr(endpoint, "__name__", None) or scope.get("path", "?")
+    template = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.startswith(TEMPLATES_DIR):
+            # Code compilé par Jinja2 : co_filename est le chemin du template
+            template = os.path.relpath(filename, TEMPLATES_DIR)
+            break
+        frame = frame.f_back
+    return handler, template
+
+
+def _describe(shape, count, origin):
+    handler, template = origin
+    where = f"handler {handler}"
+    if template:
+        where += f", template {template}"
+    shape = _COLUMNS.sub("SELECT ... FROM ", shape)
+    return f"N+1 probable: {count} exécutions ({where})\n    {shape[:300]}"
+
+
+async def track_request(request, call_next):
+    """Corps du middleware HTTP : regroupe les instructions de la requête"""
+    queries = _RequestQueries(request.scope)
+    token = _current.set(queries)
+    try:
+        return await call_next(request)
+    finally:
+        _current.reset(token)
+        if MODE == "log":
+            for shape, origin in queries.origins.items():
+                print(f"⚠️  {request.method} {request.url.path} - {_describe(shape, queries.counts[shape], origin)}")
+
+
+def instrument_engine(engine):
+    """Branche le détecteur sur un moteur (sans effet s'il est désactivé)"""
+    if not ENABLED:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_shape(conn, cursor, statement, parameters, context, executemany):
+        queries = _current.get()
+        if queries is None:
+            return
+        shape = normalize(statement)
+        count = queries.counts.get(shape, 0) + 1
+        queries.counts[shape] = count
+        if count == THRESHOLD + 1:
+            origin = _origin(queries.scope)
+            queries.origins[shape] = origin
+            if MODE == "raise":
+                raise NPlusOneError(_describe(shape, count, origin))
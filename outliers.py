@@ -0,0 +1,266 @@
+# outliers.py
+"""
+Détection des prix aberrants à l'écriture (ex: 75000 au lieu de 7500 FCFA).
+
+Chaque série produit × zone garde des statistiques glissantes (algorithme de
+Welford : nombre, moyenne, somme des carrés des écarts) dans price_stats,
+mises à jour en O(1) par prix écrit. Les calculs portent sur le logarithme du
+prix : une erreur d'un facteur 10 donne le même écart quel que soit le produit.
+
+Un prix dont le z-score dépasse OUTLIER_ZSCORE est enregistré dans
+price_outliers et n'entre pas dans les statistiques ; en mode "quarantine"
+(par défaut) il est aussi exclu de l'agrégat journalier, donc des moyennes,
+séries et indices, jusqu'à ce qu'un administrateur l'accepte.
+
+    OUTLIER_MODE=quarantine|flag|off
+    OUTLIER_ZSCORE=4           # seuil de détection
+    OUTLIER_MIN_COUNT=8        # observations nécessaires avant de juger
+"""
+import math
+import os
+from datetime import datetime
+
+from sqlalchemy import delete, insert, inspect, select, tuple_, update
+
+import hooks
+import models
+
+MODE = os.environ.get("OUTLIER_MODE", "quarantine")
+ZSCORE = float(os.environ.get("OUTLIER_ZSCORE", "4"))
+MIN_COUNT = int(os.environ.get("OUTLIER_MIN_COUNT", "8"))
+# Écart-type plancher (en log, ~5 %) : une série aux prix identiques ne rend
+# pas suspecte la moindre variation
+MIN_STD = 0.05
+
+FLAGGED = "flagged"
+QUARANTINED = "quarantined"
+ACCEPTED = "accepted"
+
+
+class RunningStats:
+    """Moyenne et variance glissantes (Welford), avec retrait d'une valeur"""
+
+    __slots__ = ("count", "mean", "m2")
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    def remove(self, x):
+        if self.count <= 1:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        mean = (self.count * self.mean - x) / (self.count - 1)
+        self.m2 = max(self.m2 - (x - self.mean) * (x - mean), 0.0)
+        self.mean = mean
+        self.count -= 1
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def zscore(self, x):
+        """z-score de x, None tant que la série est trop courte pour juger"""
+        if self.count < MIN_COUNT:
+            return None
+        return (x - self.mean) / max(self.std, MIN_STD)
+
+
+def quarantined_ids():
+    """Sous-requête des identifiants de prix en quarantaine (à exclure des agrégats)"""
+    return select(models.PriceOutlier.price_id).where(models.PriceOutlier.status == QUARANTINED)
+
+
+def _log(price):
+    return math.log(price) if price and price > 0 else None
+
+
+# ============================================
+# 1. STATISTIQUES PAR SÉRIE
+# ============================================
+def load_stats(connection, keys):
+    """{(product_id, zone_id): RunningStats} pour les séries demandées"""
+    stats = {key: RunningStats() for key in keys}
+    if not keys:
+        return stats
+    table = models.PriceStats
+    rows = connection.execute(
+        select(table.product_id, table.zone_id, table.count, table.mean, table.m2)
+        .where(tuple_(table.product_id, table.zone_id).in_(list(keys)))
+    )
+    for product_id, zone_id, count, mean, m2 in rows:
+        stats[(product_id, zone_id)] = RunningStats(count, mean, m2)
+    return stats
+
+
+def save_stats(connection, stats):
+    table = models.PriceStats
+    if not stats:
+        return
+    now = datetime.now()
+    hooks.replace_rows(connection, table, stats, [
+        {"product_id": p, "zone_id": z, "count": s.count, "mean": s.mean, "m2": s.m2, "updated_at": now}
+        for (p, z), s in stats.items()
+    ])
+
+
+def rebuild(connection):
+    """Recalcule price_stats à partir de tous les prix non aberrants"""
+    price = models.Price
+    outliers = select(models.PriceOutlier.price_id).where(models.PriceOutlier.status != ACCEPTED)
+    query = select(price.product_id, price.zone_id, price.price)\
+        .where(price.id.notin_(outliers))\
+        .execution_options(yield_per=10000)
+    stats = {}
+    for product_id, zone_id, value in connection.execute(query):
+        x = _log(value)
+        if x is not None and product_id is not None and zone_id is not None:
+            stats.setdefault((product_id, zone_id), RunningStats()).add(x)
+    connection.execute(delete(models.PriceStats))
+    save_stats(connection, stats)
+    return len(stats)
+
+
+def ensure_built(engine):
+    """Construit price_stats au démarrage s'il est vide alors que des prix existent"""
+    with engine.begin() as conn:
+        has_stats = conn.execute(select(models.PriceStats.product_id).limit(1)).first()
+        has_prices = conn.execute(select(models.Price.id).limit(1)).first()
+        if has_prices and not has_stats:
+            count = rebuild(conn)
+            print(f"✅ Statistiques de prix construites ({count} séries)")
+
+
+# ============================================
+# 2. DÉTECTION À L'ÉCRITURE
+# ============================================
+def _value_changed(price):
+    state = inspect(price)
+    return any(state.attrs[attr].history.has_changes() for attr in ("product_id", "zone_id", "price"))
+
+
+def screen(connection, inserted, updated=(), deleted=()):
+    """Met à jour les statistiques et enregistre les prix aberrants.
+
+    `updated` ne contient que des prix dont le produit, la zone ou la valeur a
+    changé ; ils sont retirés puis réévalués. Retourne les lignes price_outliers créées.
+    """
+    removed = [
+        (hooks.old_value(p, "product_id"), hooks.old_value(p, "zone_id"), hooks.old_value(p, "price"), p.id)
+        for p in updated
+    ] + [(p.product_id, p.zone_id, p.price, p.id) for p in deleted]
+    added = [p for p in list(inserted) + list(updated) if p.product_id and p.zone_id and _log(p.price) is not None]
+
+    keys = {(p, z) for p, z, _, _ in removed if p and z} | {(p.product_id, p.zone_id) for p in added}
+    if not keys:
+        return []
+    stats = load_stats(connection, keys)
+
+    if removed:
+        table = models.PriceOutlier
+        ids = [price_id for _, _, _, price_id in removed]
+        # Les aberrants non acceptés n'étaient pas comptés dans les statistiques
+        excluded = set(connection.execute(
+            select(table.price_id).where(table.price_id.in_(ids), table.status != ACCEPTED)
+        ).scalars())
+        connection.execute(delete(table).where(table.price_id.in_(ids)))
+        for product_id, zone_id, value, price_id in removed:
+            x = _log(value)
+            if price_id not in excluded and x is not None and (product_id, zone_id) in stats:
+                stats[(product_id, zone_id)].remove(x)
+
+    found = []
+    now = datetime.now()
+    for price in added:
+        series_stats = stats[(price.product_id, price.zone_id)]
+        x = _log(price.price)
+        z = series_stats.zscore(x)
+        if MODE != "off" and z is not None and abs(z) > ZSCORE:
+            found.append({
+                "price_id": price.id,
+                "product_id": price.product_id,
+                "zone_id": price.zone_id,
+                "price": price.price,
+                "expected": round(math.exp(series_stats.mean), 2),
+                "zscore": round(z, 2),
+                "status": QUARANTINED if MODE == "quarantine" else FLAGGED,
+                "detected_at": now,
+            })
+        else:
+            series_stats.add(x)
+
+    save_stats(connection, stats)
+    if found:
+        connection.execute(insert(models.PriceOutlier), found)
+        for row in found:
+            print(f"⚠️ Prix aberrant #{row['price_id']} ({row['status']}): "
+                  f"{row['price']:.0f} FCFA, attendu ~{row['expected']:.0f} (z={row['zscore']})")
+    return found
+
+
+@hooks.on_flush(models.Price, priority=50)
+def screen_prices(session, changes):
+    # Avant rollups (priorité 100) : les prix mis en quarantaine sont exclus de price_daily
+    updated = [p for p in changes.updated if _value_changed(p)]
+    found = screen(session.connection(), changes.inserted, updated, changes.deleted)
+    if found:
+        session.info.setdefault("price_outliers", []).extend(found)
+
+
+# ============================================
+# 3. CONSULTATION ET MODÉRATION
+# ============================================
+def statuses(db, price_ids):
+    """{price_id: statut} pour les prix aberrants parmi `price_ids`"""
+    if not price_ids:
+        return {}
+    table = models.PriceOutlier
+    return dict(db.execute(
+        select(table.price_id, table.status).where(table.price_id.in_(list(price_ids)))
+    ).all())
+
+
+def list_outliers(db, status=None, limit=100):
+    table = models.PriceOutlier
+    query = select(table).order_by(table.detected_at.desc()).limit(limit)
+    if status:
+        query = query.where(table.status == status)
+    return db.execute(query).scalars().all()
+
+
+def accept(db, price_id):
+    """Accepte un prix signalé : il rejoint les statistiques et les agrégats"""
+    table = models.PriceOutlier
+    outlier = db.get(table, price_id)
+    price = db.get(models.Price, price_id)
+    if outlier is None or price is None or outlier.status == ACCEPTED:
+        return False
+    connection = db.connection()
+    key = (price.product_id, price.zone_id)
+    stats = load_stats(connection, {key})
+    stats[key].add(_log(price.price))
+    save_stats(connection, stats)
+    connection.execute(update(table).where(table.price_id == price_id).values(status=ACCEPTED))
+
+    # Recalcul des données dérivées (agrégat, indice...) comme pour une modification
+    changes = hooks.Changes()
+    changes.updated.append(price)
+    hooks.dispatch(db, models.Price, changes)
+    db.commit()
+    return True
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        count = rebuild(conn)
+    print(f"✅ Statistiques de prix recalculées ({count} séries)")
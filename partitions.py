@@ -0,0 +1,424 @@
+# partitions.py
+"""
+Partitionnement par date des tables prices et stocks (PARTITIONING=1).
+
+Les observations s'accumulent sans fin ; une requête bornée par date
+(prices.date >= ... AND prices.date < ...) ne doit lire que les périodes
+concernées :
+
+- PostgreSQL : partitionnement natif par mois (PARTITION BY RANGE (date)),
+  prices_p2026_10, prices_p2026_11... et une partition par défaut pour les
+  dates hors plage. Le planificateur écarte les partitions hors bornes.
+- SQLite : une table par année (prices_2025, prices_2026...) ; `prices`
+  devient une vue UNION ALL munie de triggers INSTEAD OF, si bien que le
+  modèle Price s'utilise comme avant (ORM, insert/update/delete en SQL).
+  Chaque branche de la vue a ses index : une borne sur la date se réduit à
+  une recherche vide dans les années hors plage. La première table reçoit
+  aussi les dates antérieures, la dernière les dates postérieures.
+
+La conversion d'une table existante se fait une fois, au démarrage
+(ensure_built) ou avec `python partitions.py`. Une tâche quotidienne crée
+ensuite les partitions à venir (PARTITION_MONTHS_AHEAD mois, l'année
+suivante sous SQLite) et range à leur place les lignes tombées dans la
+partition par défaut.
+"""
+import os
+from datetime import date
+
+from sqlalchemy import Column, Index, MetaData, Table, event, text
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+import jobs
+import models
+
+ENABLED = os.environ.get("PARTITIONING", "0") == "1"
+MONTHS_AHEAD = int(os.environ.get("PARTITION_MONTHS_AHEAD", "3"))
+INTERVAL = int(os.environ.get("PARTITION_INTERVAL", "86400"))
+
+MODELS = (models.Price, models.Stock)
+SEQUENCES = "partition_sequences"  # SQLite : dernier identifiant attribué par table
+
+# layout : "postgresql" ou "sqlite" une fois les tables converties ; tables : tables partitionnées
+_state = {"layout": None, "tables": set()}
+
+
+def layout():
+    return _state["layout"]
+
+
+def managed_tables():
+    """Tables partitionnées (leurs index sont gérés ici, pas par create_all)"""
+    return set(_state["tables"])
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def _columns(model):
+    return [column.name for column in model.__table__.columns]
+
+
+# ============================================
+# 1. POSTGRESQL : PARTITIONS MENSUELLES
+# ============================================
+def _pg_partition_name(table, month):
+    return f"{table}_p{month:%Y_%m}"
+
+
+def _pg_is_partitioned(conn, table):
+    return conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table}
+    ).scalar() == "p"
+
+
+def _pg_partitions(conn, table):
+    return {
+        name for (name,) in conn.execute(
+            text("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                 "WHERE i.inhparent = to_regclass(:table)"),
+            {"table": table},
+        )
+    }
+
+
+def _pg_create_partition(conn, table, month):
+    """Crée la partition d'un mois en y déplaçant les lignes de la partition par défaut"""
+    name = _pg_partition_name(table, month)
+    start, end = month.isoformat(), add_months(month, 1).isoformat()
+    conn.exec_driver_sql(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)")
+    conn.exec_driver_sql(
+        f"WITH moved AS (DELETE FROM {table}_default WHERE date >= '{start}' AND date < '{end}' RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    )
+    conn.exec_driver_sql(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')")
+
+
+def _pg_months(first, last):
+    month = month_start(first)
+    while month <= last:
+        yield month
+        month = add_months(month, 1)
+
+
+def _pg_convert(conn, model):
+    """Remplace une table ordinaire par une table partitionnée (données recopiées)"""
+    table = model.__tablename__
+    if conn.execute(text(f"SELECT 1 FROM {table} WHERE date IS NULL LIMIT 1")).first():
+        print(f"⚠️ {table} : des lignes sans date empêchent le partitionnement")
+        return False
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table}).scalar()
+    first, last = conn.execute(text(f"SELECT min(date), max(date) FROM {table}")).first()
+    today = date.today()
+    first = min(first.date(), today) if first else today
+    last = max(last.date(), today) if last else today
+
+    conn.exec_driver_sql(f"ALTER TABLE {table} RENAME TO {table}_unpartitioned")
+    conn.exec_driver_sql(
+        f"CREATE TABLE {table} (LIKE {table}_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (date)"
+    )
+    conn.exec_driver_sql(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+    for month in _pg_months(first, add_months(last, MONTHS_AHEAD)):
+        start, end = month.isoformat(), add_months(month, 1).isoformat()
+        conn.exec_driver_sql(
+            f"CREATE TABLE {_pg_partition_name(table, month)} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{start}') TO ('{end}')"
+        )
+    columns = ", ".join(_columns(model))
+    conn.exec_driver_sql(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {table}_unpartitioned")
+    if sequence:
+        # La séquence des identifiants survit à l'ancienne table
+        conn.exec_driver_sql(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id")
+    conn.exec_driver_sql(f"DROP TABLE {table}_unpartitioned")
+
+    # Toute contrainte d'unicité doit contenir la clé de partitionnement
+    conn.exec_driver_sql(f"ALTER TABLE {table} ADD PRIMARY KEY (id, date)")
+    for index in model.__table__.indexes:
+        conn.execute(CreateIndex(index, if_not_exists=True))
+    for fk in model.__table__.foreign_keys:
+        target = fk.column
+        conn.exec_driver_sql(
+            f"ALTER TABLE {table} ADD FOREIGN KEY ({fk.parent.name}) "
+            f"REFERENCES {target.table.name} ({target.name})"
+        )
+    return True
+
+
+def _pg_rotate(conn, model):
+    """Partitions des mois à venir, et des mois présents dans la partition par défaut"""
+    table = model.__tablename__
+    existing = _pg_partitions(conn, table)
+    today = month_start(date.today())
+    months = {add_months(today, i) for i in range(MONTHS_AHEAD + 1)}
+    months.update(
+        month_start(day) for (day,) in conn.execute(
+            text(f"SELECT DISTINCT date_trunc('month', date) FROM {table}_default WHERE date IS NOT NULL")
+        )
+    )
+    created = 0
+    for month in sorted(months):
+        if _pg_partition_name(table, month) not in existing:
+            _pg_create_partition(conn, table, month)
+            created += 1
+    return created
+
+
+# ============================================
+# 2. SQLITE : UNE TABLE PAR ANNÉE DERRIÈRE UNE VUE
+# ============================================
+def _sqlite_is_view(conn, table):
+    return conn.execute(
+        text("SELECT type FROM sqlite_master WHERE name = :table"), {"table": table}
+    ).scalar() == "view"
+
+
+def _sqlite_years(conn, table):
+    names = conn.execute(
+        text("SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB :pattern"),
+        {"pattern": f"{table}_[0-9][0-9][0-9][0-9]"},
+    )
+    return sorted(int(name[-4:]) for (name,) in names)
+
+
+def _sqlite_year_table(model, year):
+    """Table d'une année : mêmes colonnes (sans clés étrangères) et mêmes index"""
+    table = model.__tablename__
+    name = f"{table}_{year}"
+    year_table = Table(name, MetaData(), *[
+        Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable)
+        for c in model.__table__.columns
+    ])
+    for index in model.__table__.indexes:
+        Index(index.name.replace(f"{table}_", f"{name}_", 1),
+              *[year_table.c[column.name] for column in index.columns], unique=index.unique)
+    return year_table
+
+
+def sqlite_target(conn, model, moment):
+    """Table annuelle où est rangée une ligne datée de `moment` (écriture directe, sans la vue)"""
+    years = _sqlite_years(conn, model.__tablename__)
+    if moment is None:
+        return _sqlite_year_table(model, years[-1])  # comme la vue : dates absentes dans la dernière table
+    earlier = [year for year in years if year <= moment.year]
+    return _sqlite_year_table(model, earlier[-1] if earlier else years[0])
+
+
+def allocate_ids(conn, model, count):
+    """Réserve `count` identifiants consécutifs (SQLite partitionné) ; renvoie le premier"""
+    name = model.__tablename__
+    last = conn.execute(
+        text(f"UPDATE {SEQUENCES} SET value = value + :count WHERE name = :name RETURNING value"),
+        {"count": count, "name": name},
+    ).scalar()
+    return last - count + 1
+
+
+def _sqlite_condition(years, year, prefix=""):
+    """Dates rangées dans la table `year` (la première et la dernière débordent)"""
+    position = years.index(year)
+    conditions = []
+    if position > 0:
+        conditions.append(f"{prefix}date >= '{year}-01-01'")
+    if position < len(years) - 1:
+        conditions.append(f"{prefix}date < '{years[position + 1]}-01-01'")
+    if position == len(years) - 1:
+        # Dates postérieures... ou absentes : dans la dernière table
+        return f"({' AND '.join(conditions) or '1'} OR {prefix}date IS NULL)"
+    return " AND ".join(conditions) or "1"
+
+
+def _sqlite_install(conn, model, years):
+    """(Re)crée la vue et ses triggers pour les années données"""
+    table = model.__tablename__
+    columns = _columns(model)
+    column_list = ", ".join(columns)
+    new_values = ", ".join(f"NEW.{c}" for c in columns)
+    tables = [f"{table}_{year}" for year in years]
+
+    conn.exec_driver_sql(f"DROP VIEW IF EXISTS {table}")
+    conn.exec_driver_sql(
+        f"CREATE VIEW {table} AS " + " UNION ALL ".join(f"SELECT {column_list} FROM {name}" for name in tables)
+    )
+
+    def routed_insert(values):
+        return "".join(
+            f"INSERT INTO {table}_{year} ({column_list}) SELECT {values} "
+            f"WHERE {_sqlite_condition(years, year, 'NEW.')}; "
+            for year in years
+        )
+
+    delete_old = "".join(f"DELETE FROM {name} WHERE id = OLD.id; " for name in tables)
+    allocated = new_values.replace(
+        "NEW.id", f"coalesce(NEW.id, (SELECT value FROM {SEQUENCES} WHERE name = '{table}'))", 1
+    )
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER {table}_insert INSTEAD OF INSERT ON {table} BEGIN "
+        f"UPDATE {SEQUENCES} SET value = CASE WHEN NEW.id IS NULL THEN value + 1 ELSE max(value, NEW.id) END "
+        f"WHERE name = '{table}'; "
+        + routed_insert(allocated) + "END"
+    )
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER {table}_update INSTEAD OF UPDATE ON {table} BEGIN "
+        + delete_old + routed_insert(new_values) + "END"
+    )
+    conn.exec_driver_sql(f"CREATE TRIGGER {table}_delete INSTEAD OF DELETE ON {table} BEGIN {delete_old}END")
+
+
+def _sqlite_create_years(conn, model, years):
+    for year in years:
+        year_table = _sqlite_year_table(model, year)
+        conn.execute(CreateTable(year_table, if_not_exists=True))
+        for index in year_table.indexes:
+            conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+def _sqlite_convert(conn, model):
+    table = model.__tablename__
+    columns = ", ".join(_columns(model))
+    this_year = date.today().year
+    years = {this_year, this_year + 1}
+    years.update(
+        int(year) for (year,) in conn.execute(
+            text(f"SELECT DISTINCT substr(date, 1, 4) FROM {table} WHERE date IS NOT NULL")
+        ) if year and year.isdigit()
+    )
+    years = sorted(years)
+
+    _sqlite_create_years(conn, model, years)
+    for year in years:
+        conn.exec_driver_sql(
+            f"INSERT INTO {table}_{year} ({columns}) SELECT {columns} FROM {table} "
+            f"WHERE {_sqlite_condition(years, year)}"
+        )
+    conn.exec_driver_sql(f"CREATE TABLE IF NOT EXISTS {SEQUENCES} (name TEXT PRIMARY KEY, value INTEGER)")
+    conn.exec_driver_sql(
+        f"INSERT OR REPLACE INTO {SEQUENCES} (name, value) SELECT '{table}', coalesce(max(id), 0) FROM {table}"
+    )
+    conn.exec_driver_sql(f"DROP TABLE {table}")
+    _sqlite_install(conn, model, years)
+    return True
+
+
+def _sqlite_rotate(conn, model):
+    """Table de l'année suivante ; les dates déjà saisies pour cette année y sont déplacées"""
+    table = model.__tablename__
+    years = _sqlite_years(conn, table)
+    wanted = sorted(set(years) | {date.today().year, date.today().year + 1})
+    added = [year for year in wanted if year not in years]
+    if not added:
+        return 0
+    _sqlite_create_years(conn, model, added)
+    columns = ", ".join(_columns(model))
+    for name in (f"{table}_{year}" for year in years):
+        for year in added:
+            condition = _sqlite_condition(wanted, year)
+            conn.exec_driver_sql(
+                f"INSERT INTO {table}_{year} ({columns}) SELECT {columns} FROM {name} WHERE {condition}"
+            )
+            conn.exec_driver_sql(f"DELETE FROM {name} WHERE {condition}")
+    _sqlite_install(conn, model, wanted)
+    return len(added)
+
+
+def _allocate_id(mapper, connection, target):
+    # Sous SQLite, l'identifiant d'une ligne insérée dans une vue n'est pas
+    # renvoyé : l'ORM le réserve avant l'insertion
+    name = mapper.local_table.name
+    if target.id is None and _state["layout"] == "sqlite" and name in _state["tables"]:
+        connection.execute(text(f"UPDATE {SEQUENCES} SET value = value + 1 WHERE name = :name"), {"name": name})
+        target.id = connection.execute(
+            text(f"SELECT value FROM {SEQUENCES} WHERE name = :name"), {"name": name}
+        ).scalar()
+
+
+for _model in MODELS:
+    event.listen(_model, "before_insert", _allocate_id)
+
+
+# ============================================
+# 3. MISE EN SERVICE ET ROTATION
+# ============================================
+def _is_partitioned(conn, table):
+    if conn.dialect.name == "postgresql":
+        return _pg_is_partitioned(conn, table)
+    return _sqlite_is_view(conn, table)
+
+
+def convert(engine):
+    """Convertit les tables ordinaires ; renvoie le nombre de tables converties"""
+    convert_table = _pg_convert if engine.dialect.name == "postgresql" else _sqlite_convert
+    converted = 0
+    with engine.begin() as conn:
+        for model in MODELS:
+            if not _is_partitioned(conn, model.__tablename__):
+                converted += convert_table(conn, model)
+    return converted
+
+
+def rotate(engine):
+    """Crée les partitions à venir ; renvoie le nombre de partitions créées"""
+    rotate_table = _pg_rotate if engine.dialect.name == "postgresql" else _sqlite_rotate
+    created = 0
+    with engine.begin() as conn:
+        for model in MODELS:
+            if model.__tablename__ in _state["tables"]:
+                created += rotate_table(conn, model)
+    return created
+
+
+def ensure_built(engine):
+    """Partitionne prices et stocks au démarrage (si PARTITIONING=1) et crée
+    les partitions à venir ; une base déjà partitionnée est reconnue dans tous les cas"""
+    dialect = engine.dialect.name
+    if dialect not in ("postgresql", "sqlite"):
+        return
+    if ENABLED:
+        converted = convert(engine)
+        if converted:
+            print(f"✅ Tables partitionnées par date ({converted})")
+    with engine.begin() as conn:
+        _state["tables"] = {m.__tablename__ for m in MODELS if _is_partitioned(conn, m.__tablename__)}
+        # Index ajoutés au modèle après la conversion (ex: clé naturelle, voir upsert.py)
+        for model in MODELS:
+            if model.__tablename__ not in _state["tables"]:
+                continue
+            if dialect == "postgresql":
+                for index in model.__table__.indexes:
+                    conn.execute(CreateIndex(index, if_not_exists=True))
+            else:
+                _sqlite_create_years(conn, model, _sqlite_years(conn, model.__tablename__))
+    if not _state["tables"]:
+        return
+    _state["layout"] = dialect
+    if dialect == "sqlite":
+        # Une vue modifiée par trigger ne rapporte pas le nombre de lignes touchées
+        engine.dialect.supports_sane_rowcount = False
+        engine.dialect.supports_sane_multi_rowcount = False
+        for model in MODELS:
+            if model.__tablename__ in _state["tables"]:
+                model.__mapper__.confirm_deleted_rows = False
+    rotate(engine)
+
+
+@jobs.every(INTERVAL if ENABLED else 0, name="partitions")
+def scheduled_rotate():
+    from database import engine
+
+    if _state["tables"]:
+        created = rotate(engine)
+        if created:
+            print(f"🗂️ {created} partition(s) créée(s)")
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    models.Base.metadata.create_all(bind=engine)
+    ENABLED = True
+    ensure_built(engine)
+    print(f"✅ Partitionnement en place ({engine.dialect.name})")
@@ -0,0 +1,412 @@
+# price_index.py
+"""
+Indice des prix alimentaires (type Laspeyres), quotidien, par département et national.
+
+    I(jour, zone) = 100 * Σ w_i * (p_i(jour) / p_i(base)) / Σ w_i
+
+- w_i : poids du produit dans le panier (poids de sa catégorie réparti
+  également entre les produits de la catégorie), enregistré dans
+  price_index_basket
+- p_i(base) : prix moyen du produit sur la période de base
+  (PRICE_INDEX_BASE_START / PRICE_INDEX_BASE_END, sinon les 30 premiers
+  jours de données), dans le département ou, à défaut, au niveau national ;
+  figé dans price_index_base une fois la période écoulée
+- la somme ne porte que sur les produits observés ce jour-là ; la part du
+  panier observée est conservée dans `coverage`
+
+L'indice est stocké dans price_index et mis à jour à chaque écriture de prix,
+uniquement pour les jours et départements touchés (à partir de price_daily).
+
+    python price_index.py            # recalcule tout l'indice
+    python price_index.py --rebase   # recalcule aussi le panier et les prix de référence
+"""
+import os
+import unicodedata
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, delete, func, insert, or_, select
+
+import hooks
+import models
+import rollups
+
+NATIONAL = "national"
+
+# Poids des catégories dans le panier alimentaire
+CATEGORY_WEIGHTS = {
+    "cereale": 0.35,
+    "tubercule": 0.20,
+    "legumineuse": 0.12,
+    "legume": 0.12,
+    "oleagineux": 0.08,
+    "fruit": 0.08,
+    "epice": 0.05,
+}
+DEFAULT_CATEGORY_WEIGHT = 0.05
+BASE_DAYS = 30
+
+
+def _normalize(text):
+    """Minuscules sans accents ('Céréale' et 'Cereale' désignent la même catégorie)"""
+    decomposed = unicodedata.normalize("NFKD", (text or "").strip().lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+# ============================================
+# 1. PANIER ET PRIX DE RÉFÉRENCE
+# ============================================
+# Le panier (poids et période de référence de chaque produit) et les prix de
+# référence sont enregistrés en base et relus à chaque recalcul : tous les
+# workers calculent le même indice. Ils sont figés une fois leur période
+# écoulée (indice à panier fixe) :
+# - tant que la période de base est ouverte, poids et prix de référence sont
+#   recalculés à chaque écriture de prix ;
+# - un produit du panier absent de la période de base prend pour référence ses
+#   BASE_DAYS premiers jours de relevés, recalculés jusqu'à leur fin ;
+# - un produit créé après la clôture n'entre dans le panier qu'au `--rebase`.
+# Quand une référence change, l'indice est recalculé depuis le premier relevé
+# du produit : les lignes enregistrées restent celles d'un rebuild().
+def category_weights(connection):
+    """Poids de chaque produit d'après sa catégorie (somme = 1)"""
+    products = connection.execute(select(models.Product.id, models.Product.category)).all()
+    by_category = {}
+    for product_id, category in products:
+        by_category.setdefault(_normalize(category), []).append(product_id)
+    weights = {}
+    for category, ids in by_category.items():
+        weight = CATEGORY_WEIGHTS.get(category, DEFAULT_CATEGORY_WEIGHT)
+        for product_id in ids:
+            weights[product_id] = weight / len(ids)
+    total = sum(weights.values()) or 1.0
+    return {pid: w / total for pid, w in weights.items()}
+
+
+def basket_weights(connection):
+    """Poids de chaque produit dans le panier enregistré"""
+    basket = models.PriceIndexBasket
+    return dict(connection.execute(select(basket.product_id, basket.weight)).all())
+
+
+def base_period(connection):
+    """(début, fin) de la période de base"""
+    start = os.environ.get("PRICE_INDEX_BASE_START")
+    end = os.environ.get("PRICE_INDEX_BASE_END")
+    if start and end:
+        return date.fromisoformat(start), date.fromisoformat(end)
+    first_day = connection.execute(select(func.min(models.PriceDaily.day))).scalar()
+    if first_day is None:
+        return None
+    first_day = rollups.day_of(first_day)
+    return first_day, first_day + timedelta(days=BASE_DAYS - 1)
+
+
+def _daily_prices(connection, condition):
+    """{(jour, département): {product_id: (somme, nombre)}} et la vue nationale"""
+    daily = models.PriceDaily
+    query = select(
+        daily.day,
+        models.Zone.department,
+        daily.product_id,
+        func.sum(daily.total),
+        func.sum(daily.count),
+    ).join(models.Zone, models.Zone.id == daily.zone_id)\
+     .where(condition)\
+     .group_by(daily.day, models.Zone.department, daily.product_id)
+
+    prices = {}
+    for day, department, product_id, total, count in connection.execute(query):
+        day = rollups.day_of(day)
+        for scope in (department, NATIONAL):
+            bucket = prices.setdefault((day, scope), {})
+            previous = bucket.get(product_id, (0.0, 0))
+            bucket[product_id] = (previous[0] + total, previous[1] + count)
+    return prices
+
+
+def _windows(connection, product_ids, period):
+    """{product_id: (début, fin)} : la période de base, ou les BASE_DAYS premiers
+    jours de relevés du produit s'il n'y figure pas ((None, None) si jamais relevé)"""
+    daily = models.PriceDaily
+    ids = list(product_ids)
+    observed = set(connection.execute(
+        select(daily.product_id).where(daily.product_id.in_(ids), daily.day.between(*period)).distinct()
+    ).scalars())
+    first_days = dict(connection.execute(
+        select(daily.product_id, func.min(daily.day)).where(daily.product_id.in_(ids)).group_by(daily.product_id)
+    ).all())
+    windows = {}
+    for product_id in ids:
+        if product_id in observed:
+            windows[product_id] = period
+        elif first_days.get(product_id) is not None:
+            first_day = rollups.day_of(first_days[product_id])
+            windows[product_id] = (first_day, first_day + timedelta(days=BASE_DAYS - 1))
+        else:
+            windows[product_id] = (None, None)
+    return windows
+
+
+def _base_rows(connection, windows, now):
+    """Prix de référence (moyenne sur la période de chaque produit), par département et national"""
+    by_window = {}
+    for product_id, window in windows.items():
+        if window[0] is not None:
+            by_window.setdefault(window, []).append(product_id)
+    totals = {}
+    for window, ids in by_window.items():
+        condition = and_(models.PriceDaily.day.between(*window), models.PriceDaily.product_id.in_(ids))
+        for (_, scope), products in _daily_prices(connection, condition).items():
+            for product_id, (total, count) in products.items():
+                previous = totals.get((product_id, scope), (0.0, 0))
+                totals[(product_id, scope)] = (previous[0] + total, previous[1] + count)
+    return [
+        {"product_id": product_id, "scope": scope, "base_price": total / count, "computed_at": now}
+        for (product_id, scope), (total, count) in totals.items() if count
+    ]
+
+
+def _save(connection, weights, windows):
+    """Enregistre le panier et les prix de référence de ces produits ; renvoie le
+    premier jour de relevé des produits dont la référence a changé (ou None)"""
+    basket, base = models.PriceIndexBasket, models.PriceIndexBase
+    ids = list(windows)
+    if not ids:
+        return None
+    before = {
+        product_id: (weight, start, end)
+        for product_id, weight, start, end in connection.execute(
+            select(basket.product_id, basket.weight, basket.base_start, basket.base_end)
+            .where(basket.product_id.in_(ids))
+        )
+    }
+    before_prices = {
+        (product_id, scope): price
+        for product_id, scope, price in connection.execute(
+            select(base.product_id, base.scope, base.base_price).where(base.product_id.in_(ids))
+        )
+    }
+    now = datetime.now()
+    rows = [
+        {"product_id": product_id, "weight": weights.get(product_id, 0.0),
+         "base_start": start, "base_end": end, "computed_at": now}
+        for product_id, (start, end) in windows.items()
+    ]
+    prices = _base_rows(connection, windows, now)
+    hooks.replace_rows(connection, basket, [(product_id,) for product_id in ids], rows)
+    hooks.replace_rows(connection, base, list(before_prices), prices)
+
+    changed = {
+        row["product_id"] for row in rows
+        if before.get(row["product_id"]) != (row["weight"], row["base_start"], row["base_end"])
+    }
+    after_prices = {(row["product_id"], row["scope"]): row["base_price"] for row in prices}
+    changed |= {product_id for product_id, _ in set(before_prices) ^ set(after_prices)}
+    changed |= {key[0] for key, price in after_prices.items() if before_prices.get(key, price) != price}
+    if not changed:
+        return None
+    since = connection.execute(
+        select(func.min(models.PriceDaily.day)).where(models.PriceDaily.product_id.in_(changed))
+    ).scalar()
+    return rollups.day_of(since) if since is not None else None
+
+
+def update_basket(connection, product_ids):
+    """Recalcule les références encore ouvertes (toutes tant que la période de base
+    n'est pas écoulée, sinon celles des produits donnés) ; renvoie le premier jour
+    de l'indice à recalculer, ou None si aucune référence n'a changé"""
+    period = base_period(connection)
+    if period is None:
+        return None
+    basket = models.PriceIndexBasket
+    rows = connection.execute(
+        select(basket.product_id, basket.weight, basket.base_end, basket.computed_at)
+    ).all()
+    if not rows or any(rollups.day_of(computed_at) <= period[1] for _, _, _, computed_at in rows):
+        # Panier jamais calculé ou période de base ouverte : tout le panier
+        weights = category_weights(connection)
+        ids = set(weights) | {product_id for product_id, _, _, _ in rows}
+    else:
+        weights = {product_id: weight for product_id, weight, _, _ in rows}
+        ids = {
+            product_id for product_id, _, end, computed_at in rows
+            if product_id in product_ids and (end is None or rollups.day_of(computed_at) <= rollups.day_of(end))
+        }
+    return _save(connection, weights, _windows(connection, ids, period))
+
+
+def compute_basket(connection):
+    """Recalcule le panier (produits actuels) et tous les prix de référence (`--rebase`)"""
+    connection.execute(delete(models.PriceIndexBasket))
+    connection.execute(delete(models.PriceIndexBase))
+    period = base_period(connection)
+    if period is None:
+        return 0
+    weights = category_weights(connection)
+    _save(connection, weights, _windows(connection, weights, period))
+    return len(weights)
+
+
+def base_prices(connection):
+    """{(product_id, scope): prix de référence}"""
+    rows = connection.execute(select(
+        models.PriceIndexBase.product_id,
+        models.PriceIndexBase.scope,
+        models.PriceIndexBase.base_price,
+    )).all()
+    return {(product_id, scope): price for product_id, scope, price in rows}
+
+
+# ============================================
+# 2. CALCUL DE L'INDICE
+# ============================================
+def _index_rows(connection, prices):
+    weights = basket_weights(connection)
+    base = base_prices(connection)
+    now = datetime.now()
+    rows = []
+    for (day, scope), products in prices.items():
+        weighted = 0.0
+        observed_weight = 0.0
+        observed = 0
+        for product_id, (total, count) in products.items():
+            weight = weights.get(product_id)
+            reference = base.get((product_id, scope)) or base.get((product_id, NATIONAL))
+            if not weight or not reference or not count:
+                continue
+            weighted += weight * (total / count) / reference
+            observed_weight += weight
+            observed += 1
+        if observed:
+            rows.append({
+                "day": day,
+                "scope": scope,
+                "value": round(100 * weighted / observed_weight, 4),
+                "coverage": round(observed_weight, 4),
+                "products_count": observed,
+                "updated_at": now,
+            })
+    return rows
+
+
+def refresh(connection, days, departments, products=()):
+    """Recalcule l'indice des jours donnés pour ces départements et le national,
+    et tout l'indice depuis le premier relevé d'un produit dont la référence a changé"""
+    days = {d for d in days if d is not None}
+    if not days:
+        return
+    since = update_basket(connection, set(products))
+    index = models.PriceIndex
+    if since is None:
+        prices = _daily_prices(connection, models.PriceDaily.day.in_(days))
+        scopes = set(departments) | {NATIONAL}
+        keys = [(day, scope) for day in days for scope in scopes]
+        rows = [row for row in _index_rows(connection, prices) if row["scope"] in scopes]
+    else:
+        prices = _daily_prices(connection, or_(models.PriceDaily.day.in_(days), models.PriceDaily.day >= since))
+        keys = connection.execute(
+            select(index.day, index.scope).where(or_(index.day.in_(days), index.day >= since))
+        ).all()
+        rows = _index_rows(connection, prices)
+    hooks.replace_rows(connection, index, keys, rows)
+
+
+def rebuild(connection, rebase=False):
+    """Recalcule tout l'indice (et le panier et les prix de référence si rebase=True)"""
+    if rebase:
+        compute_basket(connection)
+    else:
+        update_basket(connection, set())
+    connection.execute(delete(models.PriceIndex))
+    rows = _index_rows(connection, _daily_prices(connection, models.PriceDaily.day.isnot(None)))
+    if rows:
+        connection.execute(insert(models.PriceIndex), rows)
+    return len(rows)
+
+
+def missing_products(connection):
+    """Jours où l'indice national compte moins de produits que le panier n'en a
+    d'observés (produit sans prix de référence)"""
+    weights = basket_weights(connection)
+    counts = dict(connection.execute(
+        select(models.PriceIndex.day, models.PriceIndex.products_count).where(models.PriceIndex.scope == NATIONAL)
+    ).all())
+    counts = {rollups.day_of(day): count for day, count in counts.items()}
+    prices = _daily_prices(connection, models.PriceDaily.day.isnot(None))
+    return sorted(
+        day for (day, scope), products in prices.items()
+        if scope == NATIONAL and counts.get(day, 0) < sum(1 for product_id in products if weights.get(product_id))
+    )
+
+
+def ensure_built(engine):
+    """Construit l'indice au démarrage s'il est vide alors que l'agrégat existe"""
+    with engine.begin() as conn:
+        has_index = conn.execute(select(models.PriceIndex.day).limit(1)).first()
+        has_daily = conn.execute(select(models.PriceDaily.day).limit(1)).first()
+        if has_daily and not has_index:
+            count = rebuild(conn)
+            print(f"✅ Indice des prix construit ({count} lignes)")
+
+
+def index_series(db, scope=NATIONAL, start=None, end=None):
+    """Valeurs de l'indice en tableaux parallèles (format Chart.js)"""
+    query = select(models.PriceIndex.day, models.PriceIndex.value, models.PriceIndex.coverage)\
+        .where(models.PriceIndex.scope == scope)\
+        .order_by(models.PriceIndex.day)
+    if start:
+        query = query.where(models.PriceIndex.day >= start)
+    if end:
+        query = query.where(models.PriceIndex.day <= end)
+    rows = db.execute(query).all()
+    return {
+        "scope": scope,
+        "labels": [rollups.day_of(day).isoformat() for day, _, _ in rows],
+        "values": [value for _, value, _ in rows],
+        "coverage": [coverage for _, _, coverage in rows],
+    }
+
+
+# ============================================
+# 3. MISE À JOUR À L'ÉCRITURE
+# ============================================
+@hooks.on_flush(models.Price, priority=200)
+def refresh_price_index(session, changes):
+    # Après rollups (priorité 100) : price_daily est déjà à jour
+    keys = rollups.price_keys(changes)
+    zone_ids = {zone_id for _, zone_id, _ in keys if zone_id is not None}
+    if not zone_ids:
+        return
+    connection = session.connection()
+    departments = connection.execute(
+        select(models.Zone.department).where(models.Zone.id.in_(zone_ids)).distinct()
+    ).scalars().all()
+    refresh(connection, {day for _, _, day in keys}, departments, {product_id for product_id, _, _ in keys})
+
+
+@hooks.on_flush(models.Zone)
+def refresh_moved_zones(session, changes):
+    # Zone changée de département : ses jours passent d'un indice départemental à l'autre
+    moved = {
+        z.id: {hooks.old_value(z, "department"), z.department}
+        for z in changes.updated if hooks.old_value(z, "department") != z.department
+    }
+    if not moved:
+        return
+    connection = session.connection()
+    daily = models.PriceDaily
+    for zone_id, departments in moved.items():
+        days = connection.execute(select(daily.day).where(daily.zone_id == zone_id).distinct()).scalars()
+        refresh(connection, {rollups.day_of(day) for day in days}, {d for d in departments if d})
+
+
+if __name__ == "__main__":
+    import sys
+    from database import engine
+
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        count = rebuild(conn, rebase="--rebase" in sys.argv)
+        missing = missing_products(conn)
+    print(f"✅ Indice des prix recalculé ({count} lignes)")
+    if missing:
+        print(f"⚠️ {len(missing)} jour(s) avec des produits observés hors de l'indice (à partir du {missing[0]}) : relancer avec --rebase")
@@ -0,0 +1,143 @@
+# profiling.py
+"""
+Profilage des requêtes par échantillonnage (pyinstrument).
+
+1. À la demande (administrateurs uniquement) :
+       /dashboard?__profile=1            -> flame graph HTML
+       /dashboard?__profile=speedscope   -> fichier speedscope (https://www.speedscope.app)
+   ou avec l'en-tête  X-Profile: html | speedscope
+
+2. En tâche de fond : une fraction PROFILE_SAMPLE_RATE (ex: 0.01) de toutes
+   les requêtes est profilée et les fonctions les plus coûteuses sont agrégées
+   (rapport JSON sur /admin/profiling).
+
+Sans pyinstrument installé, le profilage est simplement désactivé.
+"""
+import os
+import random
+import threading
+import time
+
+from fastapi.responses import HTMLResponse, Response
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+    AVAILABLE = True
+except ImportError:
+    AVAILABLE = False
+
+SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.001"))
+QUERY_PARAM = "__profile"
+HEADER = "x-profile"
+
+_lock = threading.Lock()
+_hot_functions = {}
+_sampled = {"requests": 0, "seconds": 0.0, "routes": {}}
+
+
+# ============================================
+# 1. AGRÉGATION DES PROFILS ÉCHANTILLONNÉS
+# ============================================
+def _accumulate(frame, totals):
+    # pyinstrument range le temps propre d'une fonction dans des enfants
+    # synthétiques "[self]" ; les "[await]" (attente) ne sont pas comptés
+    self_time = 0.0
+    for child in frame.children:
+        if child.is_synthetic:
+            if child.function == "[self]":
+                self_time += child.time
+        else:
+            _accumulate(child, totals)
+    if self_time > 0:
+        key = (frame.function, frame.file_path_short or "", frame.line_no or 0)
+        totals[key] = totals.get(key, 0.0) + self_time
+
+
+def _record_sample(profiler, route):
+    session = profiler.last_session
+    root = session.root_frame() if session else None
+    if root is None:
+        return
+    totals = {}
+    _accumulate(root, totals)
+    with _lock:
+        _sampled["requests"] += 1
+        _sampled["seconds"] += root.time
+        _sampled["routes"][route] = _sampled["routes"].get(route, 0) + 1
+        for key, value in totals.items():
+            _hot_functions[key] = _hot_functions.get(key, 0.0) + value
+
+
+def hot_functions_report(limit=30):
+    """Fonctions ayant le plus de temps propre sur les requêtes échantillonnées"""
+    with _lock:
+        total = _sampled["seconds"]
+        ranked = sorted(_hot_functions.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return {
+            "enabled": AVAILABLE and SAMPLE_RATE > 0,
+            "sample_rate": SAMPLE_RATE,
+            "sampled_requests": _sampled["requests"],
+            "sampled_seconds": round(total, 3),
+            "routes": dict(_sampled["routes"]),
+            "functions": [
+                {
+                    "function": function,
+                    "file": file,
+                    "line": line,
+                    "self_seconds": round(seconds, 4),
+                    "percent": round(100 * seconds / total, 2) if total else 0.0,
+                }
+                for (function, file, line), seconds in ranked
+            ],
+        }
+
+
+def reset():
+    with _lock:
+        _hot_functions.clear()
+        _sampled.update(requests=0, seconds=0.0, routes={})
+
+
+# ============================================
+# 2. MIDDLEWARE
+# ============================================
+def _requested_format(request):
+    value = request.query_params.get(QUERY_PARAM) or request.headers.get(HEADER)
+    if not value:
+        return None
+    return "speedscope" if value.lower() == "speedscope" else "html"
+
+
+async def profile_request(request, call_next):
+    """Corps du middleware HTTP (à exécuter après l'authentification)"""
+    if not AVAILABLE:
+        return await call_next(request)
+
+    user = getattr(request.state, "user", None)
+    output = _requested_format(request) if user is not None and user.is_admin else None
+    sampled = output is None and SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+    if output is None and not sampled:
+        return await call_next(request)
+
+    profiler = Profiler(interval=INTERVAL, async_mode="enabled")
+    profiler.start()
+    try:
+        response = await call_next(request)
+    finally:
+        profiler.stop()
+
+    if sampled:
+        route = getattr(request.scope.get("route"), "path", None) or request.url.path
+        _record_sample(profiler, route)
+        return response
+
+    if output == "speedscope":
+        filename = f"profile-{time.strftime('%Y%m%d-%H%M%S')}.speedscope.json"
+        return Response(
+            profiler.output(renderer=SpeedscopeRenderer()),
+            media_type="application/json",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+    return HTMLResponse(profiler.output_html())
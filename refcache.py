@@ -0,0 +1,151 @@
+# refcache.py
+"""
+Cache en mémoire des données de référence : produits et zones.
+
+Peu nombreux et rarement modifiés, ils étaient relus par une douzaine de
+routes à chaque requête (listes, formulaires, validations, modèles HTML).
+Ils sont désormais servis par un instantané immuable :
+
+    refs = refcache.get()
+    refs.product(3).name              # id -> fiche (None si inconnu)
+    refs.products_by_name             # fiches triées par nom
+    refs.version                      # incrémenté à chaque rechargement
+
+Toute écriture validée d'un produit ou d'une zone dans ce processus (routes
+CRUD comprises) invalide l'instantané ; le suivant est chargé à la première
+lecture. Les autres processus le rechargent au plus tard après
+REFCACHE_TTL secondes ; product_exists / zone_exists relisent la base avant
+de conclure qu'une fiche n'existe pas.
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select
+
+import hooks
+import models
+
+TTL = int(os.environ.get("REFCACHE_TTL", "60"))
+
+
+@dataclass(frozen=True, slots=True)
+class ProductRef:
+    id: int
+    name: str
+    category: Optional[str]
+    unit: Optional[str]
+    description: Optional[str]
+    created_at: Optional[datetime]
+    created_by: Optional[int]
+
+
+@dataclass(frozen=True, slots=True)
+class ZoneRef:
+    id: int
+    name: str
+    type: Optional[str]
+    department: Optional[str]
+    city: Optional[str]
+    created_at: Optional[datetime]
+
+
+class Snapshot:
+    """Produits et zones à un instant donné (ne pas modifier)"""
+
+    __slots__ = ("version", "loaded_at", "products", "zones", "products_by_name", "zones_by_name")
+
+    def __init__(self, version, products, zones):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.products = {p.id: p for p in products}  # ordre des identifiants
+        self.zones = {z.id: z for z in zones}
+        self.products_by_name = tuple(sorted(products, key=lambda p: (p.name or "").lower()))
+        self.zones_by_name = tuple(sorted(zones, key=lambda z: (z.name or "").lower()))
+
+    def product(self, product_id):
+        return self.products.get(product_id)
+
+    def zone(self, zone_id):
+        return self.zones.get(zone_id)
+
+    def departments(self):
+        return sorted({z.department for z in self.zones.values() if z.department})
+
+
+_lock = threading.Lock()
+_state = {"snapshot": None, "version": 0, "invalidations": 0}
+
+
+def _load(session):
+    product, zone = models.Product, models.Zone
+    products = [
+        ProductRef(*row) for row in session.execute(
+            select(product.id, product.name, product.category, product.unit, product.description,
+                   product.created_at, product.created_by).order_by(product.id)
+        )
+    ]
+    zones = [
+        ZoneRef(*row) for row in session.execute(
+            select(zone.id, zone.name, zone.type, zone.department, zone.city, zone.created_at).order_by(zone.id)
+        )
+    ]
+    return products, zones
+
+
+def get():
+    """Instantané courant (chargé à la demande)"""
+    snapshot = _state["snapshot"]
+    if snapshot is not None and time.monotonic() - snapshot.loaded_at <= TTL:
+        return snapshot
+    from database import SessionLocal
+
+    with _lock:
+        snapshot = _state["snapshot"]
+        if snapshot is None or time.monotonic() - snapshot.loaded_at > TTL:
+            invalidations = _state["invalidations"]
+            with SessionLocal() as session:
+                products, zones = _load(session)
+            _state["version"] += 1
+            snapshot = Snapshot(_state["version"], products, zones)
+            # Invalidé pendant le chargement : utilisable pour cette lecture, pas gardé
+            if invalidations == _state["invalidations"]:
+                _state["snapshot"] = snapshot
+    return snapshot
+
+
+def invalidate():
+    _state["invalidations"] += 1
+    _state["snapshot"] = None
+
+
+def product_exists(db, product_id):
+    """Vrai si le produit existe (la base est relue si l'instantané l'ignore)"""
+    if get().product(product_id) is not None:
+        return True
+    if db.get(models.Product, product_id) is None:
+        return False
+    invalidate()  # créé par un autre processus depuis le dernier chargement
+    return True
+
+
+def zone_exists(db, zone_id):
+    if get().zone(zone_id) is not None:
+        return True
+    if db.get(models.Zone, zone_id) is None:
+        return False
+    invalidate()
+    return True
+
+
+@hooks.on_commit(models.Product)
+def invalidate_products(changes):
+    invalidate()
+
+
+@hooks.on_commit(models.Zone)
+def invalidate_zones(changes):
+    invalidate()
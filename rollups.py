@@ -0,0 +1,157 @@
+# rollups.py
+"""
+Agrégat journalier des prix (table price_daily), maintenu à chaque écriture.
+
+Chaque flush touchant des prix recalcule uniquement les clés
+(produit, zone, jour) concernées ; rebuild() reconstruit tout l'agrégat
+(première mise en service, insertion en masse hors ORM...). Les jours dont
+les prix ont été archivés (archive.py) incluent les prix des archives.
+"""
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select, tuple_
+
+import hooks
+import models
+import outliers
+
+BATCH_THRESHOLD = 50
+
+
+def day_of(value):
+    """Jour d'une date/datetime (ou d'une chaîne ISO renvoyée par SQLite)"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def day_expr(column):
+    """Expression SQL du jour d'une colonne DateTime (SQLite et PostgreSQL)"""
+    return func.date(column)
+
+
+def _aggregate_query():
+    price = models.Price
+    return select(
+        price.product_id,
+        price.zone_id,
+        day_expr(price.date).label("day"),
+        func.sum(price.price),
+        func.count(price.id),
+        func.min(price.price),
+        func.max(price.price),
+    ).where(
+        price.product_id.isnot(None),  # produit ou zone supprimés : prix sans série
+        price.zone_id.isnot(None),
+        price.id.notin_(outliers.quarantined_ids()),
+    ).group_by(price.product_id, price.zone_id, day_expr(price.date))
+
+
+def _with_archives(result, start=None, end=None, product_ids=None):
+    """Ajoute aux agrégats calculés en base ceux des prix archivés (voir archive.py)"""
+    import archive  # import différé : archive.py s'appuie sur ce module
+
+    if not archive.covers(models.Price, start):
+        return result
+    totals = {}
+    for product_id, zone_id, day, total, count, min_price, max_price in result:
+        totals[(product_id, zone_id, day_of(day))] = [total, count, min_price, max_price]
+    for key, (total, count, min_price, max_price) in archive.price_aggregates(start, end, product_ids).items():
+        if key[0] is None or key[1] is None:
+            continue
+        current = totals.get(key)
+        if current is None:
+            totals[key] = [total, count, min_price, max_price]
+        else:
+            current[0] += total
+            current[1] += count
+            current[2] = min(current[2], min_price)
+            current[3] = max(current[3], max_price)
+    return [(*key, *values) for key, values in totals.items()]
+
+
+def _rows(result, keys=None):
+    now = datetime.now()
+    rows = []
+    for product_id, zone_id, day, total, count, min_price, max_price in result:
+        day = day_of(day)
+        if keys is not None and (product_id, zone_id, day) not in keys:
+            continue
+        rows.append({
+            "product_id": product_id,
+            "zone_id": zone_id,
+            "day": day,
+            "total": total,
+            "count": count,
+            "min_price": min_price,
+            "max_price": max_price,
+            "updated_at": now,
+        })
+    return rows
+
+
+def refresh(connection, keys):
+    """Recalcule les lignes de price_daily pour les clés (product_id, zone_id, jour)"""
+    keys = {(p, z, d) for p, z, d in keys if p is not None and z is not None and d is not None}
+    if not keys:
+        return
+    price = models.Price
+    daily = models.PriceDaily
+
+    first_day = min(k[2] for k in keys)
+    last_day = max(k[2] for k in keys)
+    # Bornes sur prices.date elle-même pour profiter des index (et du partitionnement)
+    query = _aggregate_query().where(
+        price.date >= datetime.combine(first_day, datetime.min.time()),
+        price.date < datetime.combine(last_day + timedelta(days=1), datetime.min.time()),
+    )
+    if len(keys) <= BATCH_THRESHOLD:
+        query = query.where(tuple_(price.product_id, price.zone_id).in_({(p, z) for p, z, _ in keys}))
+    else:
+        query = query.where(price.product_id.in_({p for p, _, _ in keys}))
+    result = _with_archives(connection.execute(query), first_day, last_day, {p for p, _, _ in keys})
+    rows = _rows(result, keys)
+
+    hooks.replace_rows(connection, daily, keys, rows)
+
+
+def rebuild(connection):
+    """Reconstruit entièrement price_daily à partir de prices"""
+    connection.execute(delete(models.PriceDaily))
+    rows = _rows(_with_archives(connection.execute(_aggregate_query())))
+    if rows:
+        connection.execute(insert(models.PriceDaily), rows)
+    return len(rows)
+
+
+def ensure_built(engine):
+    """Construit l'agrégat au démarrage s'il est vide alors que des prix existent"""
+    with engine.begin() as conn:
+        has_daily = conn.execute(select(models.PriceDaily.day).limit(1)).first()
+        has_prices = conn.execute(select(models.Price.id).limit(1)).first()
+        if has_prices and not has_daily:
+            count = rebuild(conn)
+            print(f"✅ Agrégat journalier des prix construit ({count} lignes)")
+
+
+def price_keys(changes):
+    """Clés (produit, zone, jour) touchées par des changements de prix"""
+    keys = set()
+    for price in changes.inserted + changes.deleted:
+        keys.add((price.product_id, price.zone_id, day_of(price.date) if price.date else None))
+    for price in changes.updated:
+        keys.add((price.product_id, price.zone_id, day_of(price.date)))
+        old_date = hooks.old_value(price, "date")
+        keys.add((
+            hooks.old_value(price, "product_id"),
+            hooks.old_value(price, "zone_id"),
+            day_of(old_date) if old_date else None,
+        ))
+    return keys
+
+
+@hooks.on_flush(models.Price)
+def refresh_price_daily(session, changes):
+    refresh(session.connection(), price_keys(changes))
@@ -0,0 +1,341 @@
+# search.py
+"""
+Recherche plein texte, insensible aux accents et à la casse (« mais » trouve
+« Maïs », « arzeke » trouve « Arzèkè »), sur :
+
+- les produits : nom (titre), catégorie et description ;
+- les zones : nom (titre), ville et département ;
+- les notes des stocks et des prix.
+
+Le texte est copié dans search_documents (un document par objet), tenu à
+jour à chaque écriture. L'index dépend de la base :
+
+- SQLite : table virtuelle FTS5 `search_fts` (tokenizer unicode61 sans
+  diacritiques), alimentée par des triggers, classement BM25 ;
+- PostgreSQL : colonne tsvector pondérée (titre A, texte B) calculée par
+  trigger avec unaccent, index GIN, classement ts_rank_cd.
+
+Sans FTS5 (ou sans base reconnue), une recherche LIKE dégradée est utilisée,
+sur une copie du titre et du texte sans accents ni majuscules (colonne plain).
+Chaque mot de la requête est cherché comme préfixe et tous doivent figurer.
+"""
+import html
+import re
+import unicodedata
+from datetime import datetime
+
+from sqlalchemy import bindparam, delete, insert, inspect, select, text
+
+import hooks
+import models
+
+KINDS = ("product", "zone", "stock", "price")
+# Marqueurs des mots trouvés dans les extraits, remplacés par <mark> après échappement HTML
+START, STOP = "\x02", "\x03"
+MAX_TERMS = 8
+BATCH = 1000
+
+_state = {"backend": "like"}
+
+
+def unaccent(value):
+    """Minuscules sans diacritiques (colonne plain, recherche LIKE de secours)"""
+    decomposed = unicodedata.normalize("NFKD", value or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def terms(query):
+    """Mots de la requête (les opérateurs FTS sont ignorés)"""
+    return re.findall(r"\w+", query or "")[:MAX_TERMS]
+
+
+# ============================================
+# 1. STRUCTURES PROPRES À CHAQUE BASE
+# ============================================
+SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+    "title, body, content='search_documents', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN "
+    "INSERT INTO search_fts(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN "
+    "INSERT INTO search_fts(search_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); END",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_au AFTER UPDATE ON search_documents BEGIN "
+    "INSERT INTO search_fts(search_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); "
+    "INSERT INTO search_fts(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+)
+
+POSTGRES_DDL = (
+    "ALTER TABLE search_documents ADD COLUMN IF NOT EXISTS document tsvector",
+    """CREATE OR REPLACE FUNCTION search_documents_tsvector() RETURNS trigger AS $$
+BEGIN
+    NEW.document := setweight(to_tsvector('simple', unaccent(coalesce(NEW.title, ''))), 'A')
+                 || setweight(to_tsvector('simple', unaccent(coalesce(NEW.body, ''))), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS search_documents_tsvector ON search_documents",
+    "CREATE TRIGGER search_documents_tsvector BEFORE INSERT OR UPDATE ON search_documents "
+    "FOR EACH ROW EXECUTE FUNCTION search_documents_tsvector()",
+    "CREATE INDEX IF NOT EXISTS ix_search_documents_document ON search_documents USING gin (document)",
+)
+
+
+def _create_structures(engine):
+    """Crée l'index propre à la base ; retourne le moteur de recherche utilisé"""
+    dialect = engine.dialect.name
+    try:
+        if dialect == "sqlite":
+            with engine.begin() as conn:
+                for statement in SQLITE_DDL:
+                    conn.exec_driver_sql(statement)
+            return "fts5"
+        if dialect == "postgresql":
+            with engine.begin() as conn:
+                conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS unaccent")
+                for statement in POSTGRES_DDL:
+                    conn.exec_driver_sql(statement)
+            return "postgres"
+    except Exception as e:
+        print(f"⚠️ Index de recherche plein texte indisponible ({e}) - recherche LIKE")
+    return "like"
+
+
+# ============================================
+# 2. DOCUMENTS
+# ============================================
+# Champs indexés par modèle : (type, titre, autres champs)
+SOURCES = {
+    models.Product: ("product", "name", ("category", "description")),
+    models.Zone: ("zone", "name", ("city", "department")),
+    models.Stock: ("stock", None, ("notes",)),
+    models.Price: ("price", None, ("notes",)),
+}
+
+
+def _document(kind, ref_id, title, fields, now):
+    body = " ".join(f for f in fields if f)
+    if not title and not body:
+        return None
+    return {
+        "kind": kind,
+        "ref_id": ref_id,
+        "title": title or "",
+        "body": body,
+        "plain": unaccent(f"{title or ''} {body}"),
+        "updated_at": now,
+    }
+
+
+def documents(objects, model):
+    kind, title_attr, body_attrs = SOURCES[model]
+    now = datetime.now()
+    rows = []
+    for obj in objects:
+        title = getattr(obj, title_attr) if title_attr else None
+        row = _document(kind, obj.id, title, [getattr(obj, attr) for attr in body_attrs], now)
+        if row:
+            rows.append(row)
+    return rows
+
+
+def _indexed_changed(obj, model):
+    _, title_attr, body_attrs = SOURCES[model]
+    state = inspect(obj)
+    return any(
+        state.attrs[attr].history.has_changes()
+        for attr in ((title_attr,) if title_attr else ()) + body_attrs
+    )
+
+
+def sync(connection, model, changes):
+    """Met à jour les documents des objets insérés, modifiés ou supprimés"""
+    kind = SOURCES[model][0]
+    updated = [obj for obj in changes.updated if _indexed_changed(obj, model)]
+    stale = [obj.id for obj in changes.deleted + updated]
+    rows = documents(changes.inserted + updated, model)
+    table = models.SearchDocument
+    if stale:
+        connection.execute(delete(table).where(table.kind == kind, table.ref_id.in_(stale)))
+    if rows:
+        connection.execute(insert(table), rows)
+
+
+def rebuild(connection):
+    """Recrée tous les documents à partir des tables sources"""
+    connection.execute(delete(models.SearchDocument))
+    count = 0
+    now = datetime.now()
+    for model, (kind, title_attr, body_attrs) in SOURCES.items():
+        columns = [model.id] + ([getattr(model, title_attr)] if title_attr else []) \
+            + [getattr(model, attr) for attr in body_attrs]
+        query = select(*columns)
+        if not title_attr:
+            query = query.where(model.notes.isnot(None), model.notes != "")
+        batch = []
+        for row in connection.execute(query.execution_options(yield_per=BATCH)):
+            ref_id, *values = row
+            title = values.pop(0) if title_attr else None
+            document = _document(kind, ref_id, title, values, now)
+            if document:
+                batch.append(document)
+            if len(batch) >= BATCH:
+                connection.execute(insert(models.SearchDocument), batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            connection.execute(insert(models.SearchDocument), batch)
+            count += len(batch)
+    return count
+
+
+def _add_plain_column(engine):
+    """Ajoute la colonne plain aux bases créées avant elle ; True si elle manquait"""
+    columns = {column["name"] for column in inspect(engine).get_columns("search_documents")}
+    if "plain" in columns:
+        return False
+    with engine.begin() as conn:
+        conn.exec_driver_sql("ALTER TABLE search_documents ADD COLUMN plain TEXT")
+    return True
+
+
+def ensure_built(engine):
+    """Crée l'index de la base et les documents au démarrage s'ils manquent
+    (ou s'ils n'ont pas encore de colonne plain)"""
+    added = _add_plain_column(engine)
+    _state["backend"] = _create_structures(engine)
+    with engine.begin() as conn:
+        has_documents = conn.execute(select(models.SearchDocument.id).limit(1)).first()
+        has_products = conn.execute(select(models.Product.id).limit(1)).first()
+        if has_products and (added or not has_documents):
+            count = rebuild(conn)
+            print(f"✅ Index de recherche construit ({count} documents)")
+
+
+# ============================================
+# 3. RECHERCHE
+# ============================================
+def _sqlite_query(words, kinds):
+    match = " ".join('"' + word + '"*' for word in words)
+    sql = text(
+        "SELECT d.kind, d.ref_id, d.title, "
+        "snippet(search_fts, -1, char(2), char(3), '…', 12) AS snippet, "
+        "-bm25(search_fts, 10.0, 1.0) AS score "
+        "FROM search_fts JOIN search_documents d ON d.id = search_fts.rowid "
+        "WHERE search_fts MATCH :match AND d.kind IN :kinds "
+        "ORDER BY bm25(search_fts, 10.0, 1.0) LIMIT :limit"
+    ).bindparams(bindparam("kinds", expanding=True))
+    return sql, {"match": match, "kinds": list(kinds)}
+
+
+def _postgres_query(words, kinds):
+    sql = text(
+        "SELECT kind, ref_id, title, "
+        "ts_headline('simple', body, query, :options) AS snippet, "
+        "ts_rank_cd(document, query) AS score "
+        "FROM search_documents, to_tsquery('simple', unaccent(:match)) AS query "
+        "WHERE document @@ query AND kind IN :kinds "
+        "ORDER BY score DESC LIMIT :limit"
+    ).bindparams(bindparam("kinds", expanding=True))
+    return sql, {
+        "match": " & ".join(word + ":*" for word in words),
+        "kinds": list(kinds),
+        "options": f"StartSel={START}, StopSel={STOP}, MaxWords=12, MinWords=4",
+    }
+
+
+def _like_search(db, words, kinds, limit):
+    table = models.SearchDocument
+    query = select(table.kind, table.ref_id, table.title, table.body).where(table.kind.in_(kinds))
+    for word in words:
+        query = query.where(table.plain.contains(unaccent(word), autoescape=True))
+    results = []
+    for kind, ref_id, title, body in db.execute(query.limit(limit * 5)):
+        # Les titres correspondants d'abord
+        score = sum(unaccent(word) in unaccent(title) for word in words)
+        results.append((kind, ref_id, title, (body or "")[:120], float(score)))
+    results.sort(key=lambda r: -r[4])
+    return results[:limit]
+
+
+URLS = {
+    "product": "/prices/product/{}",
+    "zone": "/prices/zone/{}",
+    "stock": "/stocks/edit/{}",
+    "price": "/prices/edit/{}",
+}
+
+
+def _labels(db, results):
+    """Titres des stocks et prix trouvés (produit — zone), lus à la demande"""
+    labels = {}
+    for kind, model in (("stock", models.Stock), ("price", models.Price)):
+        ids = [ref_id for k, ref_id, *_ in results if k == kind]
+        if ids:
+            rows = db.execute(
+                select(model.id, models.Product.name, models.Zone.name)
+                .join(models.Product, models.Product.id == model.product_id)
+                .join(models.Zone, models.Zone.id == model.zone_id)
+                .where(model.id.in_(ids))
+            )
+            labels.update({(kind, i): f"{product} — {zone}" for i, product, zone in rows})
+    return labels
+
+
+def _highlight(snippet):
+    escaped = html.escape(snippet or "")
+    return escaped.replace(START, "<mark>").replace(STOP, "</mark>")
+
+
+def search(db, query, kinds=None, limit=20):
+    """Documents correspondant à `query`, les plus pertinents d'abord.
+
+    Les extraits sont échappés (HTML) ; les mots trouvés sont entourés de <mark>.
+    """
+    words = terms(query)
+    kinds = [k for k in (kinds or KINDS) if k in KINDS]
+    if not words or not kinds:
+        return []
+    backend = _state["backend"]
+    if backend == "like":
+        results = _like_search(db, words, kinds, limit)
+    else:
+        sql, params = (_sqlite_query if backend == "fts5" else _postgres_query)(words, kinds)
+        results = db.execute(sql, {**params, "limit": limit}).all()
+
+    labels = _labels(db, results)
+    return [
+        {
+            "kind": kind,
+            "id": ref_id,
+            "title": title or labels.get((kind, ref_id), ""),
+            "snippet": _highlight(snippet),
+            "score": round(float(score), 4),
+            "url": URLS[kind].format(ref_id),
+        }
+        for kind, ref_id, title, snippet, score in results
+    ]
+
+
+# ============================================
+# 4. MISE À JOUR À L'ÉCRITURE
+# ============================================
+def _register(model):
+    @hooks.on_flush(model)
+    def sync_search_documents(session, changes):
+        sync(session.connection(), model, changes)
+    return sync_search_documents
+
+
+for _model in SOURCES:
+    _register(_model)
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    models.Base.metadata.create_all(bind=engine)
+    _create_structures(engine)
+    with engine.begin() as conn:
+        count = rebuild(conn)
+    print(f"✅ Index de recherche reconstruit ({count} documents)")
@@ -0,0 +1,175 @@
+# series.py
+"""
+Séries temporelles de prix : regroupement par période et sous-échantillonnage.
+
+Les regroupements sont calculés en SQL sur l'agrégat journalier price_daily
+(voir rollups.py), puis réduits avec LTTB (Largest-Triangle-Three-Buckets)
+qui conserve la forme de la courbe (pics, creux) avec peu de points.
+"""
+from datetime import date, datetime
+
+from sqlalchemy import Date, Integer, String, cast, func, literal, select
+
+import models
+from rollups import day_of
+
+GRANULARITIES = ("day", "week", "month", "season")
+
+# Saisons agricoles (sud du Bénin) : mois -> (mois de début, décalage d'année)
+SEASONS = {
+    12: (12, 0), 1: (12, -1), 2: (12, -1), 3: (12, -1),  # grande saison sèche
+    4: (4, 0), 5: (4, 0), 6: (4, 0), 7: (4, 0),          # grande saison des pluies
+    8: (8, 0),                                           # petite saison sèche
+    9: (9, 0), 10: (9, 0), 11: (9, 0),                   # petite saison des pluies
+}
+SEASON_NAMES = {
+    12: "Grande saison sèche",
+    4: "Grande saison des pluies",
+    8: "Petite saison sèche",
+    9: "Petite saison des pluies",
+}
+
+
+def season_start(day):
+    """Premier jour de la saison agricole contenant `day`"""
+    month, year_offset = SEASONS[day.month]
+    return date(day.year + year_offset, month, 1)
+
+
+def bucket_expr(dialect, granularity, column):
+    """Début de période (semaine au lundi, mois) d'une colonne Date"""
+    if granularity == "day":
+        return column
+    if dialect == "postgresql":
+        unit = "week" if granularity == "week" else "month"
+        return cast(func.date_trunc(unit, column), Date)
+    if granularity == "week":
+        # SQLite : strftime('%w') vaut 0 pour dimanche ; on recule jusqu'au lundi
+        offset = (cast(func.strftime("%w", column), Integer) + 6) % 7
+        return func.date(column, literal("-") + cast(offset, String) + literal(" days"))
+    return func.date(column, "start of month")
+
+
+# ============================================
+# 1. REQUÊTE
+# ============================================
+def price_series(db, granularity="day", product_id=None, zone_id=None, department=None,
+                 start=None, end=None):
+    """Moyenne, min, max et nombre d'observations par période"""
+    daily = models.PriceDaily
+    sql_granularity = "month" if granularity == "season" else granularity
+    bucket = bucket_expr(db.get_bind().dialect.name, sql_granularity, daily.day).label("bucket")
+
+    query = select(
+        bucket,
+        func.sum(daily.total),
+        func.sum(daily.count),
+        func.min(daily.min_price),
+        func.max(daily.max_price),
+    ).group_by(bucket).order_by(bucket)
+
+    if product_id:
+        query = query.where(daily.product_id == product_id)
+    if zone_id:
+        query = query.where(daily.zone_id == zone_id)
+    if department:
+        query = query.where(daily.zone_id.in_(
+            select(models.Zone.id).where(models.Zone.department == department)
+        ))
+    if start:
+        query = query.where(daily.day >= start)
+    if end:
+        query = query.where(daily.day <= end)
+
+    buckets = {}
+    for bucket_day, total, count, min_price, max_price in db.execute(query):
+        key = day_of(bucket_day)
+        if granularity == "season":
+            key = season_start(key)
+        current = buckets.get(key)
+        if current is None:
+            buckets[key] = [total, count, min_price, max_price]
+        else:
+            current[0] += total
+            current[1] += count
+            current[2] = min(current[2], min_price)
+            current[3] = max(current[3], max_price)
+
+    labels = sorted(buckets)
+    return {
+        "labels": labels,
+        "avg": [buckets[k][0] / buckets[k][1] for k in labels],
+        "min": [buckets[k][2] for k in labels],
+        "max": [buckets[k][3] for k in labels],
+        "count": [buckets[k][1] for k in labels],
+    }
+
+
+# ============================================
+# 2. SOUS-ÉCHANTILLONNAGE LTTB
+# ============================================
+def lttb_indices(xs, ys, threshold):
+    """Indices des points conservés par l'algorithme LTTB"""
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    selected = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Moyenne du seau suivant (troisième sommet du triangle)
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        span = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / span
+        avg_y = sum(ys[next_start:next_end]) / span
+
+        # Point du seau courant formant le plus grand triangle
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        ax, ay = xs[a], ys[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+    selected.append(n - 1)
+    return selected
+
+
+def downsample(series, points):
+    """Réduit une série (tableaux parallèles) à `points` périodes au plus"""
+    total = len(series["labels"])
+    if not points or total <= points:
+        return dict(series, downsampled=False, total_buckets=total)
+    xs = [label.toordinal() for label in series["labels"]]
+    keep = lttb_indices(xs, series["avg"], points)
+    reduced = {key: [values[i] for i in keep] for key, values in series.items()}
+    return dict(reduced, downsampled=True, total_buckets=total)
+
+
+def to_chart(series, granularity):
+    """Format compact pour Chart.js (dates ISO, valeurs arrondies)"""
+    chart = {
+        "granularity": granularity,
+        "labels": [label.isoformat() for label in series["labels"]],
+        "avg": [round(v, 2) for v in series["avg"]],
+        "min": series["min"],
+        "max": series["max"],
+        "count": series["count"],
+        "downsampled": series["downsampled"],
+        "total_buckets": series["total_buckets"],
+    }
+    if granularity == "season":
+        chart["season_names"] = [SEASON_NAMES[label.month] for label in series["labels"]]
+    return chart
+
+
+def parse_day(value):
+    """Date ISO (YYYY-MM-DD ou datetime ISO) -> date, None si vide"""
+    if not value:
+        return None
+    return datetime.fromisoformat(value).date()
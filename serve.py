@@ -0,0 +1,234 @@
+# serve.py
+"""
+Lancement de production : plusieurs processus workers.
+
+    python serve.py                                   # un worker par cœur
+    python serve.py --workers 4 --bind 0.0.0.0:8000
+    WEB_WORKERS=8 WEB_MAX_REQUESTS=5000 python serve.py
+
+- main.py (tables, index de recherche, données de référence) est chargé une
+  seule fois dans le processus maître, puis partagé par fork avec les
+  workers : le démarrage ne coûte plus N fois, et les workers ne se
+  disputent plus la création des tables ;
+- chaque worker est remplacé après WEB_MAX_REQUESTS requêtes (plus un
+  décalage aléatoire WEB_MAX_REQUESTS_JITTER, pour ne pas les recycler tous
+  en même temps) : la mémoire d'un worker reste bornée ;
+- SIGTERM : le maître cesse d'accepter des connexions et laisse
+  WEB_GRACEFUL_TIMEOUT secondes aux requêtes en cours ; les flux SSE du
+  tableau de bord sont fermés tout de suite (les navigateurs se
+  reconnectent). SIGHUP remplace les workers un à un (nouveau code) ;
+- avec plusieurs workers, les événements du tableau de bord passent par la
+  base (LIVE_SHARED=1, voir live.py) : chaque tableau de bord reçoit toutes
+  les écritures, quel que soit le worker qui les a traitées ;
+- les tâches périodiques (jobs.py) tournent dans un processus à part, et non
+  dans chaque worker (WEB_JOBS=0 pour ne pas le lancer).
+
+Gunicorn (Linux, macOS) pilote des workers uvicorn. Sans gunicorn (Windows),
+le script se rabat sur `uvicorn --workers` : mêmes workers, recyclage et
+arrêt progressif, mais chaque worker recharge l'application (pas de fork) ;
+seules les tables et index sont créés au préalable, une fois.
+"""
+import argparse
+import gc
+import os
+import signal
+import subprocess
+import sys
+import threading
+
+try:
+    from gunicorn.app.base import BaseApplication
+    from gunicorn.arbiter import Arbiter
+    from uvicorn.server import Server
+    from uvicorn.workers import UvicornWorker
+    AVAILABLE = True
+except ImportError:
+    AVAILABLE = False
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+WORKERS = int(os.environ.get("WEB_WORKERS", "0")) or os.cpu_count() or 1
+BIND = os.environ.get("WEB_BIND", "0.0.0.0:8000")
+MAX_REQUESTS = int(os.environ.get("WEB_MAX_REQUESTS", "2000"))
+MAX_REQUESTS_JITTER = int(os.environ.get("WEB_MAX_REQUESTS_JITTER", "200"))
+GRACEFUL_TIMEOUT = int(os.environ.get("WEB_GRACEFUL_TIMEOUT", "30"))
+TIMEOUT = int(os.environ.get("WEB_TIMEOUT", "120"))
+KEEPALIVE = int(os.environ.get("WEB_KEEPALIVE", "5"))
+JOBS = os.environ.get("WEB_JOBS", "1") != "0"
+
+
+def preload():
+    """Charge l'application et les données de référence (avant le fork)"""
+    import main
+    import lookup
+    import refcache
+    import database
+
+    refcache.get()
+    for kind in lookup.LOADERS:
+        lookup.get_index(kind)
+    # Aucune connexion ouverte ne doit être héritée par les workers
+    for _, engine in database.all_engines():
+        engine.dispose()
+    # Objets chargés jusqu'ici : hors du ramasse-miettes, les pages mémoire
+    # restent partagées entre maître et workers (copy-on-write)
+    gc.freeze()
+    return main.app
+
+
+# ============================================
+# 1. TÂCHES PÉRIODIQUES (processus dédié)
+# ============================================
+def start_jobs():
+    env = dict(os.environ, JOBS_ENABLED="1")
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), "--jobs"], env=env, cwd=BASE_DIR)
+
+
+def stop_jobs(proc):
+    if proc is None or proc.poll() is not None:
+        return
+    proc.terminate()
+    try:
+        proc.wait(timeout=GRACEFUL_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def run_jobs():
+    """Exécute les tâches périodiques jusqu'à SIGTERM / Ctrl+C"""
+    import main  # enregistre les tâches des modules
+    import jobs
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    jobs.start()
+    print(f"⏱️ Processus des tâches périodiques démarré (pid {os.getpid()})")
+    try:
+        while not stopping.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    jobs.stop()
+
+
+# ============================================
+# 2. GUNICORN + WORKERS UVICORN
+# ============================================
+if AVAILABLE:
+    class DrainingServer(Server):
+        async def shutdown(self, sockets=None):
+            # Arrêt ou recyclage : les flux SSE ne finiraient jamais d'eux-mêmes
+            import live
+            live.broker.close()
+            await super().shutdown(sockets=sockets)
+
+    class Worker(UvicornWorker):
+        """Worker uvicorn : délai d'arrêt borné et fermeture des flux SSE"""
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            # Les requêtes encore en cours sont annulées juste avant le SIGKILL du maître
+            self.config.timeout_graceful_shutdown = max(self.cfg.graceful_timeout - 1, 1)
+
+        async def _serve(self):
+            self.config.app = self.wsgi
+            server = DrainingServer(config=self.config)
+            self._install_sigquit_handler()
+            await server.serve(sockets=self.sockets)
+            if not server.started:
+                sys.exit(Arbiter.WORKER_BOOT_ERROR)
+
+    class Application(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            self.jobs = None
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return preload()
+
+    def when_ready(server):
+        app = server.app
+        if JOBS:
+            app.jobs = start_jobs()
+        print(f"✅ {server.num_workers} workers prêts sur {server.cfg.bind[0]}")
+
+    def post_fork(server, worker):
+        import database
+        for _, engine in database.all_engines():
+            engine.dispose(close=False)
+
+    def on_exit(server):
+        stop_jobs(server.app.jobs)
+
+
+def run_gunicorn(bind, workers):
+    Application({
+        "bind": bind,
+        "workers": workers,
+        "worker_class": Worker,
+        "preload_app": True,
+        "max_requests": MAX_REQUESTS,
+        "max_requests_jitter": MAX_REQUESTS_JITTER,
+        "graceful_timeout": GRACEFUL_TIMEOUT,
+        "timeout": TIMEOUT,
+        "keepalive": KEEPALIVE,
+        "when_ready": when_ready,
+        "post_fork": post_fork,
+        "on_exit": on_exit,
+        "accesslog": os.environ.get("WEB_ACCESS_LOG"),
+    }).run()
+
+
+# ============================================
+# 3. SANS GUNICORN (uvicorn --workers)
+# ============================================
+def run_uvicorn(bind, workers):
+    import uvicorn
+    import main  # tables et index créés une fois, avant que les workers ne démarrent ensemble
+
+    host, _, port = bind.rpartition(":")
+    proc = start_jobs() if JOBS else None
+    try:
+        uvicorn.run(
+            "main:app",
+            host=host or "0.0.0.0",
+            port=int(port),
+            workers=workers,
+            limit_max_requests=MAX_REQUESTS or None,
+            timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+            timeout_keep_alive=KEEPALIVE,
+            access_log=bool(os.environ.get("WEB_ACCESS_LOG")),
+        )
+    finally:
+        stop_jobs(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serveur de production AgriSuivi")
+    parser.add_argument("--bind", default=BIND, help="adresse:port")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--jobs", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.jobs:
+        run_jobs()
+        return
+    # Les workers ne portent pas les tâches périodiques (voir start_jobs)
+    os.environ["JOBS_ENABLED"] = "0"
+    # Événements du tableau de bord diffusés d'un worker à l'autre (avant le chargement de main)
+    if args.workers > 1:
+        os.environ.setdefault("LIVE_SHARED", "1")
+    if AVAILABLE:
+        run_gunicorn(args.bind, args.workers)
+    else:
+        print("⚠️  gunicorn N'EST PAS installé - uvicorn --workers (sans préchargement)")
+        run_uvicorn(args.bind, args.workers)
+
+
+if __name__ == "__main__":
+    main()
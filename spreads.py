@@ -0,0 +1,304 @@
+# spreads.py
+"""
+Écarts de prix entre marchés (Dantokpa, Arzèkè, Parakou...) par produit.
+
+- latest_prices : dernier prix connu par produit × zone, obtenu avec
+  ROW_NUMBER() OVER (PARTITION BY produit, zone ORDER BY date DESC) et
+  recalculé à chaque écriture pour les seules séries touchées ;
+- price_spreads : par produit et par département (et au niveau national),
+  prix minimum, maximum et médian des derniers prix, avec les zones
+  correspondantes, calculés eux aussi par fonctions de fenêtre.
+
+La lecture ne fait qu'un parcours de clé primaire sur ces deux tables ;
+la matrice des écarts deux à deux est calculée à la demande (NumPy) pour
+les zones choisies. Le tableau des derniers prix (/prices/latest) lit
+latest_prices filtré par département et catégorie, sans agrégation.
+"""
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import delete, func, insert, literal, select, tuple_
+
+import hooks
+import models
+import outliers
+import refcache
+from price_index import NATIONAL
+from rollups import BATCH_THRESHOLD, price_keys
+
+MATRIX_MAX_ZONES = 50
+
+
+# ============================================
+# 1. DERNIER PRIX PAR PRODUIT × ZONE
+# ============================================
+def _latest_query(condition=None):
+    price = models.Price
+    ranked = select(
+        price.product_id,
+        price.zone_id,
+        price.id,
+        price.price,
+        price.date,
+        func.row_number().over(
+            partition_by=(price.product_id, price.zone_id),
+            order_by=(price.date.desc(), price.id.desc()),
+        ).label("rank"),
+    ).where(
+        price.product_id.isnot(None),  # produit ou zone supprimés : prix sans série
+        price.zone_id.isnot(None),
+        price.id.notin_(outliers.quarantined_ids()),
+    )
+    if condition is not None:
+        ranked = ranked.where(condition)
+    ranked = ranked.subquery()
+    return select(
+        ranked.c.product_id, ranked.c.zone_id, ranked.c.id, ranked.c.price, ranked.c.date
+    ).where(ranked.c.rank == 1)
+
+
+def _latest_rows(result, keys=None):
+    now = datetime.now()
+    return [
+        {"product_id": p, "zone_id": z, "price_id": price_id, "price": value, "date": day, "updated_at": now}
+        for p, z, price_id, value, day in result
+        if keys is None or (p, z) in keys
+    ]
+
+
+def refresh_latest(connection, keys):
+    """Recalcule latest_prices pour les séries (product_id, zone_id) données"""
+    keys = {(p, z) for p, z in keys if p is not None and z is not None}
+    if not keys:
+        return
+    price = models.Price
+    table = models.LatestPrice
+    if len(keys) <= BATCH_THRESHOLD:
+        condition = tuple_(price.product_id, price.zone_id).in_(list(keys))
+    else:
+        condition = price.product_id.in_({p for p, _ in keys})
+    rows = _latest_rows(connection.execute(_latest_query(condition)), keys)
+    hooks.replace_rows(connection, table, keys, rows)
+
+
+# ============================================
+# 2. ÉCARTS PAR DÉPARTEMENT
+# ============================================
+def _ranked_query(scope, products):
+    latest = models.LatestPrice
+    partition = (latest.product_id,) if scope is None else (latest.product_id, scope)
+    ranked = select(
+        latest.product_id,
+        (literal(NATIONAL) if scope is None else scope).label("scope"),
+        latest.zone_id,
+        latest.price,
+        func.row_number().over(partition_by=partition, order_by=(latest.price, latest.zone_id)).label("rank"),
+        func.count().over(partition_by=partition).label("n"),
+    ).join(models.Zone, models.Zone.id == latest.zone_id)
+    if products is not None:
+        ranked = ranked.where(latest.product_id.in_(products))
+    ranked = ranked.subquery()
+    # Seuls le premier, le dernier et le(s) rang(s) médian(s) sont utiles
+    c = ranked.c
+    return select(c.product_id, c.scope, c.zone_id, c.price, c.rank, c.n).where(
+        (c.rank == 1) | (c.rank == c.n) | (c.rank == (c.n + 1) // 2) | (c.rank == (c.n + 2) // 2)
+    )
+
+
+def _spread_rows(connection, products):
+    stats = {}
+    for scope in (models.Zone.department, None):
+        for product_id, scope_name, zone_id, value, rank, n in connection.execute(_ranked_query(scope, products)):
+            entry = stats.setdefault((product_id, scope_name), {"zones_count": n, "medians": []})
+            if rank == 1:
+                entry["min_price"], entry["min_zone_id"] = value, zone_id
+            if rank == n:
+                entry["max_price"], entry["max_zone_id"] = value, zone_id
+            if rank in ((n + 1) // 2, (n + 2) // 2):
+                entry["medians"].append(value)
+    now = datetime.now()
+    return [
+        {
+            "product_id": product_id,
+            "scope": scope,
+            "zones_count": entry["zones_count"],
+            "min_price": entry["min_price"],
+            "min_zone_id": entry["min_zone_id"],
+            "max_price": entry["max_price"],
+            "max_zone_id": entry["max_zone_id"],
+            "median_price": sum(entry["medians"]) / len(entry["medians"]),
+            "updated_at": now,
+        }
+        for (product_id, scope), entry in stats.items() if scope is not None
+    ]
+
+
+def refresh_spreads(connection, products):
+    """Recalcule price_spreads pour les produits donnés"""
+    products = {p for p in products if p is not None}
+    if not products:
+        return
+    spread = models.PriceSpread
+    keys = connection.execute(select(spread.product_id, spread.scope).where(spread.product_id.in_(products))).all()
+    hooks.replace_rows(connection, spread, keys, _spread_rows(connection, products))
+
+
+def rebuild(connection):
+    """Reconstruit latest_prices et price_spreads à partir de prices"""
+    connection.execute(delete(models.LatestPrice))
+    rows = _latest_rows(connection.execute(_latest_query()))
+    if rows:
+        connection.execute(insert(models.LatestPrice), rows)
+    connection.execute(delete(models.PriceSpread))
+    spreads = _spread_rows(connection, None)
+    if spreads:
+        connection.execute(insert(models.PriceSpread), spreads)
+    return len(rows)
+
+
+def ensure_built(engine):
+    """Construit latest_prices au démarrage s'il est vide alors que des prix existent"""
+    with engine.begin() as conn:
+        has_latest = conn.execute(select(models.LatestPrice.product_id).limit(1)).first()
+        has_prices = conn.execute(select(models.Price.id).limit(1)).first()
+        if has_prices and not has_latest:
+            count = rebuild(conn)
+            print(f"✅ Derniers prix par marché construits ({count} lignes)")
+
+
+# ============================================
+# 3. LECTURE
+# ============================================
+def _stats_dict(row):
+    return {
+        "scope": row.scope,
+        "zones_count": row.zones_count,
+        "min_price": row.min_price,
+        "min_zone_id": row.min_zone_id,
+        "max_price": row.max_price,
+        "max_zone_id": row.max_zone_id,
+        "median_price": row.median_price,
+        "spread": row.max_price - row.min_price,
+        "spread_pct": round((row.max_price / row.min_price - 1) * 100, 2) if row.min_price else None,
+    }
+
+
+def spread_matrix(db, product_id, department=None, zone_ids=None):
+    """Derniers prix par zone, statistiques par département et écarts deux à deux.
+
+    differences[i][j] = prix en zone j - prix en zone i (marge en achetant en i
+    pour revendre en j), pour au plus MATRIX_MAX_ZONES zones demandées.
+    """
+    latest = models.LatestPrice
+    query = select(latest.zone_id, models.Zone.name, models.Zone.department, latest.price, latest.date)\
+        .join(models.Zone, models.Zone.id == latest.zone_id)\
+        .where(latest.product_id == product_id)\
+        .order_by(latest.price, latest.zone_id)
+    if department:
+        query = query.where(models.Zone.department == department)
+    zones = [
+        {"zone_id": zone_id, "zone_name": name, "department": dept, "price": value,
+         "date": day.isoformat() if day else None}
+        for zone_id, name, dept, value, day in db.execute(query)
+    ]
+
+    stats = db.execute(
+        select(models.PriceSpread).where(models.PriceSpread.product_id == product_id)
+    ).scalars().all()
+    result = {
+        "product_id": product_id,
+        "zones": zones,
+        "national": next((_stats_dict(s) for s in stats if s.scope == NATIONAL), None),
+        "departments": [
+            _stats_dict(s) for s in sorted(stats, key=lambda s: s.scope)
+            if s.scope != NATIONAL and (not department or s.scope == department)
+        ],
+    }
+
+    if zone_ids:
+        by_id = {z["zone_id"]: z["price"] for z in zones}
+        selected = [z for z in zone_ids if z in by_id][:MATRIX_MAX_ZONES]
+        values = np.array([by_id[z] for z in selected], dtype=np.float64)
+        result["matrix"] = {
+            "zone_ids": selected,
+            "differences": np.round(values[None, :] - values[:, None], 2).tolist(),
+        }
+    return result
+
+
+def latest_board(db, department=None, category=None):
+    """Dernier prix de chaque produit sur chaque marché, groupé par produit.
+
+    Les filtres sont résolus sur les données de référence en cache (refcache) :
+    la requête ne lit que latest_prices et price_spreads.
+    """
+    refs = refcache.get()
+    latest = models.LatestPrice
+    query = select(latest.product_id, latest.zone_id, latest.price, latest.date)\
+        .order_by(latest.product_id, latest.price)
+    if category:
+        query = query.where(latest.product_id.in_([p.id for p in refs.products.values() if p.category == category]))
+    if department:
+        query = query.where(latest.zone_id.in_([z.id for z in refs.zones.values() if z.department == department]))
+
+    by_product = {}
+    for product_id, zone_id, value, day in db.execute(query):
+        zone = refs.zone(zone_id)
+        by_product.setdefault(product_id, []).append({
+            "zone_id": zone_id,
+            "zone_name": zone.name if zone else "?",
+            "department": zone.department if zone else None,
+            "price": value,
+            "date": day,
+        })
+    if not by_product:
+        return []
+
+    spread = models.PriceSpread
+    stats = {
+        row.product_id: row for row in db.execute(
+            select(spread).where(spread.scope == (department or NATIONAL), spread.product_id.in_(list(by_product)))
+        ).scalars()
+    }
+    board = []
+    for product in refs.products_by_name:
+        zones = by_product.get(product.id)
+        if not zones:
+            continue
+        board.append({
+            "product_id": product.id,
+            "product_name": product.name,
+            "category": product.category,
+            "unit": product.unit,
+            "zones": zones,
+            "stats": _stats_dict(stats[product.id]) if product.id in stats else None,
+        })
+    return board
+
+
+# ============================================
+# 4. MISE À JOUR À L'ÉCRITURE
+# ============================================
+@hooks.on_flush(models.Price)
+def refresh_latest_prices(session, changes):
+    keys = {(p, z) for p, z, _ in price_keys(changes)}
+    connection = session.connection()
+    refresh_latest(connection, keys)
+    refresh_spreads(connection, {p for p, _ in keys})
+
+
+@hooks.on_flush(models.Zone)
+def refresh_zone_spreads(session, changes):
+    # Un changement de département ou une suppression de zone modifie les écarts
+    moved = [z.id for z in changes.updated if hooks.old_value(z, "department") != z.department]
+    removed = [z.id for z in changes.deleted]
+    if not moved and not removed:
+        return
+    connection = session.connection()
+    latest = models.LatestPrice
+    products = set(connection.execute(
+        select(latest.product_id).where(latest.zone_id.in_(moved + removed)).distinct()
+    ).scalars())
+    if removed:
+        connection.execute(delete(latest).where(latest.zone_id.in_(removed)))
+    refresh_spreads(connection, products)
@@ -0,0 +1,75 @@
+// Saisie assistée des produits et des zones (/api/lookup/...)
+// Le champ texte interroge l'API pendant la frappe ; le choix remplit le champ caché (identifiant).
+document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('[data-typeahead]').forEach(function(container) {
+        const endpoint = container.dataset.typeahead;
+        const input = container.querySelector('input[type="text"]');
+        const hidden = container.querySelector('input[type="hidden"]');
+        const menu = container.querySelector('.dropdown-menu');
+        let timer = null;
+        let active = -1;
+        let controller = null;
+
+        function choose(item) {
+            input.value = item.label;
+            hidden.value = item.id;
+            hidden.dispatchEvent(new Event('change'));
+            menu.classList.remove('show');
+        }
+
+        function render(items) {
+            menu.innerHTML = '';
+            active = -1;
+            if (!items.length) {
+                menu.innerHTML = '<span class="dropdown-item-text text-muted">Aucun résultat</span>';
+            }
+            items.forEach(function(item) {
+                const link = document.createElement('a');
+                link.href = '#';
+                link.className = 'dropdown-item';
+                link.textContent = item.label;
+                link.addEventListener('mousedown', function(e) {
+                    e.preventDefault();
+                    choose(item);
+                });
+                link.item = item;
+                menu.appendChild(link);
+            });
+            menu.classList.add('show');
+        }
+
+        function fetchItems() {
+            if (controller) controller.abort();
+            controller = new AbortController();
+            fetch(endpoint + '?limit=10&q=' + encodeURIComponent(input.value), {signal: controller.signal})
+                .then(response => response.json())
+                .then(data => render(Array.isArray(data) ? data : []))
+                .catch(() => {});
+        }
+
+        input.addEventListener('input', function() {
+            // Texte modifié : l'identifiant choisi n'est plus valable
+            hidden.value = '';
+            clearTimeout(timer);
+            timer = setTimeout(fetchItems, 150);
+        });
+        input.addEventListener('focus', fetchItems);
+        input.addEventListener('blur', function() {
+            menu.classList.remove('show');
+        });
+        input.addEventListener('keydown', function(e) {
+            const links = menu.querySelectorAll('.dropdown-item');
+            if (e.key === 'ArrowDown' || e.key === 'ArrowUp') {
+                e.preventDefault();
+                if (!links.length) return;
+                active = (active + (e.key === 'ArrowDown' ? 1 : -1) + links.length) % links.length;
+                links.forEach((link, i) => link.classList.toggle('active', i === active));
+            } else if (e.key === 'Enter' && menu.classList.contains('show') && links.length) {
+                e.preventDefault();
+                choose(links[Math.max(active, 0)].item);
+            } else if (e.key === 'Escape') {
+                menu.classList.remove('show');
+            }
+        });
+    });
+});
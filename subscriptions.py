@@ -0,0 +1,277 @@
+# subscriptions.py
+"""
+Abonnements aux seuils de prix (« prévenez-moi quand le maïs dépasse
+400 FCFA à Dantokpa »).
+
+Un abonnement vise un produit et, au choix, une zone, un département ou tout
+le pays ; il se déclenche quand le dernier prix de la série franchit le seuil
+dans le sens demandé (above : passe au-dessus, below : passe en dessous).
+
+Les abonnements actifs sont gardés en mémoire, indexés par
+(produit, zone | département | tout le pays), avec pour chaque clé et chaque
+sens une liste de seuils triée. Un nouveau prix ne consulte que trois clés,
+et les seuils franchis entre l'ancien et le nouveau prix sont trouvés par
+recherche dichotomique (bisect) : le coût ne dépend pas du nombre total
+d'abonnements (100 000 et plus).
+
+Toute écriture d'un abonnement incrémente sa version (table cache_versions),
+dans la même transaction. À chaque écriture de prix, cette version est relue
+(une ligne) : si l'index en mémoire est plus ancien, seuls les abonnements des
+produits touchés sont lus en base, et l'index complet est rechargé dans un
+fil d'arrière-plan. Un abonnement créé ou supprimé, sur n'importe quel worker,
+s'applique dès l'écriture de prix suivante, sans qu'elle paie le rechargement.
+"""
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+
+import alerts
+import hooks
+import models
+
+ABOVE = "above"
+BELOW = "below"
+DIRECTIONS = (ABOVE, BELOW)
+VERSION = "price_subscriptions"  # ligne de cache_versions
+
+ALL = "*"  # portée « tout le pays » dans les clés de l'index
+
+
+def scope_key(product_id, zone_id=None, department=None):
+    if zone_id is not None:
+        return (product_id, "zone", zone_id)
+    if department:
+        return (product_id, "department", department)
+    return (product_id, ALL, None)
+
+
+class Thresholds:
+    """Seuils triés d'un sens pour une clé, avec les abonnements correspondants"""
+
+    __slots__ = ("values", "entries")
+
+    def __init__(self):
+        self.values = []
+        self.entries = []  # (id, user_id), dans l'ordre de `values`
+
+    def add(self, threshold, entry):
+        position = bisect_right(self.values, threshold)
+        self.values.insert(position, threshold)
+        self.entries.insert(position, entry)
+
+    def remove(self, subscription_id):
+        for position, (sid, _) in enumerate(self.entries):
+            if sid == subscription_id:
+                del self.values[position]
+                del self.entries[position]
+                return True
+        return False
+
+    def crossed(self, direction, before, after):
+        """Abonnements dont le seuil est franchi en passant de `before` à `after`
+        (`before` None : premier prix connu, tout seuil déjà dépassé compte)"""
+        values = self.values
+        if direction == ABOVE:
+            # before < seuil <= after
+            start = 0 if before is None else bisect_right(values, before)
+            end = bisect_right(values, after)
+        else:
+            # after <= seuil < before
+            start = bisect_left(values, after)
+            end = len(values) if before is None else bisect_left(values, before)
+        return [(values[i], *self.entries[i]) for i in range(start, end)]
+
+
+class SubscriptionIndex:
+    """Abonnements actifs : {(produit, portée, valeur): {sens: Thresholds}}"""
+
+    def __init__(self, version=0):
+        self.version = version  # version des abonnements lus (cache_versions)
+        self.keys = {}
+        self.locations = {}  # id -> (clé, sens)
+        self.products = set()
+
+    def __len__(self):
+        return len(self.locations)
+
+    def add(self, subscription_id, user_id, product_id, zone_id, department, direction, threshold):
+        if direction not in DIRECTIONS or threshold is None or product_id is None:
+            return
+        self.remove(subscription_id)
+        key = scope_key(product_id, zone_id, department)
+        by_direction = self.keys.setdefault(key, {})
+        by_direction.setdefault(direction, Thresholds()).add(threshold, (subscription_id, user_id))
+        self.locations[subscription_id] = (key, direction)
+        self.products.add(product_id)
+
+    def remove(self, subscription_id):
+        location = self.locations.pop(subscription_id, None)
+        if location is None:
+            return
+        key, direction = location
+        self.keys[key][direction].remove(subscription_id)
+
+    def match(self, product_id, zone_id, department, before, after):
+        """[(seuil, sens, id, user_id)] des abonnements franchis par un prix"""
+        if before is None:
+            directions = DIRECTIONS
+        elif after > before:
+            directions = (ABOVE,)
+        elif after < before:
+            directions = (BELOW,)
+        else:
+            return []
+        keys = [scope_key(product_id, zone_id), scope_key(product_id)]
+        if department:
+            keys.append(scope_key(product_id, department=department))
+        matches = []
+        for key in keys:
+            by_direction = self.keys.get(key)
+            if not by_direction:
+                continue
+            for direction in directions:
+                thresholds = by_direction.get(direction)
+                if thresholds:
+                    matches.extend(
+                        (threshold, direction, sid, user_id)
+                        for threshold, sid, user_id in thresholds.crossed(direction, before, after)
+                    )
+        return matches
+
+
+_lock = threading.Lock()
+_state = {"index": None, "loading": False}
+
+
+def current_version(connection):
+    table = models.CacheVersion
+    return connection.execute(select(table.version).where(table.name == VERSION)).scalar() or 0
+
+
+def load_index(connection, product_ids=None):
+    """Construit l'index à partir des abonnements actifs (de ces produits seulement
+    si product_ids est donné), un seul tri par liste"""
+    version = current_version(connection)
+    table = models.PriceSubscription
+    query = select(table.id, table.user_id, table.product_id, table.zone_id, table.department,
+                   table.direction, table.threshold)\
+        .where(table.is_active.is_(True), table.threshold.isnot(None))\
+        .order_by(table.threshold)
+    if product_ids is not None:
+        query = query.where(table.product_id.in_(product_ids))
+    index = SubscriptionIndex(version)
+    for row in connection.execute(query):
+        # Seuils lus dans l'ordre croissant : chaque insertion se fait en fin de liste
+        index.add(*row)
+    return index
+
+
+def _reload(engine):
+    try:
+        with engine.connect() as connection:
+            index = load_index(connection)
+        current = _state["index"]
+        if current is None or index.version >= current.version:
+            _state["index"] = index
+    except Exception as e:
+        print(f"⚠️ Rechargement des abonnements impossible : {e}")
+    finally:
+        _state["loading"] = False
+
+
+def get_index(connection, product_ids):
+    """Index à jour pour ces produits : l'index en mémoire s'il a la version de la
+    base, sinon les abonnements de ces produits (l'index complet est rechargé en
+    arrière-plan)"""
+    version = current_version(connection)
+    index = _state["index"]
+    if index is not None and index.version == version:
+        return index
+    with _lock:
+        start = not _state["loading"]
+        _state["loading"] = True
+    if start:
+        threading.Thread(target=_reload, args=(connection.engine,), name="subscriptions", daemon=True).start()
+    return load_index(connection, product_ids)
+
+
+# ============================================
+# 1. ÉVALUATION À L'ÉCRITURE
+# ============================================
+def _previous_prices(connection, keys):
+    """{(produit, zone): (prix, date)} depuis latest_prices, avant sa mise à jour"""
+    table = models.LatestPrice
+    rows = connection.execute(
+        select(table.product_id, table.zone_id, table.price, table.date)
+        .where(tuple_(table.product_id, table.zone_id).in_(list(keys)))
+    )
+    return {(p, z): (value, day) for p, z, value, day in rows}
+
+
+@hooks.on_flush(models.Price, priority=90)
+def match_price_subscriptions(session, changes):
+    # Avant spreads (priorité 100) : latest_prices contient encore le prix précédent ;
+    # après outliers (priorité 50) : les prix en quarantaine sont ignorés
+    connection = session.connection()
+    index = get_index(connection, {p.product_id for p in changes.inserted if p.product_id})
+    if not len(index):
+        return
+    quarantined = {o["price_id"] for o in session.info.get("price_outliers", [])}
+    prices = sorted(
+        (p for p in changes.inserted
+         if p.product_id in index.products and p.zone_id and p.price and p.date and p.id not in quarantined),
+        key=lambda p: (p.date, p.id),
+    )
+    if not prices:
+        return
+
+    keys = {(p.product_id, p.zone_id) for p in prices}
+    previous = _previous_prices(connection, keys)
+    products, zones = alerts.names(connection, {p for p, _ in keys}, {z for _, z in keys})
+
+    now = datetime.now()
+    rows = []
+    for price in prices:
+        key = (price.product_id, price.zone_id)
+        before, day = previous.get(key, (None, None))
+        if day is not None and price.date < day:
+            continue  # saisie d'un prix ancien : le dernier prix ne change pas
+        previous[key] = (price.price, price.date)
+        zone_name, department = zones.get(price.zone_id, ("?", None))
+        for threshold, direction, subscription_id, user_id in index.match(
+            price.product_id, price.zone_id, department, before, price.price
+        ):
+            product_name = products.get(price.product_id, ("?", ""))[0]
+            label = "au-dessus" if direction == ABOVE else "en dessous"
+            rows.append({
+                "user_id": user_id, "rule_id": None, "type": "warning" if direction == ABOVE else "info",
+                "message": f"{product_name} à {zone_name} : {price.price:.0f} FCFA, "
+                           f"{label} de votre seuil de {threshold:.0f} FCFA"[:300],
+                "product_id": price.product_id, "zone_id": price.zone_id, "created_at": now,
+            })
+    alerts.save_notifications(session, rows)
+
+
+@hooks.on_flush(models.PriceSubscription)
+def bump_version(session, changes):
+    # Dans la transaction de l'abonnement : validée (ou annulée) avec lui
+    table = models.CacheVersion.__table__
+    connection = session.connection()
+    insert = (postgresql if connection.dialect.name == "postgresql" else sqlite).insert(table)
+    connection.execute(insert.values(name=VERSION, version=1).on_conflict_do_update(
+        index_elements=[table.c.name],
+        set_={"version": table.c.version + 1},
+    ))
+
+
+# ============================================
+# 2. CONSULTATION
+# ============================================
+def list_subscriptions(db, user_id):
+    table = models.PriceSubscription
+    return db.execute(
+        select(table).where(table.user_id == user_id).order_by(table.id)
+    ).scalars().all()
@@ -0,0 +1,211 @@
+# upsert.py
+"""
+Écriture idempotente des relevés (prix, stocks) : clé naturelle (NATURAL_KEY=1).
+
+Un formulaire validé deux fois ou un envoi relancé créait des relevés en
+double pour un même produit, une même zone et un même instant, qui gonflaient
+tous les agrégats. Avec NATURAL_KEY=1 :
+
+- la date d'un relevé est arrondie à la minute, et un index unique porte sur
+  (product_id, zone_id, date). Sous PostgreSQL partitionné, la date est la
+  clé de partitionnement : l'index est valide sur la table mère. Sous SQLite
+  partitionné, chaque table annuelle a le sien (une date n'appartient qu'à
+  une année) ;
+- add_stock, add_price et save() pour des lots écrivent avec
+  INSERT ... ON CONFLICT (product_id, zone_id, date) DO UPDATE : la base
+  tranche en une instruction, sans vérification préalable ni course entre
+  deux workers qui reçoivent le même envoi ;
+- les crochets (hooks.py) reçoivent les lignes réellement insérées ou
+  modifiées, comme après un flush ORM : un envoi répété ne compte qu'une
+  fois dans les agrégats, les statistiques, les alertes et le tableau de bord.
+
+Sans NATURAL_KEY, save() ajoute simplement les objets à la session. Au
+démarrage, les doublons exacts déjà présents sont supprimés (la ligne la
+plus récente est gardée) avant la création de l'index.
+"""
+import os
+from datetime import datetime
+
+from sqlalchemy import Index, and_, delete, func, literal_column, select, text, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+import hooks
+import models
+import partitions
+
+ENABLED = os.environ.get("NATURAL_KEY", "0") == "1"
+MODELS = (models.Price, models.Stock)
+KEY = ("product_id", "zone_id", "date")
+BATCH = 500  # lignes par instruction
+CONFLICT_MESSAGE = "Un relevé existe déjà pour ce produit, cette zone et cette date (à la minute près)"
+
+if ENABLED:
+    # Déclaré avant create_all et partitions.ensure_built, qui le créent (tables et partitions)
+    for _model in MODELS:
+        Index(f"ux_{_model.__tablename__}_natural_key", *(_model.__table__.c[c] for c in KEY), unique=True)
+
+
+def minute(moment):
+    """Date d'un relevé arrondie à la minute (granularité de la clé naturelle)"""
+    return moment.replace(second=0, microsecond=0)
+
+
+# ============================================
+# 1. ÉCRITURE
+# ============================================
+def _normalize(model, rows):
+    """Lignes complètes, date arrondie, une seule par clé (la dernière l'emporte)"""
+    columns = [c.name for c in model.__table__.columns if c.name != "id"]
+    now = minute(datetime.now())
+    unique = {}
+    for row in rows:
+        row = {c: row.get(c) for c in columns}
+        row["date"] = minute(row["date"]) if row["date"] else now
+        unique[tuple(row[c] for c in KEY)] = row
+    return list(unique.values())
+
+
+def _targets(connection, model, rows):
+    """[(table, lignes)] : la table du modèle, ou les tables annuelles sous SQLite partitionné"""
+    if partitions.layout() != "sqlite" or model.__tablename__ not in partitions.managed_tables():
+        return [(model.__table__, rows)]
+    by_year = {}
+    for row in rows:
+        by_year.setdefault(row["date"].year, []).append(row)
+    targets = {}
+    for year_rows in by_year.values():
+        table = partitions.sqlite_target(connection, model, year_rows[0]["date"])
+        targets.setdefault(table.name, (table, []))[1].extend(year_rows)
+    return list(targets.values())
+
+
+def _detached(model, before, after):
+    """Objet « modifié » pour les crochets : old_value() et l'historique donnent `before`"""
+    obj = model(**before)
+    make_transient_to_detached(obj)
+    for name, value in after.items():
+        setattr(obj, name, value)
+    return obj
+
+
+def _write(session, model, table, rows, changes):
+    dialect = session.get_bind().dialect.name
+    key = tuple_(*(table.c[c] for c in KEY))
+    keys = [tuple(row[c] for c in KEY) for row in rows]
+
+    # Valeurs d'avant écriture des clés déjà présentes (historique transmis aux crochets).
+    # SQLite : une mise à jour sans effet prend tout de suite le verrou d'écriture ;
+    # aucun autre processus ne peut insérer ces clés avant la fin de la transaction.
+    if dialect == "postgresql":
+        existing = select(table).where(key.in_(keys)).with_for_update()
+    else:
+        existing = update(table).where(key.in_(keys)).values(id=table.c.id).returning(*table.c)
+    before = {row["id"]: dict(row) for row in session.execute(existing).mappings()}
+
+    if table is not model.__table__:
+        # Table annuelle (SQLite partitionné) : identifiants réservés comme pour la vue
+        first = partitions.allocate_ids(session.connection(), model, len(rows))
+        rows = [dict(row, id=first + i) for i, row in enumerate(rows)]
+
+    insert = (postgresql if dialect == "postgresql" else sqlite).insert(table).values(rows)
+    statement = insert.on_conflict_do_update(
+        index_elements=[table.c[c] for c in KEY],
+        set_={c.name: insert.excluded[c.name] for c in table.columns if c.name not in KEY and c.name != "id"},
+    )
+    returning = list(table.columns)
+    if dialect == "postgresql":
+        returning.append(literal_column("xmax = 0").label("inserted"))  # ligne neuve (pas de mise à jour)
+
+    for row in session.execute(statement.returning(*returning)).mappings():
+        row = dict(row)
+        inserted = row.pop("inserted", None)
+        if row["id"] in before:
+            changes.updated.append(_detached(model, before[row["id"]], row))
+        elif inserted is False:
+            # Clé insérée entre-temps par une autre transaction : valeurs d'avant inconnues
+            changes.updated.append(_detached(model, row, row))
+        else:
+            changes.inserted.append(model(**row))
+
+
+def save(session, model, rows):
+    """Écrit des relevés (dicts de colonnes) ; renvoie les changements (hooks.Changes).
+
+    Avec NATURAL_KEY, un relevé dont la clé existe déjà met à jour la ligne
+    existante au lieu d'en créer une autre. La transaction reste à valider.
+    """
+    changes = hooks.Changes()
+    if not ENABLED:
+        objects = [model(**row) for row in rows]
+        session.add_all(objects)
+        session.flush()
+        changes.inserted.extend(objects)
+        return changes
+
+    rows = _normalize(model, rows)
+    for table, table_rows in _targets(session.connection(), model, rows):
+        for offset in range(0, len(table_rows), BATCH):
+            _write(session, model, table, table_rows[offset:offset + BATCH], changes)
+    hooks.dispatch(session, model, changes)
+    return changes
+
+
+# ============================================
+# 2. MISE EN SERVICE
+# ============================================
+def _index_missing(connection, model):
+    table = model.__tablename__
+    if connection.dialect.name == "postgresql":
+        return connection.execute(
+            text("SELECT to_regclass(:name)"), {"name": f"ux_{table}_natural_key"}
+        ).scalar() is None
+    tables = connection.execute(
+        text("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND (name = :table OR name GLOB :years)"),
+        {"table": table, "years": f"{table}_[0-9][0-9][0-9][0-9]"},
+    ).scalar()
+    indexes = connection.execute(
+        text("SELECT count(*) FROM sqlite_master WHERE type = 'index' AND name GLOB :pattern"),
+        {"pattern": f"ux_{table}*_natural_key"},
+    ).scalar()
+    return indexes < tables
+
+
+def deduplicate(session, model):
+    """Supprime les doublons exacts de la clé naturelle (la ligne la plus récente est
+    gardée) ; les crochets mettent à jour les données dérivées. Renvoie le nombre supprimé"""
+    columns = [getattr(model, c) for c in KEY]
+    groups = select(*columns, func.max(model.id).label("keep"))\
+        .where(*(column.isnot(None) for column in columns))\
+        .group_by(*columns)\
+        .having(func.count() > 1)\
+        .subquery()
+    extra = session.execute(
+        select(model).join(groups, and_(
+            *(column == groups.c[c] for c, column in zip(KEY, columns)),
+            model.id != groups.c.keep,
+        ))
+    ).scalars().all()
+    if not extra:
+        return 0
+    ids = [obj.id for obj in extra]
+    for offset in range(0, len(ids), BATCH):
+        session.execute(delete(model.__table__).where(model.__table__.c.id.in_(ids[offset:offset + BATCH])))
+    changes = hooks.Changes()
+    changes.deleted.extend(extra)
+    hooks.dispatch(session, model, changes)
+    return len(extra)
+
+
+def ensure_built(engine):
+    """Supprime les doublons avant la création de l'index unique (si NATURAL_KEY=1)"""
+    if not ENABLED or engine.dialect.name not in ("postgresql", "sqlite"):
+        return
+    with Session(engine) as session:
+        removed = 0
+        for model in MODELS:
+            if _index_missing(session.connection(), model):
+                removed += deduplicate(session, model)
+        session.commit()
+    if removed:
+        print(f"🧹 {removed} relevé(s) en double supprimé(s) (clé naturelle)")